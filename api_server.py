@@ -1,12 +1,19 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import os
-import io
+import json
 import requests
-from PIL import Image
-import tempfile
 import logging
-from nsfw_detector import predict
+import time
+from functools import wraps
+from werkzeug.wsgi import get_input_stream
+from server_common import (
+    ENDPOINTS, API_VERSION, MAX_CONTENT_LENGTH, MAX_DOWNLOAD_BYTES, MAX_STREAM_BYTES, DOWNLOAD_TIMEOUT, DOWNLOAD_CHUNK_SIZE,
+    UPLOAD_CHUNK_SIZE, METRICS_ENABLED, HTTP_IN_FLIGHT, ModelService, CappedBuffer, DownloadTooLarge, MultipartFileStream,
+    allowed_file, check_image_response, iter_stream_batch, multipart_boundary, observe_request, parse_url_list,
+    prediction_error_status, resolve_file_entry, result_from_prediction, timed_download, url_result, wants_ndjson
+)
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,27 +21,49 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-MODEL_PATH = "models/mobilenet_v2_140_224/saved_model.h5"
-model = None
+service = ModelService()
+service.register_metrics()
+http_session = requests.Session()
 
-def initialize_model():
-    global model
-    try:
-        if os.path.exists(MODEL_PATH):
-            model = predict.load_model(MODEL_PATH)
-            logger.info("Model loaded successfully!")
-        else:
-            logger.error(f"Model file not found: {MODEL_PATH}")
-            raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
-    except Exception as e:
-        logger.error(f"Error loading model: {e}")
-        raise
+def start_model_loading():
+    return service.start_loading()
+
+@app.before_request
+def ensure_model_loading():
+    if service.status == "not_loaded":
+        start_model_loading()
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        g.request_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+    
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            method = request.method
+            status = response.status_code
+            
+            # Runs once the body has been sent, so streamed responses are timed in full
+            def finish():
+                HTTP_IN_FLIGHT.dec()
+                observe_request(endpoint, method, status, time.perf_counter() - started)
+            response.call_on_close(finish)
+        return response
 
-initialize_model()
+def require_model(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not service.ready:
+            payload, status_code = service.not_ready()
+            return jsonify(payload), status_code
+        return view(*args, **kwargs)
+    return wrapper
 
 UPLOAD_FOLDER = 'uploads'
-ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
@@ -42,20 +71,16 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 def download_image_from_url(url):
     try:
-        response = requests.get(url, stream=True, timeout=10)
-        response.raise_for_status()
-        
-        content_type = response.headers.get('content-type', '')
-        if not content_type.startswith('image/'):
-            raise ValueError("URL does not point to an image file")
-        
-        image = Image.open(io.BytesIO(response.content))
-        return image
+        with timed_download(), http_session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            check_image_response(response.headers.get('content-type', ''), response.headers.get('content-length'))
+            
+            buffer = CappedBuffer(MAX_DOWNLOAD_BYTES)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                buffer.append(chunk)
+            return buffer.getvalue()
         
     except Exception as e:
         logger.error(f"Error downloading image from URL: {e}")
@@ -65,26 +90,20 @@ def download_image_from_url(url):
 def home():
     return jsonify({
         "message": "NSFW Detector API",
-        "version": "1.0.0",
-        "endpoints": {
-            "POST /predict": "Upload file for NSFW prediction",
-            "POST /predict_url": "Predict NSFW from image URL",
-            "POST /predict_batch": "Batch prediction with multiple files",
-            "GET /health": "Health check"
-        }
+        "version": API_VERSION,
+        "endpoints": ENDPOINTS
     })
 
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
-        if model is None:
-            return jsonify({"status": "error", "message": "Model not loaded"}), 503
-        
-        return jsonify({"status": "healthy", "message": "API is running"})
+        payload, status_code = service.health()
+        return jsonify(payload), status_code
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/predict', methods=['POST'])
+@require_model
 def predict_file():
     try:
         if 'file' not in request.files:
@@ -97,48 +116,21 @@ def predict_file():
         if not allowed_file(file.filename):
             return jsonify({"error": "Unsupported file type"}), 400
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            image = Image.open(file.stream)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            image.save(tmp_file.name, 'JPEG')
-            
-            predictions = predict.classify(model, tmp_file.name)
-            os.unlink(tmp_file.name)
-            
-            filename = os.path.basename(tmp_file.name)
-            if filename in predictions:
-                scores = predictions[filename]
-                if "error" not in scores:
-                    nsfw_score = predict.get_nsfw_score(scores)
-                    is_nsfw = predict.is_nsfw(scores)
-                    
-                    max_class = max(scores, key=scores.get)
-                    max_confidence = scores[max_class]
-                    
-                    result = {
-                        "is_nsfw": is_nsfw,
-                        "nsfw_score": nsfw_score,
-                        "predicted_class": max_class,
-                        "confidence": max_confidence,
-                        "scores": scores
-                    }
-                else:
-                    result = {"error": scores["error"]}
-            else:
-                result = {"error": "Prediction failed"}
-            
-            return jsonify({
-                "success": True,
-                "filename": file.filename,
-                "result": result
-            })
-            
+        future = service.submit(file.read())
+        result = result_from_prediction(future.result())
+        
+        return jsonify({
+            "success": True,
+            "filename": file.filename,
+            "result": result
+        })
+        
     except Exception as e:
         logger.error(f"File prediction error: {e}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), prediction_error_status(e)
 
 @app.route('/predict_url', methods=['POST'])
+@require_model
 def predict_url():
     try:
         data = request.get_json()
@@ -146,50 +138,46 @@ def predict_url():
             return jsonify({"error": "URL required"}), 400
         
         url = data['url']
-        image = download_image_from_url(url)
+        try:
+            image_data = download_image_from_url(url)
+        except DownloadTooLarge as e:
+            return jsonify({"error": str(e)}), 413
+        
+        future = service.submit(image_data)
+        result = result_from_prediction(future.result())
+        
+        return jsonify({
+            "success": True,
+            "url": url,
+            "result": result
+        })
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            image.save(tmp_file.name, 'JPEG')
-            
-            predictions = predict.classify(model, tmp_file.name)
-            os.unlink(tmp_file.name)
-            
-            filename = os.path.basename(tmp_file.name)
-            if filename in predictions:
-                scores = predictions[filename]
-                if "error" not in scores:
-                    nsfw_score = predict.get_nsfw_score(scores)
-                    is_nsfw = predict.is_nsfw(scores)
-                    
-                    max_class = max(scores, key=scores.get)
-                    max_confidence = scores[max_class]
-                    
-                    result = {
-                        "is_nsfw": is_nsfw,
-                        "nsfw_score": nsfw_score,
-                        "predicted_class": max_class,
-                        "confidence": max_confidence,
-                        "scores": scores
-                    }
-                else:
-                    result = {"error": scores["error"]}
-            else:
-                result = {"error": "Prediction failed"}
-            
-            return jsonify({
-                "success": True,
-                "url": url,
-                "result": result
-            })
-            
     except Exception as e:
         logger.error(f"URL prediction error: {e}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": str(e)}), prediction_error_status(e)
+
+@app.route('/predict_urls', methods=['POST'])
+@require_model
+def predict_urls():
+    try:
+        urls = parse_url_list(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    from url_fetcher import iter_url_predictions
+    
+    def generate():
+        for index, url, prediction, error in iter_url_predictions(service.submit, urls):
+            yield json.dumps(url_result(index, url, prediction, error)) + "\n"
+    
+    return Response(generate(), mimetype="application/x-ndjson")
 
 @app.route('/predict_batch', methods=['POST'])
+@require_model
 def predict_batch():
+    if wants_ndjson(request.args.get('stream'), request.headers.get('Accept')):
+        return stream_predict_batch()
+    
     try:
         if 'files' not in request.files:
             return jsonify({"error": "No files found"}), 400
@@ -199,6 +187,7 @@ def predict_batch():
             return jsonify({"error": "No files selected"}), 400
         
         results = []
+        pending = []
         
         for file in files:
             try:
@@ -209,42 +198,11 @@ def predict_batch():
                     })
                     continue
                 
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-                    image = Image.open(file.stream)
-                    if image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    image.save(tmp_file.name, 'JPEG')
-                    
-                    predictions = predict.classify(model, tmp_file.name)
-                    os.unlink(tmp_file.name)
-                    
-                    tmp_filename = os.path.basename(tmp_file.name)
-                    if tmp_filename in predictions:
-                        scores = predictions[tmp_filename]
-                        if "error" not in scores:
-                            nsfw_score = predict.get_nsfw_score(scores)
-                            is_nsfw = predict.is_nsfw(scores)
-                            
-                            max_class = max(scores, key=scores.get)
-                            max_confidence = scores[max_class]
-                            
-                            result = {
-                                "is_nsfw": is_nsfw,
-                                "nsfw_score": nsfw_score,
-                                "predicted_class": max_class,
-                                "confidence": max_confidence,
-                                "scores": scores
-                            }
-                        else:
-                            result = {"error": scores["error"]}
-                    else:
-                        result = {"error": "Prediction failed"}
-                    
-                    results.append({
-                        "filename": file.filename,
-                        "result": result
-                    })
-                    
+                future = service.submit(file.read())
+                entry = {"filename": file.filename}
+                results.append(entry)
+                pending.append((entry, future))
+                
             except Exception as e:
                 logger.error(f"Prediction error for file {file.filename}: {e}")
                 results.append({
@@ -252,6 +210,9 @@ def predict_batch():
                     "error": str(e)
                 })
         
+        for entry, future in pending:
+            resolve_file_entry(entry, future)
+        
         return jsonify({
             "success": True,
             "total_files": len(files),
@@ -262,19 +223,52 @@ def predict_batch():
         logger.error(f"Batch prediction error: {e}")
         return jsonify({"error": str(e)}), 500
 
+def stream_predict_batch():
+    try:
+        boundary = multipart_boundary(request.content_type)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if request.content_length is not None and request.content_length > MAX_STREAM_BYTES:
+        return jsonify({"error": f"Request body too large (maximum {MAX_STREAM_BYTES} bytes)"}), 413
+    
+    # Read the raw body so uploads are parsed part by part instead of buffered by request.files;
+    # the parser enforces MAX_STREAM_BYTES on what actually arrives
+    body = get_input_stream(request.environ, max_content_length=None)
+    parser = MultipartFileStream(boundary)
+    
+    def iter_parts():
+        while True:
+            chunk = body.read(UPLOAD_CHUNK_SIZE) or None
+            yield from parser.feed(chunk)
+            if chunk is None:
+                return
+    
+    def generate():
+        total = 0
+        try:
+            for entry in iter_stream_batch(iter_parts(), service.submit):
+                total += 1
+                yield json.dumps(entry) + "\n"
+            yield json.dumps({"success": True, "total_files": total}) + "\n"
+        except Exception as e:
+            logger.error(f"Batch prediction error: {e}")
+            yield json.dumps({"success": False, "total_files": total, "error": str(e)}) + "\n"
+    
+    return Response(generate(), mimetype="application/x-ndjson")
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     try:
-        return jsonify({
-            "model_path": MODEL_PATH,
-            "classes": ["drawings", "hentai", "neutral", "porn", "sexy"],
-            "input_size": [224, 224],
-            "model_loaded": model is not None,
-            "version": "1.0.0"
-        })
+        return jsonify(service.stats())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.errorhandler(413)
 def file_too_large(e):
     return jsonify({"error": "File too large (maximum 16MB)"}), 413
@@ -293,8 +287,11 @@ if __name__ == '__main__':
     print("  POST /predict - Upload file for prediction")
     print("  POST /predict_url - Predict from image URL")
     print("  POST /predict_batch - Batch prediction")
+    print("  POST /predict_urls - Bulk URL prediction (NDJSON)")
     print("  GET /health - Health check")
     print("  GET /stats - Model statistics")
+    print("  GET /metrics - Prometheus metrics")
     print("  GET / - API information")
     
+    start_model_loading()
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
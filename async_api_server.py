@@ -0,0 +1,406 @@
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from collections import deque
+
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from server_common import (
+    ENDPOINTS, API_VERSION, MAX_CONTENT_LENGTH, DOWNLOAD_TIMEOUT, MAX_STREAM_BYTES, MAX_STREAM_IN_FLIGHT, METRICS_ENABLED,
+    HTTP_IN_FLIGHT, ModelService, DownloadTooLarge, MultipartFileStream, allowed_file, file_result, item_result,
+    multipart_boundary, observe_request, parse_url_list, prediction_error_status, result_from_prediction, url_result,
+    wants_ndjson
+)
+from url_fetcher import URLFetcher, aiter_url_predictions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+
+service = ModelService()
+service.register_metrics()
+http_client = None
+fetcher = None
+
+
+def create_http_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(DOWNLOAD_TIMEOUT),
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+        follow_redirects=True
+    )
+
+
+async def download_image_from_url(url):
+    try:
+        return await fetcher.fetch(url)
+    except Exception as e:
+        logger.error(f"Error downloading image from URL: {e}")
+        raise
+
+
+async def classify(image_data):
+    # prepare() decodes in the caller's thread, so keep it off the event loop
+    future = await run_in_threadpool(service.submit, image_data)
+    return result_from_prediction(await asyncio.wrap_future(future))
+
+
+async def classify_entry(entry, image_data):
+    try:
+        future = await run_in_threadpool(service.submit, image_data)
+        prediction = await asyncio.wrap_future(future)
+    except Exception as e:
+        logger.error(f"Prediction error for file {entry['filename']}: {e}")
+        return item_result(entry, error=e)
+    return item_result(entry, prediction)
+
+
+class RequestStreamingResponse(StreamingResponse):
+    # StreamingResponse polls receive() for disconnects, which would swallow the
+    # request body that this response is still reading
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    def endpoint_label(self, scope):
+        if self._paths is None:
+            self._paths = {route.endpoint: route.path for route in scope["app"].routes}
+        return self._paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            observe_request(self.endpoint_label(scope), scope["method"], status, time.perf_counter() - started)
+
+
+def error_response(message, status_code):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def model_unavailable():
+    if service.ready:
+        return None
+    payload, status_code = service.not_ready()
+    return JSONResponse(payload, status_code=status_code)
+
+
+def body_too_large(request, max_bytes=MAX_CONTENT_LENGTH):
+    content_length = request.headers.get("content-length")
+    return content_length is not None and int(content_length) > max_bytes
+
+
+def capped_request(request, max_bytes=MAX_CONTENT_LENGTH):
+    # body_too_large only sees the header; this counts what actually arrives, including chunked uploads
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise DownloadTooLarge(f"Request body too large (maximum {max_bytes} bytes)")
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def home(request):
+    return JSONResponse({
+        "message": "NSFW Detector API",
+        "version": API_VERSION,
+        "endpoints": ENDPOINTS
+    })
+
+
+async def health_check(request):
+    payload, status_code = service.health()
+    return JSONResponse(payload, status_code=status_code)
+
+
+async def predict_file(request):
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        return unavailable
+    if body_too_large(request):
+        return error_response("File too large (maximum 16MB)", 413)
+
+    try:
+        form = await capped_request(request).form()
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return error_response("No file found", 400)
+        if file.filename == '':
+            return error_response("No file selected", 400)
+        if not allowed_file(file.filename):
+            return error_response("Unsupported file type", 400)
+
+        result = await classify(await file.read())
+
+        return JSONResponse({
+            "success": True,
+            "filename": file.filename,
+            "result": result
+        })
+
+    except DownloadTooLarge:
+        return error_response("File too large (maximum 16MB)", 413)
+    except Exception as e:
+        logger.error(f"File prediction error: {e}")
+        return error_response(str(e), prediction_error_status(e))
+
+
+async def predict_url(request):
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or 'url' not in data:
+            return error_response("URL required", 400)
+
+        url = data['url']
+        try:
+            image_data = await download_image_from_url(url)
+        except DownloadTooLarge as e:
+            return error_response(str(e), 413)
+
+        result = await classify(image_data)
+
+        return JSONResponse({
+            "success": True,
+            "url": url,
+            "result": result
+        })
+
+    except Exception as e:
+        logger.error(f"URL prediction error: {e}")
+        return error_response(str(e), prediction_error_status(e))
+
+
+async def predict_urls(request):
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        return unavailable
+
+    try:
+        urls = parse_url_list(await request.json())
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    async def generate():
+        async for index, url, prediction, error in aiter_url_predictions(service.submit, urls, fetcher):
+            yield json.dumps(url_result(index, url, prediction, error)) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def predict_batch(request):
+    unavailable = model_unavailable()
+    if unavailable is not None:
+        return unavailable
+    if wants_ndjson(request.query_params.get('stream'), request.headers.get('accept')):
+        return stream_predict_batch(request)
+    if body_too_large(request):
+        return error_response("File too large (maximum 16MB)", 413)
+
+    try:
+        form = await capped_request(request).form()
+        files = [file for file in form.getlist('files') if not isinstance(file, str)]
+        if not files:
+            return error_response("No files found", 400)
+
+        results = []
+        entries = []
+        images = []
+
+        for file in files:
+            if file.filename == '' or not allowed_file(file.filename):
+                results.append({
+                    "filename": file.filename,
+                    "error": "Invalid file"
+                })
+                continue
+
+            entry = {"filename": file.filename}
+            results.append(entry)
+            entries.append(entry)
+            images.append(await file.read())
+
+        await asyncio.gather(*(classify_entry(entry, image_data) for entry, image_data in zip(entries, images)))
+
+        return JSONResponse({
+            "success": True,
+            "total_files": len(files),
+            "results": results
+        })
+
+    except DownloadTooLarge:
+        return error_response("File too large (maximum 16MB)", 413)
+    except Exception as e:
+        logger.error(f"Batch prediction error: {e}")
+        return error_response(str(e), 500)
+
+
+async def _resolve_pending(index, filename, future, error):
+    if future is None:
+        return file_result(index, filename, error=error)
+    try:
+        return file_result(index, filename, await future)
+    except Exception as e:
+        logger.error(f"Prediction error for file {filename}: {e}")
+        return file_result(index, filename, error=e)
+
+
+async def aiter_stream_batch(request, parser, max_in_flight=MAX_STREAM_IN_FLIGHT):
+    async def iter_parts():
+        async for chunk in request.stream():
+            if chunk:
+                for part in parser.feed(chunk):
+                    yield part
+        for part in parser.feed(None):
+            yield part
+
+    pending = deque()
+    index = 0
+    async for filename, data, error in iter_parts():
+        if error is None and (filename == '' or not allowed_file(filename)):
+            error = "Invalid file"
+        future = None
+        if error is None:
+            future = asyncio.wrap_future(await run_in_threadpool(service.submit, data))
+        pending.append((index, filename, future, error))
+        index += 1
+
+        while pending and (len(pending) >= max_in_flight or pending[0][2] is None or pending[0][2].done()):
+            yield await _resolve_pending(*pending.popleft())
+
+    while pending:
+        yield await _resolve_pending(*pending.popleft())
+
+
+def stream_predict_batch(request):
+    try:
+        parser = MultipartFileStream(multipart_boundary(request.headers.get('content-type')))
+    except ValueError as e:
+        return error_response(str(e), 400)
+    if body_too_large(request, MAX_STREAM_BYTES):
+        return error_response(f"Request body too large (maximum {MAX_STREAM_BYTES} bytes)", 413)
+
+    async def generate():
+        total = 0
+        try:
+            async for entry in aiter_stream_batch(request, parser):
+                total += 1
+                yield json.dumps(entry) + "\n"
+            yield json.dumps({"success": True, "total_files": total}) + "\n"
+        except Exception as e:
+            logger.error(f"Batch prediction error: {e}")
+            yield json.dumps({"success": False, "total_files": total, "error": str(e)}) + "\n"
+
+    return RequestStreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def get_stats(request):
+    try:
+        return JSONResponse(service.stats())
+    except Exception as e:
+        return error_response(str(e), 500)
+
+
+async def get_metrics(request):
+    if not METRICS_ENABLED:
+        return error_response("Metrics are disabled", 404)
+    return Response(metrics.REGISTRY.render(), headers={"content-type": metrics.CONTENT_TYPE})
+
+
+async def not_found(request, exc):
+    return error_response("Endpoint not found", 404)
+
+
+async def http_error(request, exc):
+    return error_response(exc.detail, exc.status_code)
+
+
+async def internal_error(request, exc):
+    return error_response("Internal server error", 500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global http_client, fetcher
+    http_client = create_http_client()
+    fetcher = URLFetcher(client=http_client)
+    service.start_loading()
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+        if service.batcher is not None:
+            service.batcher.stop()
+
+
+app = Starlette(
+    routes=[
+        Route('/', home, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/predict', predict_file, methods=['POST']),
+        Route('/predict_url', predict_url, methods=['POST']),
+        Route('/predict_batch', predict_batch, methods=['POST']),
+        Route('/predict_urls', predict_urls, methods=['POST']),
+        Route('/stats', get_stats, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+    + ([Middleware(MetricsMiddleware)] if METRICS_ENABLED else []),
+    exception_handlers={404: not_found, HTTPException: http_error, 500: internal_error},
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("🚀 Starting NSFW Detector API (asyncio)...")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -0,0 +1,455 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TFLITE_QUANTIZATIONS = ("float32", "float16", "int8")
+
+ONNX_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def _penultimate_tf(graph_def, output_name):
+    # Walk back from the output through Identity/Softmax/BiasAdd to the final dense layer's MatMul;
+    # its input is the penultimate activation (the pooled MobileNetV2 features)
+    nodes = {node.name: node for node in graph_def.node}
+    name = output_name.split(":")[0]
+    while name in nodes:
+        node = nodes[name]
+        if node.op == "MatMul":
+            feature = node.input[0]
+            return feature if ":" in feature else f"{feature}:0"
+        if not node.input:
+            break
+        name = node.input[0].split(":")[0].lstrip("^")
+    raise ValueError(f"Could not find the final dense layer behind {output_name}")
+
+
+def embedding_function(model_path):
+    """Frozen serving_default signature pruned to return (prediction, embedding)."""
+    import tensorflow as tf
+    from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+    saved_model = tf.saved_model.load(model_path)
+    frozen = convert_variables_to_constants_v2(saved_model.signatures["serving_default"])
+    graph_def = frozen.graph.as_graph_def()
+    input_name = frozen.inputs[0].name
+    output_name = frozen.outputs[0].name
+    feature_name = _penultimate_tf(graph_def, output_name)
+
+    wrapped = tf.compat.v1.wrap_function(lambda: tf.compat.v1.import_graph_def(graph_def, name=""), [])
+    graph = wrapped.graph
+    pruned = wrapped.prune(graph.as_graph_element(input_name),
+                           [graph.as_graph_element(output_name), graph.as_graph_element(feature_name)])
+    input_spec = tf.TensorSpec(frozen.inputs[0].shape, tf.float32, name=input_name.split(":")[0])
+    return tf.function(lambda images: pruned(images)).get_concrete_function(input_spec), wrapped
+
+
+def _spatial_shape(shape):
+    # (height, width) of an NHWC input; None where the model accepts any size
+    return tuple(int(dim) if isinstance(dim, (int, np.integer)) and dim > 0 else None for dim in list(shape)[1:3])
+
+
+def _require_embeddings(backend):
+    if not backend.embeddings:
+        raise ValueError(f"The {backend.name} backend was created without embeddings=True")
+
+
+class TFSavedModelBackend:
+    name = "tf"
+
+    def __init__(self, model_path, num_threads=None, embeddings=False):
+        import tensorflow as tf
+        from tensorflow import keras
+
+        if num_threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            except RuntimeError as e:
+                logger.warning(f"Could not set TensorFlow thread count: {e}")
+
+        self.model_path = model_path
+        self.embeddings = embeddings
+        if embeddings:
+            self._embedding_fn, self._graph = embedding_function(model_path)
+            self.model = None
+            input_spec = self._embedding_fn.structured_input_signature[0][0]
+        else:
+            self.model = keras.layers.TFSMLayer(model_path, call_endpoint='serving_default')
+            input_spec = next(iter(self.model.call_endpoint_fn.structured_input_signature[1].values()))
+        self.input_shape = _spatial_shape(input_spec.shape.as_list())
+
+    def predict_with_embeddings(self, batch):
+        _require_embeddings(self)
+        pred_array, embeddings = self._embedding_fn(np.asarray(batch, dtype=np.float32))
+        return np.asarray(pred_array.numpy(), dtype=np.float32), np.asarray(embeddings.numpy(), dtype=np.float32)
+
+    def __call__(self, batch):
+        if self.embeddings:
+            return self.predict_with_embeddings(batch)[0]
+
+        predictions = self.model(batch)
+
+        if isinstance(predictions, dict):
+            pred_array = next(iter(predictions.values()))
+        else:
+            pred_array = predictions
+
+        if hasattr(pred_array, 'numpy'):
+            pred_array = pred_array.numpy()
+
+        return np.asarray(pred_array, dtype=np.float32)
+
+
+def _is_current(output_path, model_path):
+    saved_model = os.path.join(model_path, "saved_model.pb")
+    return os.path.exists(output_path) and (
+        not os.path.exists(saved_model) or os.path.getmtime(output_path) >= os.path.getmtime(saved_model)
+    )
+
+
+def _write_atomic(output_path, data):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+
+
+def tflite_model_path(model_path, quantization, cache_dir=None, embeddings=False):
+    cache_dir = cache_dir or os.path.join(model_path, "tflite")
+    suffix = "_embeddings" if embeddings else ""
+    return os.path.join(cache_dir, f"model_{quantization}{suffix}.tflite")
+
+
+def convert_to_tflite(model_path, quantization="int8", cache_dir=None, embeddings=False):
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(f"Unknown TFLite quantization: {quantization}")
+
+    output_path = tflite_model_path(model_path, quantization, cache_dir, embeddings)
+    if _is_current(output_path, model_path):
+        return output_path
+
+    import tensorflow as tf
+
+    logger.info(f"Converting {model_path} to TFLite ({quantization}{', with embeddings' if embeddings else ''})")
+    try:
+        if embeddings:
+            function, graph = embedding_function(model_path)
+            converter = tf.lite.TFLiteConverter.from_concrete_functions([function], trackable_obj=graph)
+        else:
+            converter = tf.lite.TFLiteConverter.from_saved_model(model_path)
+        if quantization == "int8":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        elif quantization == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        tflite_model = converter.convert()
+    except Exception as e:
+        logger.error(f"Error converting model to TFLite: {e}")
+        raise
+
+    _write_atomic(output_path, tflite_model)
+    logger.info(f"TFLite model saved: {output_path} ({len(tflite_model) / 1e6:.1f} MB)")
+    return output_path
+
+
+def _tflite_interpreter_module():
+    try:
+        from ai_edge_litert import interpreter
+    except ImportError:
+        try:
+            from tflite_runtime import interpreter
+        except ImportError:
+            from tensorflow.lite.python import interpreter
+    return interpreter
+
+
+class TFLiteBackend:
+    def __init__(self, model_path, quantization="int8", num_threads=None, cache_dir=None, use_xnnpack=True,
+                 embeddings=False):
+        self.name = f"tflite-{quantization}"
+        self.model_path = convert_to_tflite(model_path, quantization, cache_dir, embeddings)
+        self.quantization = quantization
+        self.embeddings = embeddings
+
+        interpreter = _tflite_interpreter_module()
+        # XNNPACK packs the weights into private memory. The builtin kernels read them in place from the
+        # mapped model file instead, so processes that load the same file share one copy (see SHARED_WEIGHT_BACKENDS)
+        resolver = interpreter.OpResolverType.AUTO if use_xnnpack else \
+            interpreter.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = interpreter.Interpreter(
+            model_path=self.model_path,
+            num_threads=num_threads,
+            experimental_op_resolver_type=resolver
+        )
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        self._input_index = input_details["index"]
+        self._input_shape = list(input_details["shape"])
+        # _invoke only ever resizes the batch dimension; the spatial size is fixed at conversion
+        self.input_shape = _spatial_shape(input_details.get("shape_signature", self._input_shape))
+        # The embedding model's outputs are Identity (prediction) and Identity_1 (embedding)
+        outputs = sorted(self.interpreter.get_output_details(), key=lambda details: details["name"])
+        self._output_index = outputs[0]["index"]
+        self._embedding_index = outputs[1]["index"] if embeddings else None
+        self._batch_size = int(self._input_shape[0])
+        self._lock = threading.Lock()
+
+    def _invoke(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) != self._batch_size:
+            self.interpreter.resize_tensor_input(self._input_index, [len(batch)] + self._input_shape[1:])
+            self.interpreter.allocate_tensors()
+            self._batch_size = len(batch)
+        self.interpreter.set_tensor(self._input_index, batch)
+        self.interpreter.invoke()
+
+    def predict_with_embeddings(self, batch):
+        _require_embeddings(self)
+        with self._lock:
+            self._invoke(batch)
+            return (np.array(self.interpreter.get_tensor(self._output_index), dtype=np.float32),
+                    np.array(self.interpreter.get_tensor(self._embedding_index), dtype=np.float32))
+
+    def __call__(self, batch):
+        with self._lock:
+            self._invoke(batch)
+            return np.array(self.interpreter.get_tensor(self._output_index), dtype=np.float32)
+
+
+def onnx_model_path(model_path, cache_dir=None):
+    return os.path.join(cache_dir or model_path, "model.onnx")
+
+
+def convert_to_onnx(model_path, cache_dir=None, opset=13):
+    output_path = onnx_model_path(model_path, cache_dir)
+    if _is_current(output_path, model_path):
+        return output_path
+
+    import tensorflow as tf
+    import tf2onnx
+
+    logger.info(f"Exporting {model_path} to ONNX (opset {opset})")
+    try:
+        saved_model = tf.saved_model.load(model_path)
+        signature = saved_model.signatures["serving_default"]
+        input_name, input_spec = next(iter(signature.structured_input_signature[1].items()))
+
+        @tf.function
+        def serve(images):
+            return next(iter(signature(**{input_name: images}).values()))
+
+        model_proto, _ = tf2onnx.convert.from_function(
+            serve,
+            input_signature=[tf.TensorSpec(input_spec.shape, tf.float32, name=input_name)],
+            opset=opset
+        )
+    except Exception as e:
+        logger.error(f"Error exporting model to ONNX: {e}")
+        raise
+
+    data = model_proto.SerializeToString()
+    _write_atomic(output_path, data)
+    logger.info(f"ONNX model saved: {output_path} ({len(data) / 1e6:.1f} MB)")
+    return output_path
+
+
+def _with_embedding_output(onnx_path):
+    # Same walk as _penultimate_tf, then expose the final MatMul/Gemm input as a second graph output
+    import onnx
+
+    model = onnx.load(onnx_path)
+    producers = {output: node for node in model.graph.node for output in node.output}
+    name = model.graph.output[0].name
+    while name in producers and producers[name].op_type not in ("MatMul", "Gemm"):
+        name = producers[name].input[0]
+    if name not in producers:
+        raise ValueError(f"Could not find the final dense layer in {onnx_path}")
+    feature = producers[name].input[0]
+    model.graph.output.append(onnx.helper.make_tensor_value_info(feature, onnx.TensorProto.FLOAT, None))
+    return model.SerializeToString()
+
+
+class ONNXBackend:
+    name = "onnx"
+
+    def __init__(self, model_path, num_threads=None, inter_op_threads=None, optimization_level="all",
+                 cache_dir=None, providers=None, embeddings=False):
+        import onnxruntime as ort
+
+        if optimization_level not in ONNX_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown ONNX optimization level: {optimization_level}")
+
+        self.model_path = convert_to_onnx(model_path, cache_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, ONNX_OPTIMIZATION_LEVELS[optimization_level]
+        )
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.embeddings = embeddings
+        self.session = ort.InferenceSession(
+            _with_embedding_output(self.model_path) if embeddings else self.model_path,
+            sess_options=options,
+            providers=providers or ["CPUExecutionProvider"]
+        )
+        self._input_name = self.session.get_inputs()[0].name
+        self.input_shape = _spatial_shape(self.session.get_inputs()[0].shape)
+        self._output_names = [output.name for output in self.session.get_outputs()]
+
+    def predict_with_embeddings(self, batch):
+        _require_embeddings(self)
+        batch = np.asarray(batch, dtype=np.float32)
+        pred_array, embeddings = self.session.run(self._output_names, {self._input_name: batch})
+        return np.asarray(pred_array, dtype=np.float32), np.asarray(embeddings, dtype=np.float32)
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return np.asarray(self.session.run(self._output_names[:1], {self._input_name: batch})[0], dtype=np.float32)
+
+
+BACKENDS = {
+    "tf": lambda model_path, **options: TFSavedModelBackend(model_path, **options),
+    "tflite": lambda model_path, **options: TFLiteBackend(model_path, quantization="float32", **options),
+    "tflite-float16": lambda model_path, **options: TFLiteBackend(model_path, quantization="float16", **options),
+    "tflite-int8": lambda model_path, **options: TFLiteBackend(model_path, quantization="int8", **options),
+    "onnx": lambda model_path, **options: ONNXBackend(model_path, **options),
+}
+
+
+# Backends whose weights stay in the mapped model file when run with use_xnnpack=False and num_threads=1.
+# float16 weights are dequantized into private memory, the multithreaded float convolution keeps a transposed
+# copy, and tf/onnx load the whole model onto the heap
+SHARED_WEIGHT_BACKENDS = ("tflite", "tflite-int8")
+
+
+CONVERTERS = {
+    "tflite": lambda model_path, cache_dir=None: convert_to_tflite(model_path, "float32", cache_dir),
+    "tflite-float16": lambda model_path, cache_dir=None: convert_to_tflite(model_path, "float16", cache_dir),
+    "tflite-int8": lambda model_path, cache_dir=None: convert_to_tflite(model_path, "int8", cache_dir),
+    "onnx": lambda model_path, cache_dir=None: convert_to_onnx(model_path, cache_dir),
+}
+
+
+def prepare_backend(name, model_path, cache_dir=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (available: {', '.join(sorted(BACKENDS))})")
+    converter = CONVERTERS.get(name)
+    return converter(model_path, cache_dir=cache_dir) if converter is not None else model_path
+
+
+def create_backend(name, model_path, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (available: {', '.join(sorted(BACKENDS))})")
+    options = {key: value for key, value in options.items() if value is not None}
+    return BACKENDS[name](model_path, **options)
+
+
+def compare_backends(reference, candidate, image_inputs, batch_size=32, threshold=0.5):
+    nsfw_columns = [reference.classes.index(cls) for cls in ("hentai", "porn", "sexy")]
+    reference_rows = []
+    candidate_rows = []
+    reference_time = 0.0
+    candidate_time = 0.0
+    errors = 0
+
+    image_inputs = list(image_inputs)
+    for start in range(0, len(image_inputs), batch_size):
+        pixels = []
+        for image_input in image_inputs[start:start + batch_size]:
+            try:
+                pixels.append(reference.preprocess_pixels(image_input))
+            except Exception as e:
+                logger.error(f"Skipping {image_input}: {e}")
+                errors += 1
+        if not pixels:
+            continue
+
+        batch = np.stack(pixels).astype(np.float32) / 255.0
+        if not reference_rows:
+            reference.run_model(batch)
+            candidate.run_model(batch)
+        started = time.perf_counter()
+        reference_rows.append(reference.run_model(batch))
+        reference_time += time.perf_counter() - started
+        started = time.perf_counter()
+        candidate_rows.append(candidate.run_model(batch))
+        candidate_time += time.perf_counter() - started
+
+    if not reference_rows:
+        raise ValueError("No images could be compared")
+
+    expected = np.concatenate(reference_rows)
+    actual = np.concatenate(candidate_rows)
+    abs_diff = np.abs(expected - actual)
+    expected_nsfw = expected[:, nsfw_columns].sum(axis=1)
+    actual_nsfw = actual[:, nsfw_columns].sum(axis=1)
+    count = len(expected)
+
+    return {
+        "reference": getattr(reference.model, "name", reference.backend),
+        "candidate": getattr(candidate.model, "name", candidate.backend),
+        "images": count,
+        "errors": errors,
+        "top1_agreement": float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1))),
+        "nsfw_decision_agreement": float(np.mean((expected_nsfw >= threshold) == (actual_nsfw >= threshold))),
+        "mean_abs_diff": float(abs_diff.mean()),
+        "max_abs_diff": float(abs_diff.max()),
+        "class_mean_abs_diff": {cls: float(abs_diff[:, i].mean()) for i, cls in enumerate(reference.classes)},
+        "nsfw_score_mean_abs_diff": float(np.abs(expected_nsfw - actual_nsfw).mean()),
+        "nsfw_score_max_abs_diff": float(np.abs(expected_nsfw - actual_nsfw).max()),
+        "reference_ms_per_image": reference_time / count * 1000.0,
+        "candidate_ms_per_image": candidate_time / count * 1000.0,
+        "speedup": reference_time / candidate_time if candidate_time > 0 else None,
+    }
+
+
+def main(argv=None):
+    import argparse
+    import itertools
+    import json
+
+    from nsfw_detector import NSFWDetector, iter_image_files
+
+    parser = argparse.ArgumentParser(description="Convert the model and report accuracy deltas between backends")
+    parser.add_argument("images", nargs="+", help="Image files or directories to compare on")
+    parser.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    parser.add_argument("--reference", default="tf")
+    parser.add_argument("--candidates", nargs="+", default=["tflite-float16", "tflite-int8"])
+    parser.add_argument("--num-threads", type=int)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of images to compare")
+    args = parser.parse_args(argv)
+
+    image_inputs = itertools.chain.from_iterable(
+        iter_image_files(path) if os.path.isdir(path) else [path] for path in args.images
+    )
+    image_inputs = list(itertools.islice(image_inputs, args.limit))
+
+    reference = NSFWDetector(args.model_path, backend=args.reference, num_threads=args.num_threads)
+    reports = []
+    for name in args.candidates:
+        candidate = NSFWDetector(args.model_path, backend=name, num_threads=args.num_threads)
+        reports.append(compare_backends(reference, candidate, image_inputs, batch_size=args.batch_size))
+    print(json.dumps(reports, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Detector and API benchmark suite
+
+Generates a reproducible set of synthetic images (several sizes and formats), then measures
+decode, preprocess and inference latency separately, end-to-end throughput of predict,
+predict_batch and predict.classify on a directory, and the Flask endpoints through the test client.
+Results are written as JSON so two runs can be compared.
+
+    python benchmark.py --backend tflite -o before.json
+    python benchmark.py --backend tflite -o after.json
+    python benchmark.py --compare before.json after.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from nsfw_detector import BatchBuffer, NSFWDetector, decode_image, predict, resize_pixels
+
+DEFAULT_SIZES = ["320x240", "640x480", "1280x720", "1920x1080", "4000x3000"]
+DEFAULT_FORMATS = ["jpeg", "png", "webp"]
+BENCHMARKS = ["decode", "preprocess", "inference", "predict", "predict_batch", "classify_dir",
+              "api_predict", "api_predict_batch"]
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp"}
+
+
+def synthetic_image(rng, width, height):
+    # Smooth colour fields plus sensor-like noise compress roughly like photos, unlike pure noise
+    base = Image.fromarray(rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(base, dtype=np.int16) + rng.integers(-12, 13, (height, width, 3), dtype=np.int16)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def make_dataset(directory, sizes=DEFAULT_SIZES, formats=DEFAULT_FORMATS, per_variant=4, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    images = []
+    for size in sizes:
+        width, height = (int(value) for value in size.split("x"))
+        for image_format in formats:
+            for index in range(per_variant):
+                path = os.path.join(directory, f"{size}_{index}.{EXTENSIONS[image_format]}")
+                synthetic_image(rng, width, height).save(path, format=image_format.upper(), quality=85)
+                images.append({"path": path, "variant": f"{image_format} {size}", "bytes": os.path.getsize(path)})
+    return images
+
+
+def summarize(seconds, items=None):
+    samples = np.asarray(seconds) * 1000.0
+    summary = {
+        "count": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+    }
+    if items is not None:
+        summary["items_per_s"] = items / (samples.sum() / 1000.0)
+    return summary
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def by_variant(images, measure, repeat):
+    samples = {}
+    for image in images:
+        for _ in range(repeat):
+            samples.setdefault(image["variant"], []).append(measure(image["path"]))
+    return {variant: summarize(values) for variant, values in samples.items()}
+
+
+def bench_decode(detector, images, args):
+    return by_variant(images, lambda path: timed(decode_image, path, detector.input_size, detector.fast_decode), args.repeat)
+
+
+def bench_preprocess(detector, images, args):
+    buffer = BatchBuffer(1, detector.input_size)
+    decoded = {image["path"]: decode_image(image["path"], detector.input_size, detector.fast_decode) for image in images}
+
+    def measure(path):
+        started = time.perf_counter()
+        resize_pixels(decoded[path], detector.input_size, out=buffer.pixels[0])
+        buffer.normalize(1)
+        return time.perf_counter() - started
+
+    return by_variant(images, measure, args.repeat)
+
+
+def bench_inference(detector, images, args):
+    results = {}
+    width, height = detector.input_size
+    for batch_size in args.batch_sizes:
+        batch = np.random.default_rng(batch_size).random((batch_size, height, width, 3), dtype=np.float32)
+        detector.run_model(batch)
+        samples = [timed(detector.run_model, batch) for _ in range(args.repeat * 3)]
+        summary = summarize(samples, items=batch_size * len(samples))
+        summary["per_image_ms"] = summary["mean_ms"] / batch_size
+        results[f"batch_{batch_size}"] = summary
+    return results
+
+
+def bench_predict(detector, images, args):
+    paths = [image["path"] for image in images]
+    detector.predict(paths[0])
+    return summarize([timed(detector.predict, path) for path in paths for _ in range(args.repeat)],
+                     items=len(paths) * args.repeat)
+
+
+def bench_predict_batch(detector, images, args):
+    paths = [image["path"] for image in images]
+    samples = [timed(detector.predict_batch, paths) for _ in range(args.repeat)]
+    return summarize(samples, items=len(paths) * args.repeat)
+
+
+def bench_classify_dir(detector, images, args):
+    results = predict.classify(detector, args.data_dir)
+    samples = [timed(predict.classify, detector, args.data_dir) for _ in range(args.repeat)]
+    summary = summarize(samples, items=len(results) * args.repeat)
+    summary["images"] = len(results)
+    return summary
+
+
+def start_api_service(args):
+    import api_server
+    from server_common import ModelService
+
+    service = ModelService(args.model_path, backend=args.backend, num_threads=args.num_threads)
+    service.initialize()
+    api_server.service = service
+    return service
+
+
+def api_app():
+    import api_server
+
+    # Every upload must reach the model, not the result cache left behind by an earlier run
+    if api_server.service.detector.cache is not None:
+        api_server.service.detector.cache.clear()
+    return api_server.app
+
+
+def run_requests(app, requests, concurrency):
+    def send(request):
+        with app.test_client() as client:
+            started = time.perf_counter()
+            response = client.post(request["url"], data=request["data"], content_type="multipart/form-data")
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"{request['url']} returned {response.status_code}: {response.get_data(as_text=True)}")
+        return elapsed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, requests))
+    return latencies, time.perf_counter() - started
+
+
+def load_bytes(images):
+    contents = []
+    for image in images:
+        with open(image["path"], "rb") as f:
+            contents.append((os.path.basename(image["path"]), f.read()))
+    return contents
+
+
+def bench_api_predict(detector, images, args):
+    app = api_app()
+    requests = [{"url": "/predict", "data": {"file": (io.BytesIO(data), name)}} for name, data in load_bytes(images)]
+    latencies, elapsed = run_requests(app, requests, args.api_concurrency)
+    summary = summarize(latencies)
+    summary["items_per_s"] = len(requests) / elapsed
+    summary["concurrency"] = args.api_concurrency
+    return summary
+
+
+def bench_api_predict_batch(detector, images, args):
+    app = api_app()
+    contents = load_bytes(images)
+    requests = []
+    for start in range(0, len(contents), args.api_batch_files):
+        files = [(io.BytesIO(data), name) for name, data in contents[start:start + args.api_batch_files]]
+        requests.append({"url": "/predict_batch", "data": {"files": files}})
+    latencies, elapsed = run_requests(app, requests, max(1, args.api_concurrency // 4))
+    summary = summarize(latencies)
+    summary["items_per_s"] = len(contents) / elapsed
+    summary["files_per_request"] = args.api_batch_files
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    owns_data_dir = args.data_dir is None
+    args.data_dir = args.data_dir or tempfile.mkdtemp(prefix="nsfw-bench-")
+    try:
+        images = make_dataset(args.data_dir, args.sizes, args.formats, args.per_variant, args.seed)
+        detector = NSFWDetector(args.model_path, batch_size=args.batch_size, backend=args.backend,
+                                num_threads=args.num_threads)
+        detector.warmup(batch_sizes=(1, args.batch_size))
+
+        selected = [name for name in args.only or BENCHMARKS if name not in args.skip]
+        service = start_api_service(args) if any(name.startswith("api_") for name in selected) else None
+
+        results = {}
+        for name in selected:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = globals()[f"bench_{name}"](detector, images, args)
+
+        if service is not None:
+            service.batcher.stop()
+        detector.close()
+    finally:
+        if owns_data_dir:
+            shutil.rmtree(args.data_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "num_threads": args.num_threads,
+            "batch_size": args.batch_size,
+            "dataset": {
+                "sizes": args.sizes,
+                "formats": args.formats,
+                "per_variant": args.per_variant,
+                "seed": args.seed,
+                "images": len(images),
+            },
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+
+def flatten(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name))
+        elif name.endswith(("_ms", "_per_s")):
+            metrics[name] = value
+    return metrics
+
+
+def compare(baseline, current, tolerance=0.1):
+    # Positive change is always an improvement: lower latency or higher throughput
+    before = flatten(baseline["results"])
+    after = flatten(current["results"])
+    rows = []
+    for name in sorted(before.keys() & after.keys()):
+        if name.endswith("_ms"):
+            change = (before[name] - after[name]) / before[name] if before[name] else 0.0
+        else:
+            change = (after[name] - before[name]) / before[name] if before[name] else 0.0
+        rows.append({"metric": name, "baseline": before[name], "current": after[name],
+                     "improvement": change, "regression": change < -tolerance})
+    return rows
+
+
+def print_comparison(rows):
+    width = max([len(row["metric"]) for row in rows] + [6])
+    print(f"{'metric':<{width}} {'baseline':>12} {'current':>12} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<{width}} {row['baseline']:>12.3f} {row['current']:>12.3f} {row['improvement']:>+7.1%}{flag}")
+
+
+def print_report(report):
+    for name, result in report["results"].items():
+        print(name)
+        entries = result.items() if "mean_ms" not in result else [("", result)]
+        for label, stats in entries:
+            line = f"  {label:<18} mean {stats['mean_ms']:9.2f} ms  p95 {stats['p95_ms']:9.2f} ms"
+            if "items_per_s" in stats:
+                line += f"  {stats['items_per_s']:9.1f} img/s"
+            print(line)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the detector and API hot paths")
+    parser.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    parser.add_argument("--backend", default="tf")
+    parser.add_argument("--num-threads", type=int)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32], help="Inference batch sizes")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Synthetic image sizes (WxH)")
+    parser.add_argument("--formats", nargs="+", default=DEFAULT_FORMATS, choices=DEFAULT_FORMATS)
+    parser.add_argument("--per-variant", type=int, default=4, help="Images per size/format combination")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--api-concurrency", type=int, default=8)
+    parser.add_argument("--api-batch-files", type=int, default=16)
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS)
+    parser.add_argument("--skip", nargs="+", choices=BENCHMARKS, default=[])
+    parser.add_argument("--data-dir", help="Keep the synthetic images here instead of a temporary directory")
+    parser.add_argument("-o", "--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", nargs="+", metavar="REPORT",
+                        help="Compare BASELINE against CURRENT (or against a fresh run when only one is given)")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative slowdown reported as a regression")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        print("--compare takes a baseline and at most one current report", file=sys.stderr)
+        return 2
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+        if not args.compare:
+            if args.output:
+                print_report(current)
+            else:
+                print(json.dumps(current, indent=2))
+            return 0
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+
+    rows = compare(baseline, current, args.tolerance)
+    print_comparison(rows)
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Multi-worker serving benchmark
+
+Starts the API under gunicorn with an increasing number of workers and reports
+requests/sec, latency and per-worker memory (RSS, PSS and private pages) for each.
+The mapped model file is reported separately: its pages are shared, so its PSS
+per worker falls as workers are added while private memory per worker stays flat.
+
+    python benchmark_serving.py --workers 1 2 4 --backend tflite --concurrency 16 --requests 500
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+
+def make_images(count, size=256, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+
+def worker_pids(pid):
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        cmdline = f.read()
+    workers = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat.rsplit(")", 1)[1].split()[1]) != pid:
+            continue
+        # Forked workers keep the master's command line; helper processes do not
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                if f.read() == cmdline:
+                    workers.append(int(entry))
+        except OSError:
+            continue
+    return workers
+
+
+def memory_usage(pid):
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                usage[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    return {
+        "rss_mb": usage.get("Rss", 0.0),
+        "pss_mb": usage.get("Pss", 0.0),
+        "shared_mb": usage.get("Shared_Clean", 0.0) + usage.get("Shared_Dirty", 0.0),
+        "private_mb": usage.get("Private_Clean", 0.0) + usage.get("Private_Dirty", 0.0),
+    }
+
+
+def model_memory(pid, suffix=".tflite"):
+    # Rss/Pss of the memory-mapped model file(s); shared pages are split between the processes mapping them
+    usage = {"Rss": 0.0, "Pss": 0.0}
+    mapped = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            parts = line.split()
+            if "-" in parts[0] and len(parts) >= 5:
+                mapped = len(parts) >= 6 and parts[5].endswith(suffix)
+            elif mapped and parts[0].rstrip(":") in usage:
+                usage[parts[0].rstrip(":")] += int(parts[1]) / 1024.0
+    return {"model_rss_mb": usage["Rss"], "model_pss_mb": usage["Pss"]}
+
+
+def wait_until_ready(url, workers, timeout):
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            stats = requests.get(f"{url}/stats", timeout=5).json()
+            if stats.get("model_status") == "ready":
+                ready.add(stats["pid"])
+            elif stats.get("model_status") == "error":
+                raise RuntimeError("Model failed to load, see the server log")
+            if len(ready) >= workers:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"Only {len(ready)}/{workers} workers became ready within {timeout}s")
+
+
+def run_load(url, images, total_requests, concurrency):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+
+    def send(index):
+        started = time.perf_counter()
+        response = session.post(f"{url}/predict", files={"file": ("image.jpg", images[index % len(images)])}, timeout=60)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(send, range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1000.0
+    return {
+        "requests": total_requests,
+        "requests_per_s": total_requests / elapsed,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def benchmark(workers, args, images):
+    port = args.port
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.update({
+        "NSFW_WORKERS": str(workers),
+        "NSFW_BIND": f"127.0.0.1:{port}",
+        "NSFW_BACKEND": args.backend,
+        "NSFW_MODEL_PATH": args.model_path,
+        "NSFW_HTTP_THREADS": str(args.http_threads),
+    })
+    if args.num_threads:
+        env["NSFW_NUM_THREADS"] = str(args.num_threads)
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api_server:app"],
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    try:
+        wait_until_ready(url, workers, args.startup_timeout)
+        warmup_images = images[args.requests:]
+        run_load(url, warmup_images, len(warmup_images), args.concurrency)
+
+        result = {"workers": workers, "backend": args.backend}
+        result.update(run_load(url, images[:args.requests], args.requests, args.concurrency))
+
+        worker_memory = [dict(memory_usage(pid), **model_memory(pid)) for pid in worker_pids(server.pid)]
+        for key in ("rss_mb", "pss_mb", "shared_mb", "private_mb", "model_rss_mb", "model_pss_mb"):
+            result[f"worker_{key}"] = float(np.mean([memory[key] for memory in worker_memory]))
+        result["total_pss_mb"] = memory_usage(server.pid)["pss_mb"] + sum(memory["pss_mb"] for memory in worker_memory)
+        return result
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark multi-worker serving under gunicorn")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--backend", default="tflite")
+    parser.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    parser.add_argument("--num-threads", type=int, help="Inference threads per worker (default: cores / workers)")
+    parser.add_argument("--http-threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client connections")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the server log")
+    args = parser.parse_args(argv)
+
+    # Unique images, so the result cache never answers for the model
+    images = make_images(args.requests + 4 * args.concurrency, seed=random.randrange(2 ** 32))
+    results = [benchmark(workers, args, images) for workers in args.workers]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+
+    print(f"{'workers':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS/worker':>11} {'PSS/worker':>11} "
+          f"{'private/worker':>15} {'model RSS':>10} {'model PSS':>10} {'total PSS':>10}")
+    for result in results:
+        print(f"{result['workers']:>7} {result['requests_per_s']:>8.1f} {result['latency_p50_ms']:>8.1f} "
+              f"{result['latency_p95_ms']:>8.1f} {result['worker_rss_mb']:>9.0f}MB {result['worker_pss_mb']:>9.0f}MB "
+              f"{result['worker_private_mb']:>13.0f}MB {result['worker_model_rss_mb']:>8.0f}MB "
+              f"{result['worker_model_pss_mb']:>8.0f}MB {result['total_pss_mb']:>8.0f}MB")
+    # What one more worker costs: with shared weights this is the worker's private memory, not another model copy
+    for previous, result in zip(results, results[1:]):
+        added = result["workers"] - previous["workers"]
+        if added > 0:
+            print(f"{previous['workers']} -> {result['workers']} workers: "
+                  f"{(result['total_pss_mb'] - previous['total_pss_mb']) / added:.0f}MB PSS per added worker")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
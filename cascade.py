@@ -0,0 +1,208 @@
+import logging
+import threading
+import time
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+NSFW_CLASSES = ("hentai", "porn", "sexy")
+DEFAULT_BANDS = ((0.05, 0.95), (0.1, 0.9), (0.2, 0.8), (0.3, 0.7))
+
+
+class Cascade:
+    def __init__(self, stage1, low=0.1, high=0.9):
+        if not 0.0 <= low <= high <= 1.0:
+            raise ValueError(f"Invalid uncertainty band: [{low}, {high}]")
+        self.stage1 = stage1
+        self.low = low
+        self.high = high
+        self._nsfw_columns = [stage1.classes.index(cls) for cls in NSFW_CLASSES]
+        self._lock = threading.Lock()
+        self.images = 0
+        self.escalated = 0
+
+    def identity(self):
+        return f"cascade[{self.low},{self.high}]:{self.stage1.model_identity()}"
+
+    def stage1_inputs(self, batch):
+        size = self.stage1.input_size
+        if tuple(batch.shape[1:3]) == (size[1], size[0]):
+            return batch
+        pixels = np.clip(batch * 255.0 + 0.5, 0, 255).astype(np.uint8)
+        resized = np.stack([np.asarray(Image.fromarray(row).resize(size, Image.BILINEAR)) for row in pixels])
+        return resized.astype(np.float32) / 255.0
+
+    def uncertain(self, rows):
+        nsfw_scores = rows[:, self._nsfw_columns].sum(axis=1)
+        return (nsfw_scores >= self.low) & (nsfw_scores <= self.high)
+
+    def run(self, batch, full_model):
+        # Confident stage 1 rows are final; only the uncertain band pays for the full model
+        rows = np.array(self.stage1.run_model(self.stage1_inputs(batch)), dtype=np.float32)
+        escalate = self.uncertain(rows)
+        if escalate.any():
+            rows[escalate] = full_model(batch[escalate])
+
+        with self._lock:
+            self.images += len(batch)
+            self.escalated += int(escalate.sum())
+        return rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                "low": self.low,
+                "high": self.high,
+                "images": self.images,
+                "escalated": self.escalated,
+                "escalation_rate": self.escalated / self.images if self.images else 0.0,
+            }
+
+
+def load_stage1(model_path, backend="tflite-int8", input_size=None, num_threads=None, backend_options=None):
+    # input_size must match the stage 1 model's own input shape: the shipped MobileNetV2 is fixed at
+    # 224x224 in every backend, so a smaller first stage needs a separately trained low-res model
+    from nsfw_detector import NSFWDetector
+
+    return NSFWDetector(
+        model_path,
+        backend=backend,
+        num_threads=num_threads,
+        backend_options=backend_options,
+        input_size=(input_size, input_size) if input_size else (224, 224)
+    )
+
+
+def build_cascade(model_path, backend="tflite-int8", input_size=None, low=0.1, high=0.9, num_threads=None,
+                  backend_options=None):
+    return Cascade(load_stage1(model_path, backend, input_size, num_threads, backend_options), low, high)
+
+
+def band_report(full_rows, stage1_rows, nsfw_columns, low, high, threshold, full_ms, stage1_ms):
+    full_nsfw = full_rows[:, nsfw_columns].sum(axis=1)
+    stage1_nsfw = stage1_rows[:, nsfw_columns].sum(axis=1)
+    escalate = (stage1_nsfw >= low) & (stage1_nsfw <= high)
+    cascade_rows = np.where(escalate[:, None], full_rows, stage1_rows)
+    cascade_nsfw = cascade_rows[:, nsfw_columns].sum(axis=1)
+
+    expected = full_nsfw >= threshold
+    actual = cascade_nsfw >= threshold
+    cascade_ms = stage1_ms + escalate.mean() * full_ms
+    return {
+        "low": low,
+        "high": high,
+        "escalation_rate": float(escalate.mean()),
+        "decision_agreement": float(np.mean(expected == actual)),
+        "top1_agreement": float(np.mean(full_rows.argmax(axis=1) == cascade_rows.argmax(axis=1))),
+        "missed_nsfw": int(np.sum(expected & ~actual)),
+        "extra_nsfw": int(np.sum(~expected & actual)),
+        "ms_per_image": cascade_ms,
+        "compute_saved": 1.0 - cascade_ms / full_ms if full_ms > 0 else 0.0,
+    }
+
+
+def evaluate_cascade(detector, stage1, image_inputs, low=0.1, high=0.9, threshold=0.5, batch_size=32, bands=DEFAULT_BANDS):
+    # Both stages score every image once, so any band can be replayed without rerunning the models
+    if detector.cascade is not None:
+        raise ValueError("The reference detector must not use a cascade itself")
+    cascade = Cascade(stage1, low, high)
+    nsfw_columns = [detector.classes.index(cls) for cls in NSFW_CLASSES]
+    full_rows = []
+    stage1_rows = []
+    full_time = 0.0
+    stage1_time = 0.0
+    errors = 0
+
+    image_inputs = list(image_inputs)
+    for start in range(0, len(image_inputs), batch_size):
+        pixels = []
+        for image_input in image_inputs[start:start + batch_size]:
+            try:
+                pixels.append(detector.preprocess_pixels(image_input))
+            except Exception as e:
+                logger.error(f"Skipping {image_input}: {e}")
+                errors += 1
+        if not pixels:
+            continue
+
+        batch = np.stack(pixels).astype(np.float32) / 255.0
+        stage1_batch = cascade.stage1_inputs(batch)
+        if not full_rows:
+            detector.run_model(batch)
+            stage1.run_model(stage1_batch)
+
+        started = time.perf_counter()
+        full_rows.append(detector.run_model(batch))
+        full_time += time.perf_counter() - started
+        started = time.perf_counter()
+        stage1_rows.append(stage1.run_model(stage1_batch))
+        stage1_time += time.perf_counter() - started
+
+    if not full_rows:
+        raise ValueError("No images could be evaluated")
+
+    full_rows = np.concatenate(full_rows)
+    stage1_rows = np.concatenate(stage1_rows)
+    count = len(full_rows)
+    full_ms = full_time / count * 1000.0
+    stage1_ms = stage1_time / count * 1000.0
+
+    candidates = [(low, high)] + [band for band in bands if band != (low, high)]
+    return {
+        "images": count,
+        "errors": errors,
+        "threshold": threshold,
+        "full_ms_per_image": full_ms,
+        "stage1_ms_per_image": stage1_ms,
+        "configured": band_report(full_rows, stage1_rows, nsfw_columns, low, high, threshold, full_ms, stage1_ms),
+        "bands": [
+            band_report(full_rows, stage1_rows, nsfw_columns, band_low, band_high, threshold, full_ms, stage1_ms)
+            for band_low, band_high in candidates
+        ],
+    }
+
+
+def main(argv=None):
+    import argparse
+    import itertools
+    import json
+    import os
+
+    from nsfw_detector import NSFWDetector, iter_image_files
+
+    parser = argparse.ArgumentParser(description="Evaluate a two-stage cascade against the full model")
+    parser.add_argument("images", nargs="+", help="Image files or directories to evaluate on")
+    parser.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    parser.add_argument("--backend", default="tf")
+    parser.add_argument("--stage1-model-path", help="Stage 1 model (defaults to --model-path)")
+    parser.add_argument("--stage1-backend", default="tflite-int8")
+    parser.add_argument("--stage1-input-size", type=int, help="Stage 1 input resolution; must match the input shape of --stage1-model-path")
+    parser.add_argument("--low", type=float, default=0.1)
+    parser.add_argument("--high", type=float, default=0.9)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--num-threads", type=int)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=1000, help="Maximum number of images to evaluate")
+    args = parser.parse_args(argv)
+
+    image_inputs = itertools.chain.from_iterable(
+        iter_image_files(path) if os.path.isdir(path) else [path] for path in args.images
+    )
+    image_inputs = list(itertools.islice(image_inputs, args.limit))
+
+    detector = NSFWDetector(args.model_path, backend=args.backend, num_threads=args.num_threads)
+    stage1 = load_stage1(args.stage1_model_path or args.model_path, args.stage1_backend, args.stage1_input_size, args.num_threads)
+    report = evaluate_cascade(detector, stage1, image_inputs, args.low, args.high, args.threshold, args.batch_size)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lazy_import import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+DEFAULT_MAX_PIXELS = 50_000_000
+DEFAULT_WAIT_TIMEOUT = 30.0
+
+# Decoded bytes per pixel for the modes Pillow hands back; anything unlisted is assumed to be 4
+_BYTES_PER_PIXEL = {"1": 1, "L": 1, "P": 1, "LA": 2, "PA": 2, "I;16": 2, "RGB": 3, "YCbCr": 3, "LAB": 3, "HSV": 3}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class DecodeBusy(TimeoutError):
+    pass
+
+
+def _input_size_bytes(image_input):
+    if isinstance(image_input, (bytes, bytearray, memoryview)):
+        return len(image_input)
+    if isinstance(image_input, (str, os.PathLike)):
+        return os.path.getsize(image_input)
+    if isinstance(image_input, io.BytesIO):
+        return image_input.getbuffer().nbytes
+    return None
+
+
+def decoded_bytes(image):
+    # Full-resolution pixels plus the RGB copy made by convert(); the 224x224 resize is noise
+    pixels = image.width * image.height
+    size = pixels * _BYTES_PER_PIXEL.get(image.mode, 4)
+    if image.mode != "RGB":
+        size += pixels * 3
+    return size
+
+
+class DecodeGuard:
+    """Pixel and byte budgets checked from the image header before any pixels are decoded, plus a
+    memory budget shared by the decodes in flight in this process."""
+
+    def __init__(self, max_pixels=DEFAULT_MAX_PIXELS, max_input_bytes=None, memory_budget=None,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.max_pixels = max_pixels
+        self.max_input_bytes = max_input_bytes
+        self.memory_budget = memory_budget
+        self.wait_timeout = wait_timeout
+        self._init_state()
+
+    def _init_state(self):
+        self._cond = threading.Condition()
+        self.in_flight_bytes = 0
+        self.reduced = 0
+        self.rejected = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def __getstate__(self):
+        # Process workers get the same limits and a fresh budget of their own
+        return {
+            "max_pixels": self.max_pixels,
+            "max_input_bytes": self.max_input_bytes,
+            "memory_budget": self.memory_budget,
+            "wait_timeout": self.wait_timeout,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _reject(self, message):
+        with self._cond:
+            self.rejected += 1
+        raise ImageTooLarge(message)
+
+    def open(self, image_input, input_size, fast_decode=True):
+        """Open image_input lazily, shrink it on load where the format allows and check the result
+        against the budgets. The returned image has not been decoded yet."""
+        return self.open_with_size(image_input, input_size, fast_decode)[0]
+
+    def check_input(self, image_input):
+        size = _input_size_bytes(image_input)
+        if self.max_input_bytes is not None and size is not None and size > self.max_input_bytes:
+            self._reject(f"Image too large ({size} bytes, maximum {self.max_input_bytes})")
+
+    def open_with_size(self, image_input, input_size, fast_decode=True):
+        """Same as open(), plus the size read from the image header before any draft."""
+        if isinstance(image_input, Image.Image):
+            # Already in memory, so the only thing left to bound is the RGB copy
+            self.check_pixels(image_input.size)
+            return image_input, image_input.size
+
+        self.check_input(image_input)
+
+        from nsfw_detector import load_image
+
+        try:
+            image = load_image(image_input)
+        except Image.DecompressionBombError as e:
+            # Pillow's own hard limit (twice Image.MAX_IMAGE_PIXELS), checked while reading the header
+            self._reject(str(e))
+
+        header_size = image.size
+        if fast_decode:
+            # JPEG can decode at 1/2, 1/4 or 1/8 scale; other formats keep their header size
+            image.draft('RGB', input_size)
+        try:
+            self.check_pixels(image.size, header_size)
+        except ImageTooLarge:
+            image.close()
+            raise
+        if self.max_pixels is not None and header_size[0] * header_size[1] > self.max_pixels:
+            with self._cond:
+                self.reduced += 1
+        return image, header_size
+
+    def check_pixels(self, size, header_size=None):
+        width, height = size
+        if self.max_pixels is not None and width * height > self.max_pixels:
+            header_width, header_height = header_size or size
+            self._reject(f"Image too large ({header_width}x{header_height} pixels, maximum {self.max_pixels})")
+
+    @contextmanager
+    def reserve(self, nbytes):
+        if self.memory_budget is None:
+            yield
+            return
+        if nbytes > self.memory_budget:
+            self._reject(f"Image too large to decode ({nbytes} bytes, memory budget {self.memory_budget})")
+
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            if self.in_flight_bytes + nbytes > self.memory_budget:
+                self.waits += 1
+            while self.in_flight_bytes + nbytes > self.memory_budget:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise DecodeBusy(f"Timed out waiting {self.wait_timeout}s for decode memory")
+                self._cond.wait(remaining)
+            self.in_flight_bytes += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.in_flight_bytes -= nbytes
+                self._cond.notify_all()
+
+    @contextmanager
+    def decoding(self, image_input, input_size, fast_decode=True):
+        """Opened image for the duration of the block, with its decoded size held against the budget."""
+        image = self.open(image_input, input_size, fast_decode)
+        with self.reserve(decoded_bytes(image)):
+            yield image
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_pixels": self.max_pixels,
+                "max_input_bytes": self.max_input_bytes,
+                "memory_budget": self.memory_budget,
+                "in_flight_bytes": self.in_flight_bytes,
+                "reduced": self.reduced,
+                "rejected": self.rejected,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+            }
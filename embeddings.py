@@ -0,0 +1,349 @@
+import json
+import logging
+import math
+import os
+import threading
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f16"
+PATHS_FILE = "paths.jsonl"
+META_FILE = "meta.json"
+INDEX_FILE = "index.faiss"
+DEFAULT_FLUSH_ROWS = 4096
+SEARCH_CHUNK_ROWS = 8192
+
+
+def _import_faiss():
+    try:
+        import faiss
+    except ImportError:
+        raise ImportError("IVF-PQ indexes require faiss (pip install faiss-cpu)")
+    return faiss
+
+
+def normalize(vectors):
+    # Unit rows turn cosine similarity into a plain dot product
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def merge_topk(scores, indices, k):
+    # Keeps the k highest scores per row, sorted descending; padding entries have index -1
+    if scores.shape[1] > k:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, top, axis=1)
+        indices = np.take_along_axis(indices, top, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+def search_matrix(matrix, queries, k, offset=0, chunk_rows=SEARCH_CHUNK_ROWS):
+    """Exact inner-product top-k over matrix rows, converting chunk_rows rows to float32 at a time."""
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(matrix), chunk_rows):
+        chunk = np.asarray(matrix[start:start + chunk_rows], dtype=np.float32)
+        scores = queries @ chunk.T
+        indices = np.broadcast_to(np.arange(start, start + len(chunk)) + offset, scores.shape)
+        best_scores, best_indices = merge_topk(
+            np.concatenate([best_scores, scores], axis=1),
+            np.concatenate([best_indices, indices], axis=1),
+            k
+        )
+    return best_scores, best_indices
+
+
+class EmbeddingStore:
+    """Unit-length embeddings in an append-only float16 matrix on disk, read back through a memory map.
+
+    Row i of vectors.f16 belongs to line i of paths.jsonl; meta.json records how many rows are
+    complete, so rows from an interrupted flush are dropped on the next open.
+    """
+
+    def __init__(self, path, dim=None, model_identity=None, flush_rows=DEFAULT_FLUSH_ROWS):
+        self.path = path
+        self.flush_rows = flush_rows
+        self._lock = threading.Lock()
+        self._pending_paths = []
+        self._pending_vectors = []
+        self._matrix = None
+        self._paths = None
+        self._rows = None
+        self._index = None
+        os.makedirs(path, exist_ok=True)
+
+        self.meta = {"dim": dim, "count": 0, "paths_bytes": 0, "model_identity": model_identity, "index": None}
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta.update(json.load(f))
+            if dim is not None and self.meta["dim"] not in (None, dim):
+                raise ValueError(f"Embedding store {path} holds {self.meta['dim']}-d vectors, not {dim}-d")
+            if model_identity is not None and self.meta["model_identity"] not in (None, model_identity):
+                logger.warning(f"Embedding store {path} was built with {self.meta['model_identity']}, "
+                               f"now adding from {model_identity}")
+            self._truncate()
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _truncate(self, warn=True):
+        for name, size in ((VECTORS_FILE, self.meta["count"] * (self.dim or 0) * 2),
+                           (PATHS_FILE, self.meta["paths_bytes"])):
+            file_path = self._file(name)
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                if warn:
+                    logger.warning(f"Dropping incomplete rows from {file_path}")
+                os.truncate(file_path, size)
+
+    def add(self, image_path, embedding):
+        self.add_batch([image_path], [embedding])
+
+    def add_batch(self, image_paths, embeddings):
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if self.meta["dim"] is None:
+                self.meta["dim"] = embeddings.shape[1]
+            elif embeddings.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Expected {self.meta['dim']}-d embeddings, got {embeddings.shape[1]}-d")
+            self._pending_paths.extend(os.fspath(path) if path is not None else None for path in image_paths)
+            self._pending_vectors.append(normalize(embeddings).astype(np.float16))
+            pending = len(self._pending_paths)
+        # flush_rows=None leaves flushing to the caller, e.g. only at scan checkpoints
+        if self.flush_rows is not None and pending >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_paths:
+                return
+            vectors = np.concatenate(self._pending_vectors)
+            lines = "".join(json.dumps(path) + "\n" for path in self._pending_paths).encode("utf-8")
+            for name, data in ((VECTORS_FILE, vectors.tobytes()), (PATHS_FILE, lines)):
+                with open(self._file(name), "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            if self._paths is not None:
+                self._paths.extend(self._pending_paths)
+            if self._rows is not None:
+                self._rows.update((path, row) for row, path in enumerate(self._pending_paths, self.meta["count"]))
+            self.meta["count"] += len(vectors)
+            self.meta["paths_bytes"] += len(lines)
+            self._pending_paths = []
+            self._pending_vectors = []
+            self._matrix = None
+            self._write_meta()
+
+    def truncate(self, count):
+        """Drop unflushed rows and every stored row from count on, e.g. rows flushed after the last
+        checkpoint of an interrupted scan that is about to be resumed."""
+        with self._lock:
+            self._pending_paths = []
+            self._pending_vectors = []
+            if count > self.meta["count"]:
+                raise ValueError(f"Embedding store {self.path} holds {self.meta['count']} rows, not {count}")
+            if count == self.meta["count"]:
+                return
+
+            logger.warning(f"Dropping {self.meta['count'] - count} rows after row {count} from {self.path}")
+            with open(self._file(PATHS_FILE), "rb") as f:
+                data = f.read(self.meta["paths_bytes"])
+            self.meta["count"] = count
+            self.meta["paths_bytes"] = sum(map(len, data.splitlines(keepends=True)[:count]))
+            if self.meta["index"] is not None and self.meta["index"]["rows"] > count:
+                self.meta["index"] = None
+                self._index = None
+            self._matrix = None
+            self._paths = None
+            self._rows = None
+            self._write_meta()
+            self._truncate(warn=False)
+
+    def _write_meta(self):
+        tmp_path = self._file(f"{META_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file(META_FILE))
+
+    def close(self):
+        self.flush()
+
+    def matrix(self):
+        if self._matrix is None:
+            count = len(self)
+            if count == 0:
+                return np.empty((0, self.dim or 0), dtype=np.float16)
+            self._matrix = np.memmap(self._file(VECTORS_FILE), dtype=np.float16, mode="r", shape=(count, self.dim))
+        return self._matrix
+
+    def paths(self):
+        if self._paths is None:
+            if self.meta["paths_bytes"] == 0:
+                self._paths = []
+                return self._paths
+            with open(self._file(PATHS_FILE), "rb") as f:
+                data = f.read(self.meta["paths_bytes"])
+            self._paths = [json.loads(line) for line in data.decode("utf-8").splitlines()]
+        return self._paths
+
+    def find(self, image_path):
+        if self._rows is None:
+            self._rows = {path: row for row, path in enumerate(self.paths())}
+        return self._rows[os.fspath(image_path)]
+
+    def vector(self, row):
+        return np.asarray(self.matrix()[row], dtype=np.float32)
+
+    def search(self, queries, k=10, exact=False, nprobe=None, refine=10):
+        """Top-k rows by cosine similarity as (scores, indices), each (queries, k); missing hits are -1.
+
+        Uses the IVF-PQ index when one has been built, re-scoring its k * refine best candidates
+        against the stored vectors, and exact search over rows added after the index.
+        """
+        queries = normalize(queries)
+        count = len(self)
+        index = None if exact else self._load_index()
+        if index is None:
+            return search_matrix(self.matrix(), queries, k)
+
+        if nprobe is not None:
+            index.nprobe = nprobe
+        index_rows = self.meta["index"]["rows"]
+        _, indices = index.search(queries, k * max(refine, 1))
+        # PQ codes only approximate the vectors; the float16 rows are a cheap gather away
+        candidates = np.asarray(self.matrix()[np.maximum(indices, 0)], dtype=np.float32)
+        scores = np.einsum("qkd,qd->qk", candidates, queries)
+        scores = np.where(indices >= 0, scores, -np.inf).astype(np.float32)
+        scores, indices = merge_topk(scores, indices, k)
+        if index_rows < count:
+            tail_scores, tail_indices = search_matrix(self.matrix()[index_rows:], queries, k, offset=index_rows)
+            scores, indices = merge_topk(np.concatenate([scores, tail_scores], axis=1),
+                                         np.concatenate([indices, tail_indices], axis=1), k)
+        return scores, indices
+
+    def neighbours(self, query, k=10, min_similarity=None, exact=False):
+        """Nearest stored images to a stored image path or an embedding vector, most similar first."""
+        if isinstance(query, (str, os.PathLike)):
+            row = self.find(query)
+            scores, indices = self.search(self.vector(row), k + 1, exact)
+            hits = [(score, index) for score, index in zip(scores[0], indices[0]) if index != row][:k]
+        else:
+            scores, indices = self.search(query, k, exact)
+            hits = list(zip(scores[0], indices[0]))
+
+        paths = self.paths()
+        return [
+            {"image_path": paths[index], "similarity": float(score)}
+            for score, index in hits
+            if index >= 0 and (min_similarity is None or score >= min_similarity)
+        ]
+
+    def build_index(self, nlist=None, m=64, nbits=8, train_size=None, nprobe=16, seed=0):
+        """Train and save a faiss IVF-PQ index over the stored rows, for stores too large to scan."""
+        faiss = _import_faiss()
+        self.flush()
+        count, dim = len(self), self.dim
+        if dim % m:
+            raise ValueError(f"m={m} must divide the embedding size {dim}")
+        nlist = nlist or max(1, int(4 * math.sqrt(count)))
+        train_size = min(count, train_size or max(64 * nlist, 256 * 40))
+        if train_size < max(nlist, 2 ** nbits):
+            raise ValueError(f"{count} rows are too few to train nlist={nlist}, nbits={nbits}")
+
+        matrix = self.matrix()
+        sample = np.sort(np.random.default_rng(seed).choice(count, train_size, replace=False))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, faiss.METRIC_INNER_PRODUCT)
+        logger.info(f"Training IVF-PQ index (nlist={nlist}, m={m}, nbits={nbits}) on {train_size} rows")
+        index.train(np.asarray(matrix[sample], dtype=np.float32))
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            index.add(np.asarray(matrix[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32))
+        index.nprobe = nprobe
+
+        tmp_path = self._file(f"{INDEX_FILE}.tmp")
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, self._file(INDEX_FILE))
+        with self._lock:
+            self.meta["index"] = {"rows": count, "nlist": nlist, "m": m, "nbits": nbits, "nprobe": nprobe}
+            self._write_meta()
+        self._index = index
+        return index
+
+    def _load_index(self):
+        if self.meta["index"] is None:
+            return None
+        if self._index is None:
+            faiss = _import_faiss()
+            self._index = faiss.read_index(self._file(INDEX_FILE))
+            self._index.nprobe = self.meta["index"]["nprobe"]
+        return self._index
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search an embedding store written by nsfw_cli.py --embeddings")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Find stored images similar to a stored path or a new image")
+    search.add_argument("store", help="Embedding store directory")
+    query = search.add_mutually_exclusive_group(required=True)
+    query.add_argument("--path", help="Image path as stored in the store")
+    query.add_argument("--image", help="Image file to embed with the model")
+    search.add_argument("-k", type=int, default=20)
+    search.add_argument("--min-similarity", type=float)
+    search.add_argument("--exact", action="store_true", help="Ignore the IVF-PQ index")
+    search.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    search.add_argument("--backend", default="tf")
+
+    index = commands.add_parser("index", help="Build an IVF-PQ index (requires faiss)")
+    index.add_argument("store", help="Embedding store directory")
+    index.add_argument("--nlist", type=int, help="Inverted lists (default 4 * sqrt(rows))")
+    index.add_argument("--m", type=int, default=64, help="PQ sub-quantizers; must divide the embedding size")
+    index.add_argument("--nbits", type=int, default=8)
+    index.add_argument("--nprobe", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    store = EmbeddingStore(args.store)
+    if args.command == "index":
+        store.build_index(args.nlist, args.m, args.nbits, nprobe=args.nprobe)
+        print(f"Indexed {len(store)} rows")
+        return 0
+
+    if args.image:
+        from nsfw_detector import NSFWDetector
+
+        detector = NSFWDetector(args.model_path, backend=args.backend, embeddings=True)
+        if store.meta["model_identity"] not in (None, detector.model_identity()):
+            logger.warning(f"Store was built with {store.meta['model_identity']}, querying with {detector.model_identity()}")
+        query = detector.predict(args.image, return_embedding=True)["embedding"]
+    else:
+        query = args.path
+
+    for hit in store.neighbours(query, args.k, args.min_similarity, args.exact):
+        print(f"{hit['similarity']:.4f}\t{hit['image_path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
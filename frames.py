@@ -0,0 +1,252 @@
+import io
+import logging
+import os
+from collections import namedtuple
+
+from decode_guard import ImageTooLarge, decoded_bytes
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi')
+SAMPLING_METHODS = ("uniform", "keyframe", "scene")
+AGGREGATIONS = ("max", "mean", "topk")
+NSFW_CLASSES = ("hentai", "porn", "sexy")
+
+Frame = namedtuple("Frame", ["index", "time", "image"])
+
+
+def _import_av():
+    try:
+        import av
+    except ImportError:
+        raise ImportError("Video input requires PyAV (pip install av)")
+    return av
+
+
+def is_video(image_input):
+    return isinstance(image_input, (str, os.PathLike)) and os.fspath(image_input).lower().endswith(VIDEO_EXTENSIONS)
+
+
+def uniform_indices(count, max_frames):
+    if count <= max_frames:
+        return list(range(count))
+    # Centre each sample in its segment so the first and last frames (often fades) are not favoured
+    return sorted(set(int(i) for i in (np.arange(max_frames) + 0.5) * count / max_frames))
+
+
+def scene_signature(image):
+    return np.asarray(image.convert('L').resize((32, 32)), dtype=np.float32) / 255.0
+
+
+class FrameThinner:
+    """Keeps an evenly spaced subset of a frame stream of unknown length in bounded memory."""
+
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+        self.stride = 1
+        self.seen = 0
+        self.frames = []
+
+    def offer(self, frame):
+        if self.seen % self.stride == 0:
+            self.frames.append(frame)
+            if len(self.frames) >= 2 * self.max_frames:
+                self.frames = self.frames[::2]
+                self.stride *= 2
+        self.seen += 1
+
+    def result(self):
+        return [self.frames[i] for i in uniform_indices(len(self.frames), self.max_frames)]
+
+
+class PacedSampler:
+    """Streaming alternative to FrameThinner for streams of known length: the k-th kept frame must
+    lie at least k/max_frames of the way through, so frames are spread over the whole stream yet can
+    be yielded as soon as they are decoded."""
+
+    def __init__(self, length, max_frames):
+        self.length = length
+        self.max_frames = max_frames
+        self.kept = 0
+
+    @property
+    def done(self):
+        return self.kept >= self.max_frames
+
+    def wants(self, position):
+        # Untimed frames cannot be placed, so they are taken while there is room
+        return not self.done and (position is None or position >= self.kept * self.length / self.max_frames)
+
+    def offer(self, position):
+        if not self.wants(position):
+            return False
+        self.kept += 1
+        return True
+
+
+class SceneDetector:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self._last = None
+
+    def is_new_scene(self, image):
+        signature = scene_signature(image)
+        if self._last is not None and np.abs(signature - self._last).mean() < self.threshold:
+            return False
+        self._last = signature
+        return True
+
+
+def iter_animation_frames(image, sampling="uniform", max_frames=16, input_size=(224, 224), scene_threshold=0.1,
+                          decode_guard=None):
+    count = getattr(image, "n_frames", 1)
+
+    def frame_at(index):
+        image.seek(index)
+        if decode_guard is None:
+            return Frame(index, None, image.convert('RGB').resize(input_size))
+        with decode_guard.reserve(decoded_bytes(image)):
+            return Frame(index, None, image.convert('RGB').resize(input_size))
+
+    if sampling != "scene":
+        # Animated GIF/WebP frames carry no keyframe flag, so keyframe sampling is uniform here
+        for index in uniform_indices(count, max_frames):
+            yield frame_at(index)
+        return
+
+    scenes = SceneDetector(scene_threshold)
+    sampler = PacedSampler(count, max_frames)
+    for index in range(count):
+        if sampler.done:
+            break
+        frame = frame_at(index)
+        if scenes.is_new_scene(frame.image) and sampler.offer(index):
+            yield frame
+
+
+def iter_video_frames(source, sampling="uniform", max_frames=16, input_size=(224, 224), scene_threshold=0.1,
+                      decode_guard=None):
+    av = _import_av()
+    if decode_guard is not None:
+        decode_guard.check_input(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    container = av.open(source)
+    try:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        to_image = _frame_converter(stream, decode_guard)
+
+        duration = None
+        if stream.duration is not None:
+            duration = float(stream.duration * stream.time_base)
+        elif container.duration is not None:
+            duration = container.duration / av.time_base
+
+        if sampling == "uniform" and duration:
+            yield from _seek_uniform(container, stream, duration, max_frames, input_size, to_image)
+            return
+
+        if sampling == "keyframe":
+            stream.codec_context.skip_frame = "NONKEY"
+        scenes = SceneDetector(scene_threshold) if sampling == "scene" else None
+        if not duration:
+            # Without a duration the spread needs the whole stream, so this path still buffers
+            yield from _thin_stream(container, stream, sampling, max_frames, input_size, scenes, to_image)
+            return
+
+        # Frames are yielded as they are decoded, so an early stop also stops decoding
+        sampler = PacedSampler(duration, max_frames)
+        for index, frame in enumerate(container.decode(stream)):
+            if sampler.done:
+                break
+            if scenes is None and not sampler.wants(frame.time):
+                continue
+            image = to_image(frame, input_size)
+            if (scenes is None or scenes.is_new_scene(image)) and sampler.offer(frame.time):
+                yield Frame(None if sampling == "keyframe" else index, frame.time, image)
+    finally:
+        container.close()
+
+
+def _thin_stream(container, stream, sampling, max_frames, input_size, scenes, to_image):
+    thinner = FrameThinner(max_frames)
+    for index, frame in enumerate(container.decode(stream)):
+        image = to_image(frame, input_size)
+        if scenes is None or scenes.is_new_scene(image):
+            thinner.offer(Frame(None if sampling == "keyframe" else index, frame.time, image))
+    return thinner.result()
+
+
+def _frame_converter(stream, decode_guard):
+    if decode_guard is None:
+        return lambda frame, input_size: frame.to_image().resize(input_size)
+
+    width, height = stream.codec_context.width, stream.codec_context.height
+    decode_guard.check_pixels((width, height))
+    # The decoded YUV 4:2:0 frame plus the RGB copy made by to_image()
+    frame_bytes = width * height * 3 // 2 + width * height * 3
+
+    def to_image(frame, input_size):
+        with decode_guard.reserve(frame_bytes):
+            return frame.to_image().resize(input_size)
+    return to_image
+
+
+def _seek_uniform(container, stream, duration, max_frames, input_size, to_image):
+    last_time = None
+    for target in (np.arange(max_frames) + 0.5) * duration / max_frames:
+        container.seek(int(target / stream.time_base), stream=stream, backward=True)
+        for frame in container.decode(stream):
+            if frame.time is None or frame.time >= target - 1e-3:
+                if frame.time != last_time:
+                    last_time = frame.time
+                    yield Frame(None, frame.time, to_image(frame, input_size))
+                break
+
+
+def iter_frames(image_input, sampling="uniform", max_frames=16, input_size=(224, 224), scene_threshold=0.1,
+                decode_guard=None):
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown frame sampling method: {sampling}")
+    if is_video(image_input):
+        return iter_video_frames(image_input, sampling, max_frames, input_size, scene_threshold, decode_guard)
+
+    from nsfw_detector import load_image
+
+    try:
+        if decode_guard is None:
+            image = load_image(image_input)
+        else:
+            # Animation frames are never drafted; each one is held against the memory budget as it is decoded
+            image = decode_guard.open(image_input, input_size, fast_decode=False)
+    except ImageTooLarge:
+        raise
+    except Exception:
+        if isinstance(image_input, (bytes, bytearray, memoryview)) or hasattr(image_input, 'read'):
+            # Not an image Pillow knows; let PyAV try it as a video container
+            if hasattr(image_input, 'seek'):
+                image_input.seek(0)
+            return iter_video_frames(image_input, sampling, max_frames, input_size, scene_threshold, decode_guard)
+        raise
+    return iter_animation_frames(image, sampling, max_frames, input_size, scene_threshold, decode_guard)
+
+
+def aggregate_scores(rows, nsfw_columns, method="max", top_k=3):
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown frame aggregation: {method}")
+
+    nsfw_scores = rows[:, nsfw_columns].sum(axis=1)
+    worst = int(nsfw_scores.argmax())
+    if method == "max":
+        row = rows[worst]
+    elif method == "mean":
+        row = rows.mean(axis=0)
+    else:
+        row = rows[np.argsort(nsfw_scores)[-top_k:]].mean(axis=0)
+    return row, worst, nsfw_scores
@@ -0,0 +1,57 @@
+import multiprocessing
+import os
+
+# gunicorn -c gunicorn.conf.py api_server:app
+#
+# Each worker process runs its own MicroBatcher and inference backend, but all
+# workers share one copy of the model weights: the TFLite file is memory-mapped
+# read-only and the builtin kernels read the weights from the mapping, so every
+# worker maps the same page-cache pages. XNNPACK would repack the weights into
+# private memory in each worker, and so would the multithreaded float
+# convolution, so workers run without XNNPACK and with one inference thread.
+# The CPU is used through worker processes instead. benchmark_serving.py shows
+# the per-worker memory.
+
+cpu_count = multiprocessing.cpu_count()
+
+bind = os.environ.get("NSFW_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("NSFW_WORKERS", cpu_count))
+worker_class = "gthread"
+threads = int(os.environ.get("NSFW_HTTP_THREADS", 4))
+timeout = int(os.environ.get("NSFW_TIMEOUT", 120))
+
+# Importing api_server is cheap (no model, no TensorFlow), so the app is
+# imported once in the master and each worker loads its model after the fork.
+preload_app = True
+
+os.environ.setdefault("NSFW_BACKEND", "tflite")
+os.environ.setdefault("NSFW_TFLITE_XNNPACK", "0")
+os.environ.setdefault("NSFW_NUM_THREADS", "1")
+
+
+def on_starting(server):
+    # Convert the model once, before any worker starts, in a separate process
+    # so the master never imports TensorFlow.
+    from backends import SHARED_WEIGHT_BACKENDS, prepare_backend
+
+    backend = os.environ["NSFW_BACKEND"]
+    for name in filter(None, (backend, os.environ.get("NSFW_CASCADE_BACKEND"))):
+        if name not in SHARED_WEIGHT_BACKENDS:
+            raise RuntimeError(f"The {name} backend loads a private copy of the model in every worker; "
+                               f"use one of {', '.join(SHARED_WEIGHT_BACKENDS)} under gunicorn")
+    if os.environ["NSFW_TFLITE_XNNPACK"].lower() not in ("0", "false", "no") or int(os.environ["NSFW_NUM_THREADS"]) > 1:
+        server.log.warning("XNNPACK or NSFW_NUM_THREADS > 1 keeps a private copy of the weights in every worker")
+
+    model_path = os.environ.get("NSFW_MODEL_PATH", "models/mobilenet_v2_140_224")
+    process = multiprocessing.get_context("spawn").Process(target=prepare_backend, args=(backend, model_path))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Could not prepare the {backend} model in {model_path}")
+    server.log.info(f"Model ready: {model_path} ({backend}, shared by {workers} workers)")
+
+
+def post_fork(server, worker):
+    import api_server
+
+    api_server.start_model_loading()
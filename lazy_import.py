@@ -0,0 +1,31 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Imports the wrapped module on first attribute access, then behaves like it."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__module = None
+
+    def _load(self):
+        if self.__module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+            self.__module = module
+        return self.__module
+
+    def __getattr__(self, attr):
+        return getattr(LazyModule._load(self), attr)
+
+    def __dir__(self):
+        return dir(LazyModule._load(self))
+
+    def __repr__(self):
+        state = "loaded" if self.__module is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
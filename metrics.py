@@ -0,0 +1,297 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Error collecting metric {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def enable(enabled=True, registry=REGISTRY):
+    registry.enabled = enabled
+
+
+def enabled(registry=REGISTRY):
+    return registry.enabled
+
+
+class _NoOp:
+    # Shared child handed out while metrics are disabled, so instrumented code pays one call
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    @contextlib.contextmanager
+    def time(self):
+        yield
+
+    @contextlib.contextmanager
+    def track_inprogress(self):
+        yield
+
+
+_NOOP = _NoOp()
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        self._children = {}
+        self._lookup = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def labels(self, *values, **labels):
+        if not self._registry.enabled:
+            return _NOOP
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        child = self._lookup.get(values)
+        if child is None:
+            child = self._create_child(values)
+        return child
+
+    def _create_child(self, values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        # 200 and "200" are the same series; _lookup just skips the str() calls on the hot path
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.setdefault(key, self._new_child())
+            self._lookup[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+    @contextlib.contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in self._items():
+            yield f"{self.name}_total", _format_labels(self.labelnames, values), child.value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def track_inprogress(self):
+        return self.labels().track_inprogress()
+
+    def samples(self):
+        for values, child in self._items():
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for values, child in self._items():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, values, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, values), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, values), cumulative
+
+
+class CallbackMetric(_Metric):
+    """Reads its value at scrape time, for counters that other components already keep."""
+
+    def __init__(self, name, documentation, kind, callback, labelnames=(), registry=REGISTRY):
+        self.kind = kind
+        self.callback = callback
+        super().__init__(name, documentation, labelnames, registry)
+
+    def samples(self):
+        value = self.callback()
+        if value is None:
+            return
+        name = f"{self.name}_total" if self.kind == "counter" else self.name
+        values = value if isinstance(value, dict) else {(): value}
+        for label_values, sample in values.items():
+            if sample is not None:
+                yield name, _format_labels(self.labelnames, label_values), sample
+
+
+STAGE_SECONDS = Histogram(
+    "nsfw_stage_duration_seconds",
+    "Time per call of each pipeline stage (per image for decode, preprocess, postprocess and queue_wait; "
+    "per batch for normalize and inference)",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+STAGE_ITEMS = Counter("nsfw_stage_items", "Images processed by each pipeline stage", ["stage"])
+BATCH_SIZE = Histogram("nsfw_inference_batch_size", "Images per model call", buckets=BATCH_SIZE_BUCKETS)
+
+
+class MetricsTimings:
+    """Drop-in for StageTimings that feeds the stage histograms instead of keeping totals."""
+
+    def add(self, stage, seconds, count=1):
+        STAGE_SECONDS.labels(stage).observe(seconds)
+        STAGE_ITEMS.labels(stage).inc(count)
+        if stage == "inference":
+            BATCH_SIZE.observe(count)
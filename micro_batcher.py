@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from nsfw_detector import BatchBuffer
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+QUEUE_WAIT_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+def _bucket_label(value, buckets):
+    for bound in buckets:
+        if value <= bound:
+            return f"<={bound}"
+    return f">{buckets[-1]}"
+
+
+class MicroBatcher:
+    def __init__(self, detector, max_batch_size=32, max_wait_ms=5, max_queue_size=1024):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker = None
+        self._buffer = BatchBuffer(max_batch_size, detector.input_size)
+        self._stats_lock = threading.Lock()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._requests = 0
+        self._batches = 0
+        self._batched_requests = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._batch_size_histogram = {}
+        self._queue_depth_histogram = {}
+        self._queue_wait_histogram = {}
+
+    def start(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name="nsfw-micro-batcher", daemon=True)
+        self._worker.start()
+        logger.info(f"Micro-batcher started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms})")
+
+    def stop(self, timeout=None):
+        if self._worker is None:
+            return
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        self._worker = None
+
+    def submit(self, image_input):
+        future = Future()
+        try:
+            prepared = self.detector.prepare(image_input)
+            if prepared.scores is not None:
+                future.set_result(self.detector.format_prediction(prepared.scores))
+                return future
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+            label = _bucket_label(depth, QUEUE_DEPTH_BUCKETS)
+            self._queue_depth_histogram[label] = self._queue_depth_histogram.get(label, 0) + 1
+        self._queue.put((prepared, future, time.perf_counter()))
+        return future
+
+    def predict(self, image_input, timeout=None):
+        return self.submit(image_input).result(timeout)
+
+    def _collect_batch(self, first_item):
+        batch = [first_item]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch, stopping = self._collect_batch(item)
+            self._run_batch(batch)
+            if stopping:
+                break
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        with self._stats_lock:
+            self._batches += 1
+            size = len(batch)
+            self._batched_requests += size
+            self._batch_size_histogram[size] = self._batch_size_histogram.get(size, 0) + 1
+            for _, _, enqueued in batch:
+                label = _bucket_label((started - enqueued) * 1000.0, QUEUE_WAIT_MS_BUCKETS)
+                self._queue_wait_histogram[label] = self._queue_wait_histogram.get(label, 0) + 1
+        timings = self.detector.timings
+        if timings is not None:
+            for _, _, enqueued in batch:
+                timings.add("queue_wait", started - enqueued)
+
+        try:
+            for row, (prepared, _, _) in enumerate(batch):
+                self._buffer.pixels[row] = prepared.pixels
+            pred_array = self.detector.run_model(self.detector.normalize_batch(self._buffer, len(batch)))
+        except Exception as e:
+            logger.error(f"Micro-batch prediction error for {len(batch)} requests: {e}")
+            with self._stats_lock:
+                self._errors += len(batch)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self.detector.remember_batch([prepared for prepared, _, _ in batch], pred_array)
+        for (_, future, _), pred_row in zip(batch, pred_array):
+            future.set_result(self.detector.format_prediction(pred_row))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": self._batches,
+                "errors": self._errors,
+                "mean_batch_size": self._batched_requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self._batch_size_histogram.items())},
+                "queue_depth_histogram": dict(self._queue_depth_histogram),
+                "queue_wait_ms_histogram": dict(self._queue_wait_histogram),
+            }
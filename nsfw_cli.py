@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Bulk NSFW scanner
+
+Classifies files, directories and manifests (one path per line) with NSFWDetector,
+reporting live throughput and a per-stage latency breakdown.
+
+    python nsfw_cli.py /data/images --batch-size 64 --workers 4 -o results.jsonl
+    python nsfw_cli.py --manifest paths.txt --format csv -o results.csv --checkpoint scan.ckpt
+    python nsfw_cli.py /data/images -o results.jsonl --embeddings embeddings/
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+
+from cascade import build_cascade
+from embeddings import EmbeddingStore
+from nsfw_detector import NSFWDetector, StageTimings, iter_image_files
+from scanner import ResultWriter, ScanCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+def iter_manifest(path):
+    manifest = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in manifest:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if manifest is not sys.stdin:
+            manifest.close()
+
+
+def iter_inputs(paths, manifest=None, recursive=True):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_image_files(path, recursive=recursive)
+        else:
+            yield path
+    if manifest:
+        yield from iter_manifest(manifest)
+
+
+def count_inputs(paths, manifest=None, recursive=True):
+    return sum(1 for _ in iter_inputs(paths, manifest, recursive))
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+class ProgressReporter:
+    def __init__(self, total=None, interval=1.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.started = time.perf_counter()
+        self._last_report = 0.0
+        self.done = 0
+        self.errors = 0
+        self.flagged = 0
+
+    def update(self, row):
+        self.done += 1
+        if "error" in row:
+            self.errors += 1
+        elif row["is_nsfw"]:
+            self.flagged += 1
+
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report(now)
+
+    def report(self, now=None):
+        if self.stream is None:
+            return
+        elapsed = (now or time.perf_counter()) - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"\r{self.done}"
+        if self.total:
+            line += f"/{self.total} ({self.done / self.total:.1%})"
+        line += f" images  {rate:.1f} img/s  elapsed {format_duration(elapsed)}"
+        if self.total and rate > 0:
+            line += f"  ETA {format_duration((self.total - self.done) / rate)}"
+        self.stream.write(line)
+        self.stream.flush()
+
+    def summary(self, timings, cascade=None):
+        if self.stream is None:
+            return
+        elapsed = time.perf_counter() - self.started
+        self.report()
+        lines = [
+            "",
+            f"Images: {self.done}  NSFW: {self.flagged}  Errors: {self.errors}",
+            f"Wall time: {format_duration(elapsed)} ({self.done / elapsed if elapsed > 0 else 0.0:.1f} img/s)",
+            "Latency breakdown:",
+        ]
+        for stage in ("decode", "preprocess", "normalize", "inference", "postprocess"):
+            stats = timings.get(stage)
+            if stats is None:
+                continue
+            lines.append(f"  {stage:<11} {stats['total_s']:9.2f} s total  {stats['mean_ms']:8.2f} ms/image")
+        if cascade is not None:
+            lines.append(f"Cascade: {cascade['escalated']}/{cascade['images']} images "
+                         f"({cascade['escalation_rate']:.1%}) sent to the full model")
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Bulk NSFW scanner")
+    parser.add_argument("inputs", nargs="*", help="Image files or directories")
+    parser.add_argument("--manifest", help="File with one image path per line ('-' for stdin)")
+    parser.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    parser.add_argument("--backend", default="tf", help="Inference backend (tf, tflite, tflite-float16, tflite-int8, onnx)")
+    parser.add_argument("--num-threads", type=int, help="Inference threads")
+    parser.add_argument("--cascade-backend", help="Enable a cheap first stage with this backend (e.g. tflite-int8)")
+    parser.add_argument("--cascade-model-path", help="First-stage model (defaults to --model-path)")
+    parser.add_argument("--cascade-input-size", type=int, help="First-stage input resolution; must match the input shape of --cascade-model-path")
+    parser.add_argument("--cascade-band", nargs=2, type=float, default=(0.1, 0.9), metavar=("LOW", "HIGH"),
+                        help="First-stage NSFW scores in this band go to the full model")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=0, help="Decode workers (0 decodes on the main thread)")
+    parser.add_argument("--worker-type", choices=["thread", "process"], default="thread")
+    parser.add_argument("--threshold", type=float, default=0.5, help="NSFW score threshold for is_nsfw")
+    parser.add_argument("--format", dest="output_format", choices=["jsonl", "csv"], help="Output format")
+    parser.add_argument("-o", "--output", default="-", help="Output file ('-' for stdout)")
+    parser.add_argument("--embeddings", help="Also store penultimate-layer embeddings in this directory for similarity search")
+    parser.add_argument("--checkpoint", help="Checkpoint file for resuming an interrupted run")
+    parser.add_argument("--checkpoint-every", type=int, default=256)
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", help="Do not descend into subdirectories")
+    parser.add_argument("--no-count", dest="count", action="store_false", help="Skip the counting pass (disables ETA)")
+    parser.add_argument("--progress-interval", type=float, default=1.0)
+    parser.add_argument("--quiet", action="store_true", help="No progress or summary output")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.inputs and not args.manifest:
+        print("No inputs given (pass files, directories or --manifest)", file=sys.stderr)
+        return 2
+    if args.manifest == "-" and args.count:
+        args.count = False
+
+    logging.getLogger().setLevel(logging.WARNING if args.quiet else logging.INFO)
+
+    state = ScanCheckpoint(args.checkpoint) if args.checkpoint else None
+    skip = state.completed if state is not None else 0
+
+    total = count_inputs(args.inputs, args.manifest, args.recursive) - skip if args.count else None
+    timings = StageTimings()
+    cascade = None
+    if args.cascade_backend:
+        cascade = build_cascade(args.cascade_model_path or args.model_path, args.cascade_backend,
+                                args.cascade_input_size, *args.cascade_band, num_threads=args.num_threads)
+    detector = NSFWDetector(
+        args.model_path,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        worker_type=args.worker_type,
+        timings=timings,
+        backend=args.backend,
+        num_threads=args.num_threads,
+        cascade=cascade,
+        embeddings=bool(args.embeddings)
+    )
+    store = None
+    if args.embeddings:
+        # Rows are only flushed at checkpoints, and a resume drops any that outlived the last checkpoint
+        store = EmbeddingStore(args.embeddings, model_identity=detector.model_identity(), flush_rows=None)
+        if state is not None and "embedding_rows" in state.extra:
+            store.truncate(state.extra["embedding_rows"])
+
+    writer = ResultWriter(args.output, args.output_format, append=skip > 0, threshold=args.threshold)
+    progress = ProgressReporter(total=total, interval=args.progress_interval, stream=None if args.quiet else sys.stderr)
+    image_paths = itertools.islice(iter_inputs(args.inputs, args.manifest, args.recursive), skip, None)
+    completed = skip
+    last_path = None
+
+    def save_checkpoint():
+        writer.flush()
+        extra = {}
+        if store is not None:
+            store.flush()
+            extra["embedding_rows"] = len(store)
+        if state is not None and last_path is not None:
+            state.save(last_path, completed, **extra)
+
+    try:
+        for result in detector.iter_predict(image_paths, return_embedding=store is not None):
+            writer.write(result)
+            if store is not None and "embedding" in result:
+                store.add(result["image_path"], result["embedding"])
+            progress.update(writer.last_row)
+            last_path = result["image_path"]
+            completed += 1
+            if (completed - skip) % args.checkpoint_every == 0:
+                save_checkpoint()
+    except KeyboardInterrupt:
+        logger.warning(f"Interrupted after {completed} images")
+        return 130
+    finally:
+        save_checkpoint()
+        writer.close()
+        detector.close()
+        progress.summary(timings.snapshot(), cascade.stats() if cascade is not None else None)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,356 @@
-import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from PIL import Image
+import io
 import os
 import logging
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from lazy_import import lazy_import
+from prediction_batch import DEFAULT_CHUNK_SIZE, PredictionBatch, format_prediction, iter_prediction_batches
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
+
+PreparedImage = namedtuple("PreparedImage", ["cache_key", "image_hash", "scores", "pixels"])
+
+class StageTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+            self._counts = {}
+    
+    def add(self, stage, seconds, count=1):
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + count
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    "total_s": total,
+                    "count": self._counts[stage],
+                    "mean_ms": total / self._counts[stage] * 1000.0 if self._counts[stage] else 0.0
+                }
+                for stage, total in self._totals.items()
+            }
+
+class BatchBuffer:
+    def __init__(self, batch_size, input_size):
+        width, height = input_size
+        self.pixels = np.empty((batch_size, height, width, 3), dtype=np.uint8)
+        self.inputs = np.empty((batch_size, height, width, 3), dtype=np.float32)
+    
+    def __len__(self):
+        return len(self.pixels)
+    
+    def normalize(self, count):
+        inputs = self.inputs[:count]
+        np.divide(self.pixels[:count], np.float32(255.0), out=inputs, dtype=np.float32)
+        return inputs
+
+def load_image(image_input):
+    if isinstance(image_input, Image.Image):
+        return image_input
+    if isinstance(image_input, (str, os.PathLike)):
+        return Image.open(image_input)
+    if isinstance(image_input, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image_input))
+    if isinstance(image_input, np.ndarray):
+        return _image_from_array(image_input)
+    if hasattr(image_input, 'read'):
+        return Image.open(image_input)
+    raise TypeError(f"Unsupported image input type: {type(image_input).__name__}")
+
+def input_label(image_input):
+    # Short printable name for an input: paths as given, a summary for in-memory images
+    if isinstance(image_input, (str, os.PathLike)):
+        return image_input
+    if isinstance(image_input, (bytes, bytearray)):
+        return f"<bytes len={len(image_input)}>"
+    if isinstance(image_input, memoryview):
+        return f"<bytes len={image_input.nbytes}>"
+    if isinstance(image_input, Image.Image):
+        return f"<PIL.Image {image_input.mode} {image_input.width}x{image_input.height}>"
+    if isinstance(image_input, np.ndarray):
+        return f"<ndarray shape={image_input.shape} dtype={image_input.dtype}>"
+    name = getattr(image_input, 'name', None)
+    if isinstance(name, str) and name:
+        return name
+    return f"<{type(image_input).__name__}>"
+
+def _image_from_array(image_array):
+    if image_array.ndim == 3 and image_array.shape[-1] == 1:
+        image_array = image_array[..., 0]
+    if image_array.ndim not in (2, 3) or (image_array.ndim == 3 and image_array.shape[-1] not in (3, 4)):
+        raise ValueError(f"Unsupported image array shape: {image_array.shape}")
+    if np.issubdtype(image_array.dtype, np.floating):
+        # Float arrays are taken to be in [0, 1]; integer arrays are already pixel values
+        image_array = np.clip(image_array * 255.0, 0, 255).astype(np.uint8)
+    elif image_array.dtype != np.uint8:
+        image_array = np.clip(image_array, 0, 255).astype(np.uint8)
+    return Image.fromarray(image_array)
+
+def decode_image(image_input, input_size, fast_decode=True):
+    if isinstance(image_input, Image.Image):
+        image = image_input
+    else:
+        image = load_image(image_input)
+        if fast_decode:
+            image.draft('RGB', input_size)
+    image.load()
+    
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    return image
+
+def resize_pixels(image, input_size, out=None, box=None):
+    image = image.resize(input_size, box=box)
+    
+    if out is None:
+        return np.asarray(image, dtype=np.uint8)
+    
+    out[...] = np.asarray(image, dtype=np.uint8)
+    return out
+
+def iter_image_files(root, recursive=True, extensions=SUPPORTED_EXTENSIONS, resume_after=None):
+    resume_parts = tuple(resume_after.replace(os.sep, "/").split("/")) if resume_after else None
+    yield from _walk_directory(root, (), recursive, tuple(extensions), resume_parts)
+
+def _walk_directory(directory, parts, recursive, extensions, resume_parts):
+    try:
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError as e:
+        logger.error(f"Error scanning directory {directory}: {e}")
+        return
+    
+    for entry in entries:
+        entry_parts = parts + (entry.name,)
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        
+        if is_dir:
+            if not recursive:
+                continue
+            if resume_parts is not None and entry_parts < resume_parts[:len(entry_parts)]:
+                continue
+            yield from _walk_directory(entry.path, entry_parts, recursive, extensions, resume_parts)
+        elif entry.name.lower().endswith(extensions):
+            if resume_parts is not None and entry_parts <= resume_parts:
+                continue
+            yield entry.path
+
+def _decode_worker(image_input, input_size, fast_decode, hash_method, decode_guard=None):
+    if decode_guard is None:
+        return _decode_and_resize(image_input, input_size, fast_decode, hash_method)
+    with decode_guard.decoding(image_input, input_size, fast_decode) as image:
+        return _decode_and_resize(image, input_size, fast_decode, hash_method)
+
+def _decode_and_resize(image_input, input_size, fast_decode, hash_method):
+    start = time.perf_counter()
+    image = decode_image(image_input, input_size, fast_decode)
+    decoded = time.perf_counter()
+    image_hash = None
+    if hash_method is not None:
+        from phash_index import HASH_FUNCTIONS
+        image_hash = HASH_FUNCTIONS[hash_method](image)
+    pixels = resize_pixels(image, input_size)
+    return image_hash, pixels, decoded - start, time.perf_counter() - decoded
+
 class NSFWDetector:
-    def __init__(self, model_path="models/mobilenet_v2_140_224"):
+    def __init__(self, model_path="models/mobilenet_v2_140_224", batch_size=32, cache=None, phash_index=None, fast_decode=True,
+                 num_workers=0, worker_type="thread", prefetch_batches=2, timings=None,
+                 backend="tf", num_threads=None, backend_options=None, input_size=(224, 224), cascade=None,
+                 decode_guard=None, embeddings=False):
+        if embeddings and cascade is not None:
+            raise ValueError("Embeddings need the full model for every image and cannot be combined with a cascade")
         self.model_path = model_path
         self.model = None
+        self.backend = backend
+        self.num_threads = num_threads
+        self.backend_options = backend_options or {}
         self.classes = ["drawings", "hentai", "neutral", "porn", "sexy"]
-        self.input_size = (224, 224)
+        self.input_size = tuple(input_size)
+        self.batch_size = batch_size
+        self.cache = cache
+        self.phash_index = phash_index
+        self.fast_decode = fast_decode
+        self.num_workers = num_workers
+        self.worker_type = worker_type
+        self.prefetch_batches = prefetch_batches
+        self.timings = timings
+        self.cascade = cascade
+        self.decode_guard = decode_guard
+        self.embeddings = embeddings
+        self._embedding_size = None
+        self._model_identity = None
+        self._free_buffers = threading.local()
+        self._executor = None
+        self._executor_workers = 0
+        self._executor_lock = threading.Lock()
         self.load_model()
     
     def load_model(self):
         try:
             if os.path.exists(self.model_path):
-                self.model = keras.layers.TFSMLayer(self.model_path, call_endpoint='serving_default')
-                logger.info(f"Model loaded successfully: {self.model_path}")
+                from backends import create_backend
+                
+                options = dict(self.backend_options, embeddings=True) if self.embeddings else self.backend_options
+                self.model = create_backend(self.backend, self.model_path, num_threads=self.num_threads, **options)
+                self._check_input_size()
+                logger.info(f"Model loaded successfully: {self.model_path} ({self.backend})")
             else:
                 raise FileNotFoundError(f"Model file not found: {self.model_path}")
         except Exception as e:
             logger.error(f"Error loading model: {e}")
             raise
     
-    def preprocess_image(self, image_path):
+    def _check_input_size(self):
+        # Backends report the (height, width) the model was exported with; None means any size
+        height, width = getattr(self.model, "input_shape", None) or (None, None)
+        if (height is not None and height != self.input_size[1]) or (width is not None and width != self.input_size[0]):
+            raise ValueError(
+                f"{self.model_path} ({self.backend}) takes {width}x{height} inputs, not "
+                f"{self.input_size[0]}x{self.input_size[1]}; a different input size needs a model trained and "
+                f"exported at that resolution"
+            )
+
+    def model_identity(self):
+        if self._model_identity is None:
+            parts = [os.path.basename(os.path.normpath(self.model_path)), self.backend, "x".join(map(str, self.input_size))]
+            saved_model = os.path.join(self.model_path, "saved_model.pb")
+            if os.path.exists(saved_model):
+                stat = os.stat(saved_model)
+                parts.extend([str(stat.st_size), str(int(stat.st_mtime))])
+            if self.cascade is not None:
+                parts.append(self.cascade.identity())
+            self._model_identity = ":".join(parts)
+        return self._model_identity
+    
+    def _input_bytes(self, image_input):
+        if isinstance(image_input, (bytes, bytearray, memoryview)):
+            return bytes(image_input), image_input
+        if isinstance(image_input, (str, os.PathLike)):
+            with open(image_input, 'rb') as f:
+                data = f.read()
+            return data, data
+        if isinstance(image_input, Image.Image):
+            header = f"{image_input.mode}:{image_input.size}".encode()
+            return header + image_input.tobytes(), image_input
+        if isinstance(image_input, np.ndarray):
+            header = f"{image_input.dtype}:{image_input.shape}".encode()
+            return header + np.ascontiguousarray(image_input).tobytes(), image_input
+        if hasattr(image_input, 'read'):
+            data = image_input.read()
+            return data, data
+        raise TypeError(f"Unsupported image input type: {type(image_input).__name__}")
+    
+    def lookup_cache(self, image_input):
+        if self.cache is None:
+            return None, None, image_input
+        
+        data, image_input = self._input_bytes(image_input)
+        scope = self.model_identity() if self.cache.per_model else ""
+        key = self.cache.make_key(data, scope)
+        if self.embeddings:
+            # Cached scores carry no embedding, so run the model and only write the cache
+            return key, None, image_input
+        return key, self.cache.get(key), image_input
+    
+    def store_cache(self, key, pred_row):
+        if self.cache is not None and key is not None:
+            self.cache.put(key, pred_row)
+    
+    def prepare(self, image_input, out=None):
+        key, cached, image_input = self.lookup_cache(image_input)
+        if cached is not None:
+            return PreparedImage(key, None, cached, None)
+        
+        if self.decode_guard is None:
+            return self._prepare_uncached(key, image_input, out)
+        # Budgets are checked from the header; the reservation lasts until the pixels are resized
+        with self.decode_guard.decoding(image_input, self.input_size, self.fast_decode) as image:
+            return self._prepare_uncached(key, image, out)
+    
+    def _prepare_uncached(self, key, image_input, out):
+        image_hash = None
+        if self.phash_index is not None:
+            image_input = self.decode_image(image_input)
+            image_hash = self.phash_index.compute_hash(image_input)
+            prepared = self._lookup_phash(key, image_hash)
+            if prepared is not None:
+                return prepared
+        
+        return PreparedImage(key, image_hash, None, self.preprocess_pixels(image_input, out=out))
+    
+    def _lookup_phash(self, key, image_hash):
+        scores = None if self.embeddings else self.phash_index.lookup(image_hash)
+        if scores is None:
+            return None
+        self.store_cache(key, scores)
+        return PreparedImage(key, image_hash, scores, None)
+    
+    def remember(self, prepared, pred_row):
+        self.remember_batch([prepared], [pred_row])
+    
+    def remember_batch(self, prepared_items, pred_rows):
+        if self.cache is not None:
+            self.cache.put_many([(prepared.cache_key, pred_row) for prepared, pred_row in zip(prepared_items, pred_rows)
+                                 if prepared.cache_key is not None])
+        if self.phash_index is not None:
+            for prepared, pred_row in zip(prepared_items, pred_rows):
+                if prepared.image_hash is not None:
+                    self.phash_index.add(prepared.image_hash, pred_row)
+    
+    def load_image(self, image_input):
+        return load_image(image_input)
+    
+    def decode_image(self, image_input):
+        if self.timings is None:
+            return decode_image(image_input, self.input_size, self.fast_decode)
+        
+        start = time.perf_counter()
+        image = decode_image(image_input, self.input_size, self.fast_decode)
+        self.timings.add("decode", time.perf_counter() - start)
+        return image
+    
+    def preprocess_pixels(self, image_input, out=None):
+        image = self.decode_image(image_input)
+        if self.timings is None:
+            return resize_pixels(image, self.input_size, out=out)
+        
+        start = time.perf_counter()
+        pixels = resize_pixels(image, self.input_size, out=out)
+        self.timings.add("preprocess", time.perf_counter() - start)
+        return pixels
+    
+    def normalize_batch(self, buffer, count):
+        if self.timings is None:
+            return buffer.normalize(count)
+        
+        start = time.perf_counter()
+        inputs = buffer.normalize(count)
+        self.timings.add("normalize", time.perf_counter() - start, count=count)
+        return inputs
+    
+    def preprocess_image(self, image_input):
         try:
-            if isinstance(image_path, str):
-                image = Image.open(image_path)
-            else:
-                image = image_path
-            
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            image = image.resize(self.input_size)
-            image_array = np.array(image)
-            image_array = image_array.astype(np.float32) / 255.0
+            pixels = self.preprocess_pixels(image_input)
+            image_array = pixels.astype(np.float32) / 255.0
             image_array = np.expand_dims(image_array, axis=0)
             
             return image_array
@@ -48,55 +359,410 @@ class NSFWDetector:
             logger.error(f"Image preprocessing error: {e}")
             raise
     
-    def predict(self, image_path):
+    def acquire_buffer(self, batch_size):
+        free = self._free_buffers.__dict__.setdefault("buffers", [])
+        for i, buffer in enumerate(free):
+            if len(buffer) >= batch_size:
+                return free.pop(i)
+        return BatchBuffer(batch_size, self.input_size)
+    
+    def release_buffer(self, buffer):
+        free = self._free_buffers.__dict__.setdefault("buffers", [])
+        if len(free) < 2:
+            free.append(buffer)
+    
+    def warmup(self, batch_sizes=(1,)):
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            # input_size is (width, height); the model takes NHWC batches
+            self._run_model(np.zeros((batch_size, self.input_size[1], self.input_size[0], 3), dtype=np.float32))
+        if self.cascade is not None:
+            self.cascade.stage1.warmup(batch_sizes)
+        logger.info(f"Model warm-up finished in {time.perf_counter() - start:.2f}s")
+    
+    def run_model(self, batch):
+        if self.timings is None:
+            return self._infer(batch)
+        
+        start = time.perf_counter()
+        pred_array = self._infer(batch)
+        self.timings.add("inference", time.perf_counter() - start, count=len(batch))
+        return pred_array
+    
+    def _require_embeddings(self):
+        if not self.embeddings:
+            raise ValueError("Create the detector with embeddings=True to extract embeddings")
+    
+    def run_model_with_embeddings(self, batch):
+        self._require_embeddings()
+        if self.timings is None:
+            return self.model.predict_with_embeddings(batch)
+        
+        start = time.perf_counter()
+        outputs = self.model.predict_with_embeddings(batch)
+        self.timings.add("inference", time.perf_counter() - start, count=len(batch))
+        return outputs
+    
+    @property
+    def embedding_size(self):
+        if self._embedding_size is None:
+            batch = np.zeros((1, self.input_size[1], self.input_size[0], 3), dtype=np.float32)
+            self._embedding_size = self.model.predict_with_embeddings(batch)[1].shape[1]
+        return self._embedding_size
+    
+    def _infer(self, batch):
+        if self.cascade is not None:
+            return self.cascade.run(batch, self._run_model)
+        return self._run_model(batch)
+    
+    def _run_model(self, batch):
+        predictions = self.model(batch)
+        
+        if isinstance(predictions, dict):
+            pred_array = next(iter(predictions.values()))
+        else:
+            pred_array = predictions
+        
+        if hasattr(pred_array, 'numpy'):
+            pred_array = pred_array.numpy()
+        
+        return np.asarray(pred_array, dtype=np.float32)
+    
+    def format_prediction(self, pred_row):
+        if self.timings is None:
+            return format_prediction(pred_row, self.classes)
+        
+        start = time.perf_counter()
+        result = format_prediction(pred_row, self.classes)
+        self.timings.add("postprocess", time.perf_counter() - start)
+        return result
+    
+    def predict(self, image_path, return_embedding=False):
+        if return_embedding:
+            self._require_embeddings()
+        buffer = self.acquire_buffer(1)
         try:
-            processed_image = self.preprocess_image(image_path)
-            predictions = self.model(processed_image)
+            prepared = self.prepare(image_path, out=buffer.pixels[0])
+            if prepared.scores is not None:
+                return self.format_prediction(prepared.scores)
             
-            if isinstance(predictions, dict):
-                pred_array = next(iter(predictions.values()))
+            if return_embedding:
+                pred_array, embeddings = self.run_model_with_embeddings(self.normalize_batch(buffer, 1))
             else:
-                pred_array = predictions
-            
-            if hasattr(pred_array, 'numpy'):
-                pred_array = pred_array.numpy()
-            
-            results = {}
-            for i, class_name in enumerate(self.classes):
-                results[class_name] = float(pred_array[0][i])
-            
-            max_class = max(results, key=results.get)
-            max_score = results[max_class]
-            
-            nsfw_classes = ["hentai", "porn", "sexy"]
-            is_nsfw = max_class in nsfw_classes
-            
-            return {
-                "is_nsfw": is_nsfw,
-                "predicted_class": max_class,
-                "confidence": max_score,
-                "scores": results
-            }
+                pred_array = self.run_model(self.normalize_batch(buffer, 1))
+            self.remember(prepared, pred_array[0])
+            result = self.format_prediction(pred_array[0])
+            if return_embedding:
+                result["embedding"] = embeddings[0]
+            return result
             
         except Exception as e:
             logger.error(f"Prediction error: {e}")
             raise
+        finally:
+            self.release_buffer(buffer)
+    
+    def predict_frames(self, image_input, max_frames=16, sampling="uniform", aggregate="max", top_k=3,
+                       threshold=0.5, early_stop=True, frame_batch_size=8, scene_threshold=0.1):
+        from frames import NSFW_CLASSES, aggregate_scores, iter_frames
+        
+        nsfw_columns = [self.classes.index(cls) for cls in NSFW_CLASSES]
+        frames = iter_frames(image_input, sampling, max_frames, self.input_size, scene_threshold, self.decode_guard)
+        buffer = self.acquire_buffer(frame_batch_size)
+        sampled = []
+        rows = []
+        stopped_early = False
+        try:
+            for frame in frames:
+                self.preprocess_pixels(frame.image, out=buffer.pixels[len(sampled) % frame_batch_size])
+                sampled.append(frame)
+                if len(sampled) % frame_batch_size:
+                    continue
+                
+                pred_array = self.run_model(self.normalize_batch(buffer, frame_batch_size))
+                rows.append(pred_array.copy())
+                if early_stop and (pred_array[:, nsfw_columns].sum(axis=1) >= threshold).any():
+                    stopped_early = next(frames, None) is not None
+                    break
+            
+            remainder = len(sampled) % frame_batch_size
+            if remainder and not stopped_early:
+                rows.append(self.run_model(self.normalize_batch(buffer, remainder)).copy())
+        except Exception as e:
+            logger.error(f"Frame prediction error: {e}")
+            raise
+        finally:
+            frames.close()
+            self.release_buffer(buffer)
+        
+        if not rows:
+            raise ValueError("No frames could be decoded")
+        
+        rows = np.concatenate(rows)
+        row, worst, nsfw_scores = aggregate_scores(rows, nsfw_columns, aggregate, top_k)
+        result = self.format_prediction(row)
+        result["nsfw_score"] = float(row[nsfw_columns].sum())
+        result["frames"] = [
+            {"frame": frame.index, "time": frame.time, "nsfw_score": float(score)}
+            for frame, score in zip(sampled, nsfw_scores)
+        ]
+        result["worst_frame"] = result["frames"][worst]
+        result["stopped_early"] = stopped_early
+        return result
+    
+    def predict_tiled(self, image_input, grid=2, window=None, overlap=0.25, refine=True, refine_threshold=0.2,
+                      max_depth=2, max_tiles=64, min_tile=None, aggregate="max", top_k=3, max_resolution=4096):
+        from frames import NSFW_CLASSES, aggregate_scores
+        from tiles import Tile, load_tiling_image, scale_box, tile_boxes
+        
+        nsfw_columns = [self.classes.index(cls) for cls in NSFW_CLASSES]
+        min_tile = min(self.input_size) if min_tile is None else min_tile
+        image, (original_width, original_height) = load_tiling_image(image_input, max_resolution, self.decode_guard)
+        
+        # The global view and the first grid share one batch; later levels only cover suspicious tiles
+        full_box = (0, 0, image.width, image.height)
+        level = [Tile(full_box, 0)] + [
+            Tile(box, 1) for box in tile_boxes(full_box, grid, window, overlap, min_tile) if box != full_box
+        ]
+        tiles = []
+        rows = []
+        while level:
+            level = level[:max_tiles - len(tiles)]
+            level_rows = self._score_boxes(image, [tile.box for tile in level])
+            tiles.extend(level)
+            rows.append(level_rows)
+            if not refine:
+                break
+            
+            level_scores = level_rows[:, nsfw_columns].sum(axis=1)
+            level = [
+                Tile(box, tile.depth + 1)
+                for tile, score in zip(level, level_scores)
+                if 0 < tile.depth < max_depth and score >= refine_threshold
+                for box in tile_boxes(tile.box, 2, None, overlap, min_tile)
+            ]
+        
+        rows = np.concatenate(rows)
+        row, worst, nsfw_scores = aggregate_scores(rows, nsfw_columns, aggregate, top_k)
+        scale_x, scale_y = original_width / image.width, original_height / image.height
+        result = self.format_prediction(row)
+        result["nsfw_score"] = float(row[nsfw_columns].sum())
+        result["image_size"] = [original_width, original_height]
+        result["tiles"] = [
+            {"box": scale_box(tile.box, scale_x, scale_y), "depth": tile.depth, "nsfw_score": float(score)}
+            for tile, score in zip(tiles, nsfw_scores)
+        ]
+        result["worst_tile"] = result["tiles"][worst]
+        result["global_nsfw_score"] = result["tiles"][0]["nsfw_score"]
+        return result
+    
+    def _score_boxes(self, image, boxes):
+        batch_size = min(len(boxes), self.batch_size)
+        buffer = self.acquire_buffer(batch_size)
+        rows = []
+        try:
+            for start in range(0, len(boxes), batch_size):
+                chunk = boxes[start:start + batch_size]
+                for slot, box in enumerate(chunk):
+                    resize_pixels(image, self.input_size, out=buffer.pixels[slot], box=box)
+                rows.append(self.run_model(self.normalize_batch(buffer, len(chunk))).copy())
+        finally:
+            self.release_buffer(buffer)
+        return np.concatenate(rows)
+    
+    def _get_executor(self, num_workers):
+        with self._executor_lock:
+            if self._executor is None or self._executor_workers != num_workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                if self.worker_type == "process":
+                    self._executor = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context("spawn"))
+                elif self.worker_type == "thread":
+                    self._executor = ThreadPoolExecutor(num_workers, thread_name_prefix="nsfw-decode")
+                else:
+                    raise ValueError(f"Unknown worker type: {self.worker_type}")
+                self._executor_workers = num_workers
+            return self._executor
     
-    def predict_batch(self, image_paths):
-        results = []
-        for image_path in image_paths:
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+    
+    def _submit_prepare(self, executor, image_input):
+        if self.worker_type != "process":
+            return executor.submit(self.prepare, image_input), None
+        
+        key, cached, image_input = self.lookup_cache(image_input)
+        if cached is not None:
+            future = Future()
+            future.set_result(PreparedImage(key, None, cached, None))
+            return future, None
+        
+        if hasattr(image_input, 'read'):
+            image_input = image_input.read()
+        
+        hash_method = self.phash_index.method if self.phash_index is not None else None
+        future = executor.submit(_decode_worker, image_input, self.input_size, self.fast_decode, hash_method,
+                                 self.decode_guard)
+        return future, key
+    
+    def _resolve_prepare(self, future, key):
+        result = future.result()
+        if isinstance(result, PreparedImage):
+            return result
+        
+        image_hash, pixels, decode_seconds, preprocess_seconds = result
+        if self.timings is not None:
+            self.timings.add("decode", decode_seconds)
+            self.timings.add("preprocess", preprocess_seconds)
+        if image_hash is not None:
+            prepared = self._lookup_phash(key, image_hash)
+            if prepared is not None:
+                return prepared
+        return PreparedImage(key, image_hash, None, pixels)
+    
+    def _iter_prepared(self, image_paths, buffer, batch_size, num_workers):
+        slot = 0
+        
+        if num_workers <= 0:
+            for index, image_path in enumerate(image_paths):
+                try:
+                    prepared = self.prepare(image_path, out=buffer.pixels[slot])
+                except Exception as e:
+                    yield index, image_path, e
+                    continue
+                if prepared.scores is None:
+                    slot = (slot + 1) % batch_size
+                yield index, image_path, prepared
+            return
+        
+        executor = self._get_executor(num_workers)
+        window = max(batch_size * self.prefetch_batches, num_workers)
+        in_flight = deque()
+        items = iter(enumerate(image_paths))
+        
+        while True:
+            while len(in_flight) < window:
+                item = next(items, None)
+                if item is None:
+                    break
+                index, image_path = item
+                try:
+                    in_flight.append((index, image_path) + self._submit_prepare(executor, image_path))
+                except Exception as e:
+                    in_flight.append((index, image_path, e, None))
+            
+            if not in_flight:
+                return
+            
+            index, image_path, future, key = in_flight.popleft()
+            if isinstance(future, Exception):
+                yield index, image_path, future
+                continue
             try:
-                result = self.predict(image_path)
-                result["image_path"] = image_path
-                results.append(result)
+                prepared = self._resolve_prepare(future, key)
             except Exception as e:
-                logger.error(f"Prediction error for image {image_path}: {e}")
-                results.append({
+                yield index, image_path, e
+                continue
+            if prepared.scores is None:
+                buffer.pixels[slot] = prepared.pixels
+                prepared = prepared._replace(pixels=buffer.pixels[slot])
+                slot = (slot + 1) % batch_size
+            yield index, image_path, prepared
+    
+    def predict_batch(self, image_paths, batch_size=None, num_workers=None, return_embedding=False):
+        return list(self.iter_predict(image_paths, batch_size=batch_size, num_workers=num_workers,
+                                      return_embedding=return_embedding))
+    
+    def predict_array(self, image_paths, batch_size=None, num_workers=None):
+        return PredictionBatch.concat(self.iter_prediction_batches(image_paths, batch_size=batch_size, num_workers=num_workers))
+    
+    def iter_prediction_batches(self, image_paths, chunk_size=DEFAULT_CHUNK_SIZE, batch_size=None, num_workers=None):
+        rows = self.iter_prediction_rows(image_paths, batch_size=batch_size, num_workers=num_workers)
+        return iter_prediction_batches(rows, self.classes, chunk_size)
+    
+    def iter_predict(self, image_paths, batch_size=None, num_workers=None, return_embedding=False):
+        rows = self._iter_rows(image_paths, batch_size, num_workers, return_embedding)
+        for image_path, pred_row, embedding, error in rows:
+            if error is not None:
+                yield {
                     "image_path": image_path,
-                    "error": str(e)
-                })
+                    "error": str(error)
+                }
+            else:
+                result = self.format_prediction(pred_row)
+                result["image_path"] = image_path
+                if return_embedding:
+                    result["embedding"] = embedding
+                yield result
+    
+    def iter_prediction_rows(self, image_paths, batch_size=None, num_workers=None):
+        # Yields (image_path, pred_row, error) in input order without building result dicts
+        for image_path, pred_row, _, error in self._iter_rows(image_paths, batch_size, num_workers):
+            yield image_path, pred_row, error
+    
+    def iter_embedding_rows(self, image_paths, batch_size=None, num_workers=None):
+        # Same as iter_prediction_rows with the penultimate-layer embedding: (image_path, pred_row, embedding, error)
+        return self._iter_rows(image_paths, batch_size, num_workers, embeddings=True)
+    
+    def _iter_rows(self, image_paths, batch_size=None, num_workers=None, embeddings=False):
+        if embeddings:
+            self._require_embeddings()
+        batch_size = batch_size or self.batch_size
+        num_workers = self.num_workers if num_workers is None else num_workers
+        buffer = self.acquire_buffer(batch_size)
+        ordered = deque()
+        pending = []
         
-        return results
+        try:
+            for _, image_input, prepared in self._iter_prepared(image_paths, buffer, batch_size, num_workers):
+                image_path = input_label(image_input)
+                entry = [image_path, None]
+                ordered.append(entry)
+                
+                if isinstance(prepared, Exception):
+                    logger.error(f"Prediction error for image {image_path}: {prepared}")
+                    entry[1] = (None, None, prepared)
+                elif prepared.scores is not None:
+                    entry[1] = (prepared.scores, None, None)
+                else:
+                    pending.append((entry, prepared))
+                    if len(pending) >= batch_size:
+                        self._predict_pending(pending, buffer, embeddings)
+                        pending = []
+                
+                while ordered and ordered[0][1] is not None:
+                    image_path, (pred_row, embedding, error) = ordered.popleft()
+                    yield image_path, pred_row, embedding, error
+            
+            if pending:
+                self._predict_pending(pending, buffer, embeddings)
+            
+            while ordered:
+                image_path, (pred_row, embedding, error) = ordered.popleft()
+                yield image_path, pred_row, embedding, error
+        finally:
+            self.release_buffer(buffer)
+    
+    def _predict_pending(self, pending, buffer, embeddings=False):
+        try:
+            inputs = self.normalize_batch(buffer, len(pending))
+            if embeddings:
+                pred_array, embedding_array = self.run_model_with_embeddings(inputs)
+            else:
+                pred_array = self.run_model(inputs)
+                embedding_array = [None] * len(pending)
+        except Exception as e:
+            logger.error(f"Batch prediction error for {len(pending)} images: {e}")
+            for entry, _ in pending:
+                entry[1] = (None, None, e)
+            return
+        
+        self.remember_batch([prepared for _, prepared in pending], pred_array)
+        for (entry, _), pred_row, embedding in zip(pending, pred_array, embedding_array):
+            entry[1] = (pred_row, embedding, None)
 
 _detector = None
 
@@ -109,11 +775,11 @@ def get_detector():
 class predict:
     
     @staticmethod
-    def load_model(model_path="models/mobilenet_v2_140_224"):
-        return NSFWDetector(model_path)
+    def load_model(model_path="models/mobilenet_v2_140_224", **kwargs):
+        return NSFWDetector(model_path, **kwargs)
     
     @staticmethod
-    def classify(model_or_path, image_input):
+    def classify(model_or_path, image_input, batch_size=None, num_workers=None):
         if isinstance(model_or_path, str):
             detector = NSFWDetector(model_or_path)
         else:
@@ -121,37 +787,72 @@ class predict:
         
         results = {}
         
-        if isinstance(image_input, str):
-            if os.path.isdir(image_input):
-                supported_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff']
-                image_files = []
-                for file in os.listdir(image_input):
-                    if any(file.lower().endswith(ext) for ext in supported_extensions):
-                        image_files.append(os.path.join(image_input, file))
-                
-                for image_path in image_files:
-                    try:
-                        result = detector.predict(image_path)
-                        results[os.path.basename(image_path)] = result['scores']
-                    except Exception as e:
-                        results[os.path.basename(image_path)] = {"error": str(e)}
-            else:
-                try:
-                    result = detector.predict(image_input)
-                    results[os.path.basename(image_input)] = result['scores']
-                except Exception as e:
-                    results[os.path.basename(image_input)] = {"error": str(e)}
+        if isinstance(image_input, str) and os.path.isdir(image_input):
+            image_files = iter_image_files(image_input, recursive=False)
+            predict._collect_batch(detector, image_files, results, batch_size, num_workers)
         
-        elif isinstance(image_input, list):
-            for image_path in image_input:
-                try:
-                    result = detector.predict(image_path)
-                    results[os.path.basename(image_path)] = result['scores']
-                except Exception as e:
-                    results[os.path.basename(image_path)] = {"error": str(e)}
+        elif isinstance(image_input, (list, tuple)):
+            predict._collect_batch(detector, image_input, results, batch_size, num_workers)
+        
+        else:
+            name = predict._input_name(image_input, "image")
+            try:
+                result = detector.predict(image_input)
+                results[name] = result['scores']
+            except Exception as e:
+                results[name] = {"error": str(e)}
         
         return results
     
+    @staticmethod
+    def scan(model_or_path, directory, **kwargs):
+        from scanner import scan
+        
+        if isinstance(model_or_path, str):
+            detector = NSFWDetector(model_or_path)
+        else:
+            detector = model_or_path
+        
+        return scan(detector, directory, **kwargs)
+    
+    @staticmethod
+    def classify_urls(model_or_path, urls, **kwargs):
+        from url_fetcher import iter_classify_urls
+        
+        if isinstance(model_or_path, str):
+            detector = NSFWDetector(model_or_path)
+        else:
+            detector = model_or_path
+        
+        results = {}
+        for result in sorted(iter_classify_urls(detector, urls, **kwargs), key=lambda result: result["index"]):
+            if "error" in result:
+                results[result["url"]] = {"error": result["error"]}
+            else:
+                results[result["url"]] = result["scores"]
+        
+        return results
+    
+    @staticmethod
+    def _input_name(image_input, default):
+        if isinstance(image_input, (str, os.PathLike)):
+            return os.path.basename(image_input)
+        name = getattr(image_input, 'filename', None) or getattr(image_input, 'name', None)
+        if isinstance(name, str) and name:
+            return os.path.basename(name)
+        return default
+    
+    @staticmethod
+    def _collect_batch(detector, image_inputs, results, batch_size=None, num_workers=None):
+        image_inputs = list(image_inputs)
+        predictions = detector.iter_predict(image_inputs, batch_size=batch_size, num_workers=num_workers)
+        for index, (image_input, result) in enumerate(zip(image_inputs, predictions)):
+            name = predict._input_name(image_input, f"image_{index}")
+            if "error" in result:
+                results[name] = {"error": result["error"]}
+            else:
+                results[name] = result['scores']
+    
     @staticmethod
     def get_nsfw_score(scores):
         if "error" in scores:
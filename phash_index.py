@@ -0,0 +1,168 @@
+import logging
+import threading
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_from_bits(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+
+def dhash(image, hash_size=8):
+    image = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.int16)
+    return _hash_from_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(size):
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / size)
+
+
+_DCT_MATRICES = {}
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    size = hash_size * highfreq_factor
+    if size not in _DCT_MATRICES:
+        _DCT_MATRICES[size] = _dct_matrix(size)
+    dct = _DCT_MATRICES[size]
+
+    image = image.convert('L').resize((size, size), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.float64)
+    coefficients = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    return _hash_from_bits(coefficients > np.median(coefficients))
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+HASH_FUNCTIONS = {
+    "phash": phash,
+    "dhash": dhash,
+}
+
+
+class BKTree:
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        self._size += 1
+        if self._root is None:
+            self._root = (value, item, {})
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        matches = []
+        if self._root is None:
+            return matches
+
+        candidates = [self._root]
+        while candidates:
+            node_value, item, children = candidates.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                matches.append((distance, item))
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    candidates.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class PerceptualIndex:
+    def __init__(self, threshold=6, method="phash"):
+        if method not in HASH_FUNCTIONS:
+            raise ValueError(f"Unknown hash method: {method}")
+        self.threshold = threshold
+        self.method = method
+        self._hash_function = HASH_FUNCTIONS[method]
+        self._tree = BKTree()
+        self._hashes = []
+        self._scores = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def compute_hash(self, image):
+        return self._hash_function(image)
+
+    def lookup(self, image_hash):
+        with self._lock:
+            matches = self._tree.search(image_hash, self.threshold)
+            if not matches:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._scores[matches[0][1]]
+
+    def add(self, image_hash, scores):
+        scores = np.array(scores, dtype=np.float32)
+        with self._lock:
+            if self._tree.search(image_hash, 0):
+                return
+            self._hashes.append(image_hash)
+            self._scores.append(scores)
+            self._tree.add(image_hash, len(self._hashes) - 1)
+
+    def save(self, path):
+        with self._lock:
+            hashes = np.array(self._hashes, dtype=np.uint64)
+            scores = np.array(self._scores, dtype=np.float32).reshape(len(self._scores), -1)
+        with open(path, 'wb') as f:
+            np.savez(f, hashes=hashes, scores=scores, threshold=self.threshold, method=self.method)
+        logger.info(f"Perceptual index saved: {path} ({len(hashes)} entries)")
+
+    @classmethod
+    def load(cls, path, threshold=None):
+        try:
+            with np.load(path) as data:
+                index = cls(
+                    threshold=int(data["threshold"]) if threshold is None else threshold,
+                    method=str(data["method"])
+                )
+                for image_hash, scores in zip(data["hashes"], data["scores"]):
+                    index.add(int(image_hash), scores)
+            logger.info(f"Perceptual index loaded: {path} ({len(index)} entries)")
+            return index
+        except Exception as e:
+            logger.error(f"Error loading perceptual index: {e}")
+            raise
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._hashes),
+                "method": self.method,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
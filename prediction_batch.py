@@ -0,0 +1,183 @@
+import os
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+CLASSES = ("drawings", "hentai", "neutral", "porn", "sexy")
+NSFW_CLASSES = ("hentai", "porn", "sexy")
+DEFAULT_CHUNK_SIZE = 65536
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow/Parquet export requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def format_prediction(pred_row, classes=CLASSES):
+    values = pred_row.tolist() if hasattr(pred_row, "tolist") else [float(value) for value in pred_row]
+    scores = dict(zip(classes, values))
+    index = max(range(len(values)), key=values.__getitem__)
+
+    return {
+        "is_nsfw": classes[index] in NSFW_CLASSES,
+        "predicted_class": classes[index],
+        "confidence": values[index],
+        "scores": scores
+    }
+
+
+def _path_name(image_input):
+    if isinstance(image_input, (str, os.PathLike)):
+        return os.fspath(image_input)
+    name = getattr(image_input, "filename", None) or getattr(image_input, "name", None)
+    return name if isinstance(name, str) else None
+
+
+class PredictionBatch:
+    """Scores for N images as one (N, classes) float32 array; per-image dicts are only built on access."""
+
+    def __init__(self, scores, image_paths=None, errors=None, classes=CLASSES):
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(-1, len(classes))
+        self.classes = tuple(classes)
+        count = len(self.scores)
+        self.image_paths = list(image_paths) if image_paths is not None else [None] * count
+        # Failed rows hold NaN scores and their message here; None marks a successful row
+        self.errors = np.empty(count, dtype=object) if errors is None else np.asarray(errors, dtype=object)
+        if len(self.image_paths) != count or len(self.errors) != count:
+            raise ValueError("scores, image_paths and errors must have the same length")
+        self._nsfw_columns = [self.classes.index(cls) for cls in NSFW_CLASSES]
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls(np.empty((0, len(CLASSES)), dtype=np.float32))
+        return cls(
+            np.concatenate([batch.scores for batch in batches]),
+            [path for batch in batches for path in batch.image_paths],
+            np.concatenate([batch.errors for batch in batches]),
+            batches[0].classes
+        )
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PredictionBatch(self.scores[index], self.image_paths[index], self.errors[index], self.classes)
+        error = self.errors[index]
+        if error is not None:
+            return {"image_path": self.image_paths[index], "error": error}
+        result = format_prediction(self.scores[index], self.classes)
+        result["image_path"] = self.image_paths[index]
+        return result
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def to_dicts(self):
+        return list(self)
+
+    @property
+    def valid(self):
+        return np.equal(self.errors, None)
+
+    def predicted_index(self):
+        # -1 marks failed rows
+        return np.where(self.valid, self.scores.argmax(axis=1), -1)
+
+    def predicted_class(self):
+        labels = np.array(self.classes + (None,), dtype=object)
+        return labels[self.predicted_index()]
+
+    def confidence(self):
+        return self.scores.max(axis=1)
+
+    def nsfw_score(self):
+        return self.scores[:, self._nsfw_columns].sum(axis=1)
+
+    def is_nsfw(self, threshold=None):
+        # Without a threshold this matches the per-image dicts: the top class is an NSFW class
+        if threshold is None:
+            flagged = np.isin(self.predicted_index(), self._nsfw_columns)
+        else:
+            flagged = self.nsfw_score() >= threshold
+        return flagged & self.valid
+
+    def to_numpy(self, threshold=None):
+        columns = {
+            "image_path": np.array([_path_name(path) for path in self.image_paths], dtype=object),
+            "is_nsfw": self.is_nsfw(threshold),
+            "nsfw_score": self.nsfw_score(),
+            "predicted_class": self.predicted_class(),
+            "confidence": self.confidence(),
+        }
+        for column, name in enumerate(self.classes):
+            columns[name] = self.scores[:, column]
+        columns["error"] = self.errors
+        return columns
+
+    def to_arrow(self, threshold=None):
+        pa = _import_pyarrow()
+        failed = ~self.valid
+        arrays = {}
+        for name, values in self.to_numpy(threshold).items():
+            if values.dtype == object:
+                arrays[name] = pa.array(values.tolist(), type=pa.string())
+            else:
+                # Failed rows become nulls rather than NaN/False
+                arrays[name] = pa.array(values, mask=failed)
+        return pa.table(arrays)
+
+    def to_parquet(self, path, threshold=None, **options):
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(threshold), path, **options)
+
+
+def iter_prediction_batches(rows, classes=CLASSES, chunk_size=DEFAULT_CHUNK_SIZE):
+    # rows yields (image_path, pred_row, error) as produced by NSFWDetector.iter_prediction_rows
+    scores = np.full((chunk_size, len(classes)), np.nan, dtype=np.float32)
+    errors = np.empty(chunk_size, dtype=object)
+    image_paths = []
+    for image_path, pred_row, error in rows:
+        index = len(image_paths)
+        image_paths.append(image_path)
+        if error is not None:
+            errors[index] = str(error)
+        else:
+            scores[index] = pred_row
+
+        if len(image_paths) == chunk_size:
+            yield PredictionBatch(scores, image_paths, errors, classes)
+            scores = np.full((chunk_size, len(classes)), np.nan, dtype=np.float32)
+            errors = np.empty(chunk_size, dtype=object)
+            image_paths = []
+
+    if image_paths:
+        count = len(image_paths)
+        yield PredictionBatch(scores[:count], image_paths, errors[:count], classes)
+
+
+def write_parquet(batches, path, threshold=None, **options):
+    _import_pyarrow()
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = 0
+    try:
+        for batch in batches:
+            table = batch.to_arrow(threshold)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, **options)
+            writer.write_table(table)
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Queue-driven offline worker
+
+Workers lease image references from a job queue, classify them in batches and write the results to a
+sink before acknowledging the jobs, so every job is written at least once. Failed jobs are retried
+with backoff and dead-lettered after max_attempts. Run more workers against the same queue to scale.
+
+    python queue_worker.py enqueue jobs.db /data/images
+    python queue_worker.py work jobs.db -o results-{worker}.jsonl --stop-when-empty
+    python queue_worker.py status jobs.db
+"""
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+Job = namedtuple("Job", ["id", "image_ref", "attempts"])
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 30.0
+STATUSES = ("pending", "leased", "done", "dead")
+
+
+class SQLiteQueue:
+    """Job queue in a local SQLite file, safe to share between worker processes on one machine.
+
+    Any object with the same lease/ack/fail methods can stand in for it; heartbeat is optional.
+    """
+
+    def __init__(self, path, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY, timeout=30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        try:
+            self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY, image_ref TEXT NOT NULL UNIQUE, status TEXT NOT NULL DEFAULT 'pending', "
+                "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL DEFAULT 0, leased_by TEXT, "
+                "lease_expires REAL, last_error TEXT, updated REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "worker_id TEXT PRIMARY KEY, started REAL, updated REAL, done INTEGER, failed INTEGER, "
+                "dead INTEGER, images_per_s REAL)"
+            )
+        except Exception as e:
+            logger.error(f"Error opening job queue {path}: {e}")
+            raise
+
+    def close(self):
+        self._db.close()
+
+    @contextmanager
+    def _transaction(self):
+        # Autocommit mode, so the write lock is taken up front and two workers never lease the same job
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, image_refs, chunk_size=10000):
+        # Already queued references are skipped, so re-running a backfill enqueue is harmless
+        added = 0
+        chunk = []
+        for image_ref in image_refs:
+            chunk.append((os.fspath(image_ref), time.time()))
+            if len(chunk) >= chunk_size:
+                added += self._insert(chunk)
+                chunk = []
+        if chunk:
+            added += self._insert(chunk)
+        return added
+
+    def _insert(self, rows):
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO jobs (image_ref, updated) VALUES (?, ?)", rows)
+            return db.total_changes - before
+
+    def lease(self, worker_id, limit, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        with self._transaction() as db:
+            # A job whose lease keeps expiring is probably killing its worker; stop handing it out
+            db.execute(
+                "UPDATE jobs SET status = 'dead', last_error = 'Lease expired ' || attempts || ' times', "
+                "updated = ? WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                (now, now, self.max_attempts)
+            )
+            rows = db.execute(
+                "SELECT id, image_ref, attempts FROM jobs "
+                "WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?) "
+                "ORDER BY id LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            db.executemany(
+                "UPDATE jobs SET status = 'leased', leased_by = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                [(worker_id, now + lease_seconds, now, job_id) for job_id, _, _ in rows]
+            )
+        return [Job(job_id, image_ref, attempts + 1) for job_id, image_ref, attempts in rows]
+
+    def ack(self, worker_id, jobs):
+        # Only jobs still leased to this worker; an expired lease may already belong to someone else
+        with self._transaction() as db:
+            db.executemany(
+                "UPDATE jobs SET status = 'done', last_error = NULL, updated = ? "
+                "WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                [(time.time(), job.id, worker_id) for job in jobs]
+            )
+
+    def fail(self, worker_id, failures):
+        # failures: (job, error) pairs. Returns the number of jobs that went to the dead letters
+        now = time.time()
+        retries = []
+        dead = []
+        for job, error in failures:
+            if job.attempts >= self.max_attempts:
+                dead.append((str(error), now, job.id, worker_id))
+            else:
+                delay = self.retry_delay * 2 ** (job.attempts - 1)
+                retries.append((str(error), now + delay, now, job.id, worker_id))
+
+        with self._transaction() as db:
+            db.executemany(
+                "UPDATE jobs SET status = 'pending', last_error = ?, available_at = ?, leased_by = NULL, "
+                "lease_expires = NULL, updated = ? WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                retries
+            )
+            db.executemany(
+                "UPDATE jobs SET status = 'dead', last_error = ?, updated = ? "
+                "WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                dead
+            )
+        return len(dead)
+
+    def heartbeat(self, worker_id, stats):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, started, updated, done, failed, dead, images_per_s) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (worker_id, stats["started"], time.time(), stats["done"], stats["failed"], stats["dead"],
+                 stats["images_per_s"])
+            )
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(rows)
+        return counts
+
+    def workers(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT worker_id, started, updated, done, failed, dead, images_per_s FROM workers ORDER BY worker_id"
+            ).fetchall()
+        fields = ("worker_id", "started", "updated", "done", "failed", "dead", "images_per_s")
+        return [dict(zip(fields, row)) for row in rows]
+
+    def dead_letters(self, limit=100):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, image_ref, attempts, last_error FROM jobs WHERE status = 'dead' ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [{"id": job_id, "image_ref": ref, "attempts": attempts, "error": error}
+                for job_id, ref, attempts, error in rows]
+
+    def requeue_dead(self):
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, leased_by = NULL, "
+                "lease_expires = NULL, updated = ? WHERE status = 'dead'",
+                (time.time(),)
+            )
+            return cursor.rowcount
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class QueueWorker:
+    def __init__(self, detector, queue, sink, worker_id=None, batch_size=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 poll_interval=1.0, heartbeat_interval=10.0):
+        self.detector = detector
+        self.queue = queue
+        self.sink = sink
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size or detector.batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_heartbeat = 0.0
+        self.started = time.time()
+        self.batches = 0
+        self.done = 0
+        self.failed = 0
+        self.dead = 0
+
+    def stop(self):
+        # The batch in progress is finished and acknowledged before run() returns
+        self._stop.set()
+
+    def run(self, max_jobs=None, stop_when_empty=False):
+        try:
+            while not self._stop.is_set():
+                limit = self.batch_size
+                if max_jobs is not None:
+                    limit = min(limit, max_jobs - self.done - self.failed)
+                    if limit <= 0:
+                        break
+
+                jobs = self.queue.lease(self.worker_id, limit, self.lease_seconds)
+                if not jobs:
+                    if stop_when_empty:
+                        break
+                    self._heartbeat()
+                    self._stop.wait(self.poll_interval)
+                    continue
+                self.process(jobs)
+        finally:
+            self._heartbeat(force=True)
+        return self.stats()
+
+    def process(self, jobs):
+        succeeded = []
+        failures = []
+        try:
+            results = self.detector.iter_predict([job.image_ref for job in jobs], batch_size=self.batch_size)
+            for job, result in zip(jobs, results):
+                if "error" in result:
+                    failures.append((job, result["error"]))
+                else:
+                    self.sink.write(result)
+                    succeeded.append(job)
+            # Results must be durable before the jobs are acknowledged
+            self.sink.flush()
+        except Exception as e:
+            logger.error(f"Batch of {len(jobs)} jobs failed: {e}")
+            failures = [(job, e) for job in jobs]
+            succeeded = []
+
+        if succeeded:
+            self.queue.ack(self.worker_id, succeeded)
+        dead = self.queue.fail(self.worker_id, failures) if failures else 0
+
+        with self._lock:
+            self.batches += 1
+            self.done += len(succeeded)
+            self.failed += len(failures)
+            self.dead += dead
+        self._heartbeat()
+        return len(succeeded), len(failures)
+
+    def _heartbeat(self, force=False):
+        heartbeat = getattr(self.queue, "heartbeat", None)
+        now = time.time()
+        if heartbeat is None or (not force and now - self._last_heartbeat < self.heartbeat_interval):
+            return
+        self._last_heartbeat = now
+        try:
+            heartbeat(self.worker_id, self.stats())
+        except Exception as e:
+            logger.error(f"Error recording worker heartbeat: {e}")
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.time() - self.started
+            return {
+                "worker_id": self.worker_id,
+                "started": self.started,
+                "batches": self.batches,
+                "done": self.done,
+                "failed": self.failed,
+                "dead": self.dead,
+                "images_per_s": (self.done + self.failed) / elapsed if elapsed > 0 else 0.0,
+            }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Queue-driven offline NSFW worker")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Add image files, directories or a manifest to the queue")
+    enqueue.add_argument("queue", help="SQLite queue file")
+    enqueue.add_argument("inputs", nargs="*", help="Image files or directories")
+    enqueue.add_argument("--manifest", help="File with one image path per line ('-' for stdin)")
+    enqueue.add_argument("--no-recursive", dest="recursive", action="store_false")
+
+    work = commands.add_parser("work", help="Process jobs until stopped")
+    work.add_argument("queue", help="SQLite queue file")
+    work.add_argument("-o", "--output", default="results-{worker}.jsonl",
+                      help="Result file; {worker} is replaced by the worker id so workers never share a file")
+    work.add_argument("--format", dest="output_format", choices=["jsonl", "csv"])
+    work.add_argument("--threshold", type=float, default=0.5)
+    work.add_argument("--worker-id", help="Defaults to <hostname>-<pid>")
+    work.add_argument("--model-path", default="models/mobilenet_v2_140_224")
+    work.add_argument("--backend", default="tf")
+    work.add_argument("--num-threads", type=int)
+    work.add_argument("--batch-size", type=int, default=32)
+    work.add_argument("--workers", type=int, default=0, help="Decode workers (0 decodes on the main thread)")
+    work.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    work.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    work.add_argument("--retry-delay", type=float, default=DEFAULT_RETRY_DELAY,
+                      help="Seconds before the first retry, doubled on each further attempt")
+    work.add_argument("--max-jobs", type=int)
+    work.add_argument("--stop-when-empty", action="store_true", help="Exit once no job is ready")
+    work.add_argument("--progress-interval", type=float, default=10.0)
+    work.add_argument("--quiet", action="store_true")
+
+    status = commands.add_parser("status", help="Job counts and per-worker throughput")
+    status.add_argument("queue", help="SQLite queue file")
+
+    dead = commands.add_parser("dead", help="List dead-lettered jobs")
+    dead.add_argument("queue", help="SQLite queue file")
+    dead.add_argument("--limit", type=int, default=100)
+
+    requeue = commands.add_parser("requeue", help="Move dead-lettered jobs back to pending")
+    requeue.add_argument("queue", help="SQLite queue file")
+    return parser
+
+
+def run_worker(args):
+    from nsfw_detector import NSFWDetector
+    from scanner import ResultWriter
+
+    queue = SQLiteQueue(args.queue, max_attempts=args.max_attempts, retry_delay=args.retry_delay)
+    detector = NSFWDetector(args.model_path, batch_size=args.batch_size, num_workers=args.workers,
+                            backend=args.backend, num_threads=args.num_threads)
+    worker_id = args.worker_id or default_worker_id()
+    sink = ResultWriter(args.output.format(worker=worker_id), args.output_format, append=True, threshold=args.threshold)
+    worker = QueueWorker(detector, queue, sink, worker_id, args.batch_size,
+                         args.lease_seconds, heartbeat_interval=args.progress_interval)
+
+    def request_stop(signum, frame):
+        logger.warning(f"Stopping worker {worker_id} after the current batch")
+        worker.stop()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    finished = threading.Event()
+    if not args.quiet:
+        def report():
+            while not finished.wait(args.progress_interval):
+                stats = worker.stats()
+                logger.info(f"{worker_id}: {stats['done']} done, {stats['failed']} failed, "
+                            f"{stats['dead']} dead-lettered, {stats['images_per_s']:.1f} img/s")
+        threading.Thread(target=report, name="worker-progress", daemon=True).start()
+
+    try:
+        stats = worker.run(max_jobs=args.max_jobs, stop_when_empty=args.stop_when_empty)
+    finally:
+        finished.set()
+        sink.close()
+        detector.close()
+        queue.close()
+    logger.info(f"{worker_id}: {stats['done']} done, {stats['failed']} failed, {stats['dead']} dead-lettered")
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == "work":
+        logging.getLogger().setLevel(logging.WARNING if args.quiet else logging.INFO)
+        return run_worker(args)
+
+    queue = SQLiteQueue(args.queue)
+    try:
+        if args.command == "enqueue":
+            from nsfw_cli import iter_inputs
+
+            if not args.inputs and not args.manifest:
+                print("No inputs given (pass files, directories or --manifest)", file=sys.stderr)
+                return 2
+            added = queue.enqueue(iter_inputs(args.inputs, args.manifest, args.recursive))
+            print(f"Enqueued {added} jobs")
+        elif args.command == "status":
+            counts = queue.counts()
+            print("  ".join(f"{status}: {counts[status]}" for status in STATUSES))
+            now = time.time()
+            for worker in queue.workers():
+                print(f"{worker['worker_id']:<32} {worker['done']:>9} done {worker['failed']:>7} failed "
+                      f"{worker['dead']:>6} dead {worker['images_per_s']:8.1f} img/s  "
+                      f"seen {now - worker['updated']:.0f}s ago")
+        elif args.command == "dead":
+            for job in queue.dead_letters(args.limit):
+                print(f"{job['image_ref']}\t{job['attempts']}\t{job['error']}")
+        elif args.command == "requeue":
+            print(f"Requeued {queue.requeue_dead()} jobs")
+    finally:
+        queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
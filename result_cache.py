@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from lazy_import import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    def __init__(self, max_entries=10000, db_path=None, per_model=True):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.per_model = per_model
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path):
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, scores BLOB NOT NULL)")
+            self._db.commit()
+            logger.info(f"Result cache database opened: {db_path}")
+        except Exception as e:
+            logger.error(f"Error opening result cache database: {e}")
+            raise
+
+    @staticmethod
+    def make_key(data, scope=""):
+        digest = hashlib.sha256()
+        digest.update(scope.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            scores = self._entries.get(key)
+            if scores is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return scores
+
+            if self._db is not None:
+                row = self._db.execute("SELECT scores FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    scores = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, scores)
+                    self.disk_hits += 1
+                    return scores
+
+            self.misses += 1
+            return None
+
+    def put(self, key, scores):
+        self.put_many([(key, scores)])
+
+    def put_many(self, items):
+        # One transaction per predicted batch instead of one commit per row
+        items = [(key, np.array(scores, dtype=np.float32)) for key, scores in items]
+        with self._lock:
+            for key, scores in items:
+                self._remember(key, scores)
+            if self._db is not None and items:
+                try:
+                    self._db.executemany("INSERT OR REPLACE INTO results (key, scores) VALUES (?, ?)",
+                                         [(key, scores.tobytes()) for key, scores in items])
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Error writing to result cache database: {e}")
+
+    def _remember(self, key, scores):
+        self._entries[key] = scores
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,140 @@
+import csv
+import json
+import logging
+import os
+import sys
+
+from nsfw_detector import iter_image_files, predict
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ["image_path", "is_nsfw", "nsfw_score", "predicted_class", "confidence",
+              "drawings", "hentai", "neutral", "porn", "sexy", "error"]
+
+
+def result_row(result, threshold=None):
+    if "error" in result:
+        return {"image_path": result["image_path"], "error": result["error"]}
+
+    scores = result["scores"]
+    nsfw_score = predict.get_nsfw_score(scores)
+    row = {
+        "image_path": result["image_path"],
+        "is_nsfw": result["is_nsfw"] if threshold is None else nsfw_score >= threshold,
+        "nsfw_score": nsfw_score,
+        "predicted_class": result["predicted_class"],
+        "confidence": result["confidence"],
+    }
+    row.update(scores)
+    return row
+
+
+class ResultWriter:
+    def __init__(self, path, output_format=None, append=False, threshold=None):
+        self.path = path
+        self.threshold = threshold
+        self.output_format = output_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+        if self.output_format not in ("jsonl", "csv"):
+            raise ValueError(f"Unsupported output format: {self.output_format}")
+
+        if path == "-":
+            write_header = True
+            self._file = sys.stdout
+        else:
+            write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+            self._file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+        self.last_row = None
+        self._csv = None
+        if self.output_format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS, extrasaction="ignore")
+            if write_header:
+                self._csv.writeheader()
+
+    def write(self, result):
+        row = result_row(result, self.threshold)
+        self.last_row = row
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row) + "\n")
+
+    def flush(self):
+        self._file.flush()
+        if self._file is not sys.stdout:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is sys.stdout:
+            self._file.flush()
+        elif not self._file.closed:
+            self._file.flush()
+            self._file.close()
+
+
+class ScanCheckpoint:
+    def __init__(self, path):
+        self.path = path
+        self.last_path = None
+        self.completed = 0
+        self.extra = {}
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.last_path = state.get("last_path")
+            self.completed = state.get("completed", 0)
+            self.extra = {key: value for key, value in state.items() if key not in ("last_path", "completed")}
+            logger.info(f"Resuming scan after {self.last_path} ({self.completed} images done)")
+        except Exception as e:
+            logger.error(f"Error reading checkpoint {self.path}: {e}")
+            raise
+
+    def save(self, last_path, completed, **extra):
+        # extra holds the position of side outputs, such as the embedding store's row count
+        self.last_path = last_path
+        self.completed = completed
+        self.extra = extra
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(extra, last_path=last_path, completed=completed), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def scan(detector, root, output=None, output_format=None, checkpoint=None, recursive=True,
+         batch_size=None, num_workers=None, checkpoint_every=256):
+    state = ScanCheckpoint(checkpoint) if checkpoint else None
+    resume_after = state.last_path if state is not None else None
+    completed = state.completed if state is not None else 0
+
+    writer = ResultWriter(output, output_format, append=resume_after is not None) if output else None
+    image_files = iter_image_files(root, recursive=recursive, resume_after=resume_after)
+    last_path = None
+    since_checkpoint = 0
+
+    def save_checkpoint():
+        if writer is not None:
+            writer.flush()
+        if state is not None and last_path is not None:
+            state.save(os.path.relpath(last_path, root), completed)
+
+    try:
+        for result in detector.iter_predict(image_files, batch_size=batch_size, num_workers=num_workers):
+            if writer is not None:
+                writer.write(result)
+            last_path = result["image_path"]
+            completed += 1
+            since_checkpoint += 1
+            if since_checkpoint >= checkpoint_every:
+                save_checkpoint()
+                since_checkpoint = 0
+
+            yield result
+    finally:
+        save_checkpoint()
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,426 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from PIL import UnidentifiedImageError
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+import metrics
+from cascade import build_cascade
+from decode_guard import DecodeBusy, DecodeGuard, ImageTooLarge
+from micro_batcher import MicroBatcher
+from nsfw_detector import predict
+from phash_index import PerceptualIndex
+from result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.environ.get("NSFW_MODEL_PATH", "models/mobilenet_v2_140_224")
+MODEL_BACKEND = os.environ.get("NSFW_BACKEND", "tf")
+MODEL_THREADS = int(os.environ["NSFW_NUM_THREADS"]) if os.environ.get("NSFW_NUM_THREADS") else None
+TFLITE_XNNPACK = os.environ.get("NSFW_TFLITE_XNNPACK", "1").lower() not in ("0", "false", "no")
+CASCADE_BACKEND = os.environ.get("NSFW_CASCADE_BACKEND")
+CASCADE_MODEL_PATH = os.environ.get("NSFW_CASCADE_MODEL_PATH", MODEL_PATH)
+CASCADE_INPUT_SIZE = int(os.environ["NSFW_CASCADE_INPUT_SIZE"]) if os.environ.get("NSFW_CASCADE_INPUT_SIZE") else None
+CASCADE_LOW = float(os.environ.get("NSFW_CASCADE_LOW", "0.1"))
+CASCADE_HIGH = float(os.environ.get("NSFW_CASCADE_HIGH", "0.9"))
+MAX_BATCH_SIZE = 32
+MAX_BATCH_WAIT_MS = 5
+RESULT_CACHE_SIZE = 10000
+RESULT_CACHE_DB = os.environ.get("NSFW_RESULT_CACHE_DB") or None
+PHASH_THRESHOLD = int(os.environ["NSFW_PHASH_THRESHOLD"]) if os.environ.get("NSFW_PHASH_THRESHOLD") else None
+METRICS_ENABLED = os.environ.get("NSFW_METRICS", "1").lower() not in ("0", "false", "no")
+
+NSFW_THRESHOLD = 0.5
+
+API_VERSION = "1.0.0"
+CLASSES = ["drawings", "hentai", "neutral", "porn", "sexy"]
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+MAX_DOWNLOAD_BYTES = MAX_CONTENT_LENGTH
+MAX_IMAGE_PIXELS = int(os.environ.get("NSFW_MAX_IMAGE_PIXELS", "50000000"))
+DECODE_MEMORY_BUDGET = int(os.environ.get("NSFW_DECODE_MEMORY_MB", "512")) * 1024 * 1024
+DECODE_WAIT_TIMEOUT = 30
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_URLS_PER_REQUEST = 1000
+MAX_STREAM_FILES = 10000
+MAX_STREAM_BYTES = int(os.environ.get("NSFW_MAX_STREAM_BYTES", str(1024 ** 3)))
+MAX_STREAM_IN_FLIGHT = 2 * MAX_BATCH_SIZE
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+ENDPOINTS = {
+    "POST /predict": "Upload file for NSFW prediction",
+    "POST /predict_url": "Predict NSFW from image URL",
+    "POST /predict_batch": "Batch prediction with multiple files",
+    "POST /predict_urls": "Predict NSFW for a list of image URLs (streams NDJSON)",
+    "GET /health": "Health check",
+    "GET /metrics": "Prometheus metrics"
+}
+
+metrics.enable(METRICS_ENABLED)
+
+HTTP_IN_FLIGHT = metrics.Gauge("nsfw_http_requests_in_flight", "Requests currently being handled")
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "nsfw_http_request_duration_seconds",
+    "Request latency by endpoint, including streamed response bodies",
+    ["endpoint", "method", "status"]
+)
+DOWNLOAD_SECONDS = metrics.Histogram("nsfw_download_duration_seconds", "Image URL download time", ["outcome"])
+
+
+class DownloadTooLarge(ValueError):
+    pass
+
+
+def observe_request(endpoint, method, status, seconds):
+    HTTP_REQUEST_SECONDS.labels(endpoint, method, status).observe(seconds)
+
+
+@contextmanager
+def timed_download():
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        DOWNLOAD_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def check_image_response(content_type, content_length=None, max_bytes=MAX_DOWNLOAD_BYTES):
+    if not (content_type or "").startswith('image/'):
+        raise ValueError("URL does not point to an image file")
+    if content_length is not None and int(content_length) > max_bytes:
+        raise DownloadTooLarge(f"Image too large ({int(content_length)} bytes, maximum {max_bytes})")
+
+
+class CappedBuffer:
+    def __init__(self, max_bytes=MAX_DOWNLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self._chunks = []
+        self.size = 0
+
+    def append(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DownloadTooLarge(f"Image too large (more than {self.max_bytes} bytes)")
+        self._chunks.append(chunk)
+
+    def clear(self):
+        self._chunks = []
+
+    def getvalue(self):
+        return b"".join(self._chunks)
+
+
+def build_result(prediction):
+    # format_prediction already picked the top class; only the NSFW sum is new here
+    scores = prediction["scores"]
+    nsfw_score = predict.get_nsfw_score(scores)
+
+    return {
+        "is_nsfw": nsfw_score >= NSFW_THRESHOLD,
+        "nsfw_score": nsfw_score,
+        "predicted_class": prediction["predicted_class"],
+        "confidence": prediction["confidence"],
+        "scores": scores
+    }
+
+
+def result_from_prediction(prediction):
+    return build_result(prediction)
+
+
+def url_result(index, url, prediction=None, error=None):
+    return item_result({"index": index, "url": url}, prediction, error)
+
+
+def file_result(index, filename, prediction=None, error=None):
+    return item_result({"index": index, "filename": filename}, prediction, error)
+
+
+def item_result(entry, prediction=None, error=None):
+    if error is not None:
+        entry["error"] = str(error)
+    else:
+        entry["result"] = build_result(prediction)
+    return entry
+
+
+def parse_url_list(data):
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+        raise ValueError("A non-empty list of URLs is required")
+    if len(urls) > MAX_URLS_PER_REQUEST:
+        raise ValueError(f"Too many URLs (maximum {MAX_URLS_PER_REQUEST})")
+    return urls
+
+
+def wants_ndjson(stream_arg, accept):
+    return (stream_arg or "").lower() in ("1", "true", "yes") or "application/x-ndjson" in (accept or "")
+
+
+def multipart_boundary(content_type):
+    mimetype, options = parse_options_header(content_type or "")
+    if mimetype != "multipart/form-data" or not options.get("boundary"):
+        raise ValueError("Expected a multipart/form-data body")
+    return options["boundary"].encode("latin-1")
+
+
+class MultipartFileStream:
+    def __init__(self, boundary, field_name="files", max_file_bytes=MAX_CONTENT_LENGTH, max_files=MAX_STREAM_FILES,
+                 max_total_bytes=MAX_STREAM_BYTES):
+        self.field_name = field_name
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.max_total_bytes = max_total_bytes
+        self.files = 0
+        self.received = 0
+        self._decoder = MultipartDecoder(boundary, max_form_memory_size=max_file_bytes)
+        self._filename = None
+        self._buffer = None
+        self._error = None
+
+    def feed(self, chunk):
+        # Pass None once the body is exhausted; returns completed (filename, data, error) parts
+        if chunk is None:
+            if self._decoder.complete:
+                return []
+            self._decoder.receive_data(None)
+            return self._drain()
+
+        # Counted as the body arrives: Content-Length is absent for chunked uploads and not trusted otherwise
+        self.received += len(chunk)
+        if self.received > self.max_total_bytes:
+            raise DownloadTooLarge(f"Request body too large (maximum {self.max_total_bytes} bytes)")
+
+        completed = []
+        view = memoryview(chunk)
+        # The decoder refuses to buffer more than max_form_memory_size at once
+        for start in range(0, len(view), UPLOAD_CHUNK_SIZE):
+            self._decoder.receive_data(bytes(view[start:start + UPLOAD_CHUNK_SIZE]))
+            completed.extend(self._drain())
+        return completed
+
+    def _drain(self):
+        completed = []
+        while True:
+            event = self._decoder.next_event()
+            if isinstance(event, File):
+                self._start_file(event)
+            elif isinstance(event, Data):
+                if self._buffer is not None and self._error is None:
+                    try:
+                        self._buffer.append(event.data)
+                    except DownloadTooLarge:
+                        self._error = f"File too large (maximum {self.max_file_bytes} bytes)"
+                        self._buffer.clear()
+                if not event.more_data and self._buffer is not None:
+                    data = None if self._error else self._buffer.getvalue()
+                    completed.append((self._filename, data, self._error))
+                    self._filename, self._buffer, self._error = None, None, None
+            elif isinstance(event, (NeedData, Epilogue)):
+                return completed
+
+    def _start_file(self, event):
+        if event.name != self.field_name:
+            self._buffer = None
+            return
+        self.files += 1
+        if self.files > self.max_files:
+            raise ValueError(f"Too many files (maximum {self.max_files})")
+        self._filename = event.filename or ""
+        self._buffer = CappedBuffer(self.max_file_bytes)
+        self._error = None
+
+
+def iter_stream_batch(parts, submit, max_in_flight=MAX_STREAM_IN_FLIGHT):
+    # Results are yielded in upload order; at most max_in_flight images are held at once
+    pending = deque()
+    index = 0
+    for filename, data, error in parts:
+        if error is None and (filename == '' or not allowed_file(filename)):
+            error = "Invalid file"
+        future = submit(data) if error is None else None
+        pending.append((index, filename, future, error))
+        index += 1
+
+        while pending and (len(pending) >= max_in_flight or pending[0][2] is None or pending[0][2].done()):
+            yield _resolve_pending(*pending.popleft())
+
+    while pending:
+        yield _resolve_pending(*pending.popleft())
+
+
+def _resolve_pending(index, filename, future, error):
+    if future is None:
+        return file_result(index, filename, error=error)
+    try:
+        return file_result(index, filename, future.result())
+    except Exception as e:
+        logger.error(f"Prediction error for file {filename}: {e}")
+        return file_result(index, filename, error=e)
+
+
+def prediction_error_status(error):
+    # Status for a failed single-image request: undecodable or oversized images are the client's fault
+    if isinstance(error, UnidentifiedImageError):
+        return 400
+    if isinstance(error, ImageTooLarge):
+        return 413
+    if isinstance(error, DecodeBusy):
+        return 503
+    return 500
+
+
+def resolve_file_entry(entry, future):
+    # Per-file failures sit next to the filename, as for invalid files and in the NDJSON stream
+    try:
+        return item_result(entry, future.result())
+    except Exception as e:
+        logger.error(f"Prediction error for file {entry['filename']}: {e}")
+        return item_result(entry, error=e)
+
+
+def backend_options(backend):
+    # Without XNNPACK the TFLite kernels read the weights from the mapped file, shared by every worker process
+    if backend.startswith("tflite") and not TFLITE_XNNPACK:
+        return {"use_xnnpack": False}
+    return None
+
+
+class ModelService:
+    def __init__(self, model_path=MODEL_PATH, backend=MODEL_BACKEND, num_threads=MODEL_THREADS):
+        self.model_path = model_path
+        self.backend = backend
+        self.num_threads = num_threads
+        self.detector = None
+        self.batcher = None
+        self.status = "not_loaded"
+        self.error = None
+        self._loader_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.status == "ready"
+
+    def initialize(self):
+        try:
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(f"Model file not found: {self.model_path}")
+
+            cache = ResultCache(max_entries=RESULT_CACHE_SIZE, db_path=RESULT_CACHE_DB)
+            phash_index = PerceptualIndex(threshold=PHASH_THRESHOLD) if PHASH_THRESHOLD is not None else None
+            cascade = None
+            if CASCADE_BACKEND:
+                cascade = build_cascade(CASCADE_MODEL_PATH, CASCADE_BACKEND, CASCADE_INPUT_SIZE,
+                                        CASCADE_LOW, CASCADE_HIGH, self.num_threads, backend_options(CASCADE_BACKEND))
+            decode_guard = DecodeGuard(max_pixels=MAX_IMAGE_PIXELS, max_input_bytes=MAX_CONTENT_LENGTH,
+                                       memory_budget=DECODE_MEMORY_BUDGET, wait_timeout=DECODE_WAIT_TIMEOUT)
+            timings = metrics.MetricsTimings() if metrics.enabled() else None
+            detector = predict.load_model(self.model_path, cache=cache, phash_index=phash_index, timings=timings,
+                                          backend=self.backend, num_threads=self.num_threads,
+                                          backend_options=backend_options(self.backend), cascade=cascade,
+                                          decode_guard=decode_guard)
+            detector.warmup(batch_sizes=(1, MAX_BATCH_SIZE))
+            batcher = MicroBatcher(detector, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS)
+            batcher.start()
+            self.detector = detector
+            self.batcher = batcher
+            self.status = "ready"
+            logger.info("Model loaded successfully!")
+        except Exception as e:
+            self.status = "error"
+            self.error = str(e)
+            logger.error(f"Error loading model: {e}")
+            raise
+
+    def _load_in_background(self):
+        try:
+            self.initialize()
+        except Exception:
+            pass
+
+    def start_loading(self):
+        with self._lock:
+            if self._loader_thread is None:
+                self.status = "loading"
+                self._loader_thread = threading.Thread(target=self._load_in_background, name="model-loader", daemon=True)
+                self._loader_thread.start()
+        return self._loader_thread
+
+    def submit(self, image_input):
+        return self.batcher.submit(image_input)
+
+    def health(self):
+        if self.status == "ready":
+            return {"status": "healthy", "model_status": self.status, "message": "API is running"}, 200
+        if self.status == "error":
+            return {"status": "error", "model_status": self.status, "message": self.error}, 503
+        return {"status": "loading", "model_status": self.status, "message": "Model is loading"}, 503
+
+    def _component_stats(self, component, fields):
+        # fields maps a label value (or None for an unlabelled metric) to a key of component.stats()
+        def read():
+            target = self.batcher if component == "batcher" else getattr(self.detector, component, None)
+            if target is None:
+                return None
+            stats = target.stats()
+            if None in fields:
+                return stats[fields[None]]
+            return {(label,): stats[key] for label, key in fields.items()}
+        return read
+
+    def register_metrics(self):
+        # Scrape-time callbacks are bound to this service; importing both servers into one process (or
+        # registering twice) rebinds them instead of failing on the duplicate name
+        for name in ("nsfw_model_ready", "nsfw_result_cache_lookups", "nsfw_phash_lookups", "nsfw_cascade_images",
+                     "nsfw_decode_guard_images", "nsfw_decode_memory_bytes", "nsfw_batcher_queue_depth"):
+            metrics.REGISTRY.unregister(name)
+        metrics.CallbackMetric("nsfw_model_ready", "1 once the model is loaded and warmed up", "gauge",
+                               lambda: int(self.ready))
+        metrics.CallbackMetric("nsfw_result_cache_lookups", "Result cache lookups by outcome", "counter",
+                               self._component_stats("cache", {"memory_hit": "memory_hits", "disk_hit": "disk_hits",
+                                                               "miss": "misses"}), ["outcome"])
+        metrics.CallbackMetric("nsfw_phash_lookups", "Near-duplicate index lookups by outcome", "counter",
+                               self._component_stats("phash_index", {"hit": "hits", "miss": "misses"}), ["outcome"])
+        metrics.CallbackMetric("nsfw_cascade_images", "Images scored by each cascade stage", "counter",
+                               self._component_stats("cascade", {"stage1": "images", "full": "escalated"}), ["stage"])
+        metrics.CallbackMetric("nsfw_decode_guard_images", "Images the decode guard shrank on load or rejected",
+                               "counter", self._component_stats("decode_guard", {"reduced": "reduced",
+                                                                                 "rejected": "rejected"}), ["outcome"])
+        metrics.CallbackMetric("nsfw_decode_memory_bytes", "Estimated decoded bytes held by in-flight decodes", "gauge",
+                               self._component_stats("decode_guard", {None: "in_flight_bytes"}))
+        metrics.CallbackMetric("nsfw_batcher_queue_depth", "Requests waiting for the micro-batcher", "gauge",
+                               self._component_stats("batcher", {None: "queue_depth"}))
+
+    def not_ready(self):
+        return {"error": f"Model not ready ({self.status})", "status": self.status}, 503
+
+    def stats(self):
+        detector = self.detector
+        return {
+            "model_path": self.model_path,
+            "backend": self.backend,
+            "pid": os.getpid(),
+            "classes": CLASSES,
+            "input_size": [224, 224],
+            "model_loaded": detector is not None,
+            "model_status": self.status,
+            "batcher": self.batcher.stats() if self.batcher is not None else None,
+            "cache": detector.cache.stats() if detector is not None and detector.cache is not None else None,
+            "phash_index": detector.phash_index.stats() if detector is not None and detector.phash_index is not None else None,
+            "cascade": detector.cascade.stats() if detector is not None and detector.cascade is not None else None,
+            "decode_guard": detector.decode_guard.stats() if detector is not None and detector.decode_guard is not None else None,
+            "version": API_VERSION
+        }
@@ -0,0 +1,151 @@
+import io
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubBackend:
+    # Scores follow the mean pixel value (black -> drawings, white -> hentai/porn), so tests can
+    # steer predictions with plain images; no model file or TensorFlow is needed
+    def __init__(self, input_shape=(224, 224), embeddings=False):
+        self.input_shape = input_shape
+        self.embeddings = embeddings
+        self.batch_shapes = []
+
+    def __call__(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        self.batch_shapes.append(batch.shape)
+        mean = batch.reshape(len(batch), -1).mean(axis=1)
+        scores = np.stack([1 - mean, mean / 2, np.full_like(mean, 0.01), mean / 2, np.full_like(mean, 0.01)], axis=1)
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def predict_with_embeddings(self, batch):
+        # The embedding is the mean colour, so differently coloured images point in different directions
+        batch = np.asarray(batch, dtype=np.float32)
+        return self(batch), np.concatenate([batch.mean(axis=(1, 2)), np.full((len(batch), 1), 0.1, np.float32)], axis=1)
+
+
+@pytest.fixture
+def make_detector(tmp_path, monkeypatch):
+    # NSFWDetector factory running on StubBackend; backend_options={"input_shape": (h, w)} changes the model size
+    import backends
+    from nsfw_detector import NSFWDetector
+
+    monkeypatch.setitem(backends.BACKENDS, "stub", lambda model_path, num_threads=None, **options: StubBackend(**options))
+
+    def make(**kwargs):
+        return NSFWDetector(str(tmp_path), backend="stub", **kwargs)
+    return make
+
+
+@pytest.fixture
+def grey_image(tmp_path):
+    # Writes a solid grey image and returns its path
+    def make(value, size=(64, 48), name=None, format="PNG"):
+        path = tmp_path / (name or f"grey_{value}_{size[0]}x{size[1]}.{format.lower()}")
+        Image.new("RGB", size, (value, value, value)).save(path, format=format)
+        return str(path)
+    return make
+
+
+@pytest.fixture
+def model_service(tmp_path, make_detector):
+    # A loaded ModelService on StubBackend (make_detector registers the "stub" backend)
+    from server_common import ModelService
+
+    service = ModelService(str(tmp_path), backend="stub")
+    service.start_loading().join()
+    assert service.ready, service.error
+    yield service
+    service.batcher.stop()
+
+
+@pytest.fixture
+def flask_client(model_service, monkeypatch):
+    import api_server
+
+    monkeypatch.setattr(api_server, "service", model_service)
+    return api_server.app.test_client()
+
+
+
+@pytest.fixture
+def async_client(model_service, monkeypatch):
+    from starlette.testclient import TestClient
+
+    import async_api_server
+
+    # The service is already loaded, so the lifespan's start_loading() is a no-op
+    monkeypatch.setattr(async_api_server, "service", model_service)
+    with TestClient(async_api_server.app) as client:
+        yield client
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    # /grey/<value>.png: a grey PNG; /slow/<value>.png: the same after a delay; /large.jpg: 17MB of
+    # "JPEG" without a Content-Length; /page.html: not an image; anything else: 404
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self._respond(self.path.split("?")[0].strip("/").split("/"))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _respond(self, parts):
+        if parts[0] in ("grey", "slow") and len(parts) == 2:
+            if parts[0] == "slow":
+                time.sleep(0.2)
+            buffer = io.BytesIO()
+            value = int(parts[1].split(".")[0])
+            Image.new("RGB", (32, 32), (value, value, value)).save(buffer, format="PNG")
+            self._send(200, "image/png", buffer.getvalue())
+        elif parts == ["large.jpg"]:
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.end_headers()
+            for _ in range(17):
+                self.wfile.write(b"\xff" * 1024 * 1024)
+        elif parts == ["page.html"]:
+            self._send(200, "text/html", b"<html></html>")
+        else:
+            self._send(404, "text/plain", b"not found")
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def image_server():
+    # Local HTTP server for URL tests; image_server.url(path) builds a URL and max_active counts concurrent requests
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.active = server.max_active = 0
+    server.url = lambda path: f"http://127.0.0.1:{server.server_port}/{path}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,64 @@
+import io
+
+from PIL import Image
+
+
+def png(value, size=(32, 32)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (value, value, value)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_home_and_health(async_client):
+    assert "POST /predict" in async_client.get("/").json()["endpoints"]
+    response = async_client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["status"] == "healthy"
+
+
+def test_predict(async_client):
+    response = async_client.post("/predict", files={"file": ("black.png", png(0))})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["filename"] == "black.png"
+    assert body["result"]["predicted_class"] == "drawings"
+
+
+def test_predict_rejects_bad_uploads(async_client):
+    assert async_client.post("/predict").status_code == 400
+    assert async_client.post("/predict", files={"file": ("notes.txt", b"text")}).status_code == 400
+    response = async_client.post("/predict", files={"file": ("broken.jpg", b"not an image")})
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_predict_batch_keeps_upload_order(async_client):
+    files = [("files", ("a.png", png(0))), ("files", ("b.txt", b"text")), ("files", ("c.png", png(255)))]
+    body = async_client.post("/predict_batch", files=files).json()
+
+    assert body["total_files"] == 3
+    assert [result["filename"] for result in body["results"]] == ["a.png", "b.txt", "c.png"]
+    assert body["results"][1]["error"] == "Invalid file"
+    assert body["results"][0]["result"]["predicted_class"] == "drawings"
+    assert body["results"][2]["result"]["nsfw_score"] > body["results"][0]["result"]["nsfw_score"]
+
+
+def test_predict_url(async_client, image_server):
+    response = async_client.post("/predict_url", json={"url": image_server.url("grey/0.png")})
+    assert response.status_code == 200
+    assert response.json()["result"]["predicted_class"] == "drawings"
+
+    assert async_client.post("/predict_url", json={}).status_code == 400
+    assert async_client.post("/predict_url", json={"url": image_server.url("page.html")}).status_code == 500
+
+
+def test_oversized_downloads_are_413_in_both_servers(async_client, flask_client, image_server):
+    url = image_server.url("large.jpg")
+    assert async_client.post("/predict_url", json={"url": url}).status_code == 413
+    assert flask_client.post("/predict_url", json={"url": url}).status_code == 413
+
+
+def test_not_ready_is_503(async_client, model_service, monkeypatch):
+    monkeypatch.setattr(model_service, "status", "loading")
+    assert async_client.post("/predict", files={"file": ("a.png", png(0))}).status_code == 503
+    assert async_client.get("/health").status_code == 503
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from backends import create_backend  # noqa: E402
+
+# Float backends should agree with TensorFlow to rounding error; int8 only approximately
+TOLERANCES = {"tflite": 1e-5, "tflite-float16": 1e-2, "tflite-int8": 0.1, "onnx": 1e-5}
+
+
+@pytest.fixture(scope="module")
+def model_path(tmp_path_factory):
+    # A tiny stand-in for MobileNetV2 with the same signature: 224x224 RGB in, 5 softmax scores out
+    keras = tf.keras
+    keras.utils.set_random_seed(0)
+    inputs = keras.Input((224, 224, 3), name="input")
+    x = keras.layers.Conv2D(8, 3, strides=4, activation="relu")(inputs)
+    x = keras.layers.GlobalAveragePooling2D()(x)
+    x = keras.layers.Dense(16, activation="relu")(x)
+    outputs = keras.layers.Dense(5, activation="softmax", name="prediction")(x)
+    path = str(tmp_path_factory.mktemp("models") / "tiny")
+    keras.Model(inputs, outputs).export(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def batch():
+    return np.random.default_rng(0).random((3, 224, 224, 3), dtype=np.float32)
+
+
+def require(backend):
+    if backend.startswith("tflite"):
+        pytest.importorskip("ai_edge_litert", reason="TFLite backends use ai_edge_litert when installed")
+    if backend == "onnx":
+        pytest.importorskip("tf2onnx")
+        pytest.importorskip("onnxruntime")
+
+
+@pytest.mark.parametrize("backend", sorted(TOLERANCES))
+def test_backend_matches_tensorflow(model_path, batch, backend):
+    require(backend)
+    expected = create_backend("tf", model_path)(batch)
+    actual = create_backend(backend, model_path)(batch)
+    assert actual.shape == expected.shape == (3, 5)
+    np.testing.assert_allclose(actual, expected, atol=TOLERANCES[backend])
+    # Batch sizes other than the converted one go through a tensor resize
+    np.testing.assert_allclose(create_backend(backend, model_path)(batch[:1]), expected[:1], atol=TOLERANCES[backend])
+
+
+@pytest.mark.parametrize("backend", ["tf", "tflite", "onnx"])
+def test_embeddings_match_tensorflow(model_path, batch, backend):
+    require(backend)
+    expected_rows = create_backend("tf", model_path)(batch)
+    _, expected_embeddings = create_backend("tf", model_path, embeddings=True).predict_with_embeddings(batch)
+    rows, embeddings = create_backend(backend, model_path, embeddings=True).predict_with_embeddings(batch)
+
+    assert embeddings.shape == (3, 16)
+    np.testing.assert_allclose(rows, expected_rows, atol=1e-5)
+    np.testing.assert_allclose(embeddings, expected_embeddings, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", ["tf", "tflite", "onnx"])
+def test_backends_report_the_input_size(model_path, backend):
+    require(backend)
+    assert create_backend(backend, model_path).input_shape == (224, 224)
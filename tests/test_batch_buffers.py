@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+from PIL import Image
+
+from nsfw_detector import BatchBuffer, decode_image
+
+
+def test_normalize_scales_only_the_filled_rows():
+    buffer = BatchBuffer(4, (8, 6))
+    assert buffer.pixels.shape == (4, 6, 8, 3)
+    buffer.pixels[:2] = 255
+
+    inputs = buffer.normalize(2)
+
+    assert inputs.shape == (2, 6, 8, 3)
+    assert inputs.dtype == np.float32
+    assert np.all(inputs == 1.0)
+    assert np.shares_memory(inputs, buffer.inputs)
+
+
+def test_buffers_are_reused_per_thread(make_detector):
+    detector = make_detector()
+    buffer = detector.acquire_buffer(4)
+    detector.release_buffer(buffer)
+
+    assert detector.acquire_buffer(2) is buffer
+    detector.release_buffer(buffer)
+    assert detector.acquire_buffer(8) is not buffer
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(detector.acquire_buffer(2)))
+    thread.start()
+    thread.join()
+    assert other[0] is not buffer
+
+
+def test_preprocess_writes_into_the_given_row(make_detector, grey_image):
+    detector = make_detector()
+    buffer = detector.acquire_buffer(2)
+
+    pixels = detector.preprocess_pixels(grey_image(200), out=buffer.pixels[1])
+
+    assert np.shares_memory(pixels, buffer.pixels)
+    assert np.all(buffer.pixels[1] == 200)
+
+
+def test_fast_decode_downscales_large_jpegs(tmp_path):
+    path = tmp_path / "large.jpg"
+    Image.new("RGB", (2000, 1600), (90, 120, 150)).save(path, quality=90)
+
+    fast = decode_image(str(path), (224, 224), fast_decode=True)
+    full = decode_image(str(path), (224, 224), fast_decode=False)
+
+    assert full.size == (2000, 1600)
+    # draft() picks the smallest DCT scale that still covers the target size
+    assert 224 <= fast.size[0] < 2000 and 224 <= fast.size[1] < 1600
+    assert fast.mode == "RGB"
+
+
+def test_fast_and_full_decode_agree(make_detector, tmp_path):
+    path = tmp_path / "large.jpg"
+    gradient = np.linspace(0, 255, 2000, dtype=np.uint8)
+    Image.fromarray(np.dstack([np.tile(gradient, (1600, 1))] * 3)).save(path, quality=90)
+
+    fast = make_detector(fast_decode=True).predict(str(path))["scores"]
+    full = make_detector(fast_decode=False).predict(str(path))["scores"]
+
+    for name in fast:
+        assert abs(fast[name] - full[name]) < 0.01
@@ -0,0 +1,52 @@
+from nsfw_detector import predict
+
+
+def test_predict_batch_runs_one_forward_pass_per_chunk(make_detector, grey_image):
+    detector = make_detector(batch_size=2)
+    paths = [grey_image(value) for value in (0, 60, 120, 180, 240)]
+
+    results = detector.predict_batch(paths)
+
+    assert [result["image_path"] for result in results] == paths
+    assert [shape[0] for shape in detector.model.batch_shapes] == [2, 2, 1]
+    assert results[0]["predicted_class"] == "drawings"
+    assert results[-1]["scores"]["porn"] > results[0]["scores"]["porn"]
+
+
+def test_batch_matches_single_predictions(make_detector, grey_image):
+    detector = make_detector(batch_size=3)
+    paths = [grey_image(value) for value in (10, 200, 90)]
+
+    batched = detector.predict_batch(paths)
+
+    for path, result in zip(paths, batched):
+        single = detector.predict(path)
+        for name, score in single["scores"].items():
+            assert abs(result["scores"][name] - score) < 1e-6
+
+
+def test_unreadable_images_are_reported_in_place(make_detector, grey_image, tmp_path):
+    detector = make_detector(batch_size=2)
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    paths = [grey_image(0), str(broken), grey_image(255)]
+
+    results = detector.predict_batch(paths)
+
+    assert [result["image_path"] for result in results] == paths
+    assert "error" in results[1]
+    assert "error" not in results[0] and "error" not in results[2]
+    # The broken file never reaches the model
+    assert sum(shape[0] for shape in detector.model.batch_shapes) == 2
+
+
+def test_classify_directory_with_batch_size_override(make_detector, grey_image, tmp_path):
+    detector = make_detector(batch_size=32)
+    for value in range(5):
+        grey_image(value * 50, name=f"{value}.png")
+
+    results = predict.classify(detector, str(tmp_path), batch_size=2)
+
+    assert sorted(results) == [f"{value}.png" for value in range(5)]
+    assert max(shape[0] for shape in detector.model.batch_shapes) == 2
+    assert all("error" not in scores for scores in results.values())
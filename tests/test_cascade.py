@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from cascade import Cascade, band_report, evaluate_cascade
+
+
+@pytest.fixture
+def stage1(make_detector):
+    return make_detector(input_size=(112, 112), backend_options={"input_shape": (112, 112)})
+
+
+def test_only_the_uncertain_band_reaches_the_full_model(make_detector, stage1, grey_image):
+    detector = make_detector(cascade=Cascade(stage1, low=0.1, high=0.9))
+    paths = [grey_image(value) for value in (0, 128, 255)]
+
+    results = detector.predict_batch(paths)
+
+    assert stage1.model.batch_shapes == [(3, 112, 112, 3)]
+    assert detector.model.batch_shapes == [(1, 224, 224, 3)]
+    assert [result["predicted_class"] for result in results][0] == "drawings"
+    assert detector.cascade.stats() == {
+        "low": 0.1, "high": 0.9, "images": 3, "escalated": 1, "escalation_rate": pytest.approx(1 / 3),
+    }
+
+
+def test_cascade_results_match_the_full_model(make_detector, stage1, grey_image):
+    paths = [grey_image(value) for value in (0, 64, 128, 192, 255)]
+    expected = make_detector().predict_batch(paths)
+
+    results = make_detector(cascade=Cascade(stage1, low=0.0, high=1.0)).predict_batch(paths)
+
+    for result, full in zip(results, expected):
+        assert result["scores"] == pytest.approx(full["scores"], abs=1e-6)
+
+
+def test_cascade_is_part_of_the_model_identity(make_detector, stage1):
+    assert make_detector(cascade=Cascade(stage1)).model_identity() != make_detector().model_identity()
+    assert Cascade(stage1, 0.2, 0.8).identity() != Cascade(stage1, 0.1, 0.9).identity()
+
+
+def test_invalid_band(stage1):
+    with pytest.raises(ValueError, match="Invalid uncertainty band"):
+        Cascade(stage1, low=0.9, high=0.1)
+
+
+def test_cascade_and_embeddings_are_exclusive(make_detector, stage1):
+    with pytest.raises(ValueError, match="cannot be combined with a cascade"):
+        make_detector(cascade=Cascade(stage1), embeddings=True)
+
+
+def test_band_report():
+    # Columns: drawings, nsfw; stage 1 is confidently wrong on the last image
+    full_rows = np.array([[0.9, 0.1], [0.2, 0.8], [0.6, 0.4], [0.1, 0.9]])
+    stage1_rows = np.array([[0.95, 0.05], [0.5, 0.5], [0.7, 0.3], [0.99, 0.01]])
+
+    report = band_report(full_rows, stage1_rows, [1], 0.1, 0.9, 0.5, full_ms=10.0, stage1_ms=2.0)
+
+    assert report["escalation_rate"] == 0.5
+    assert report["missed_nsfw"] == 1
+    assert report["extra_nsfw"] == 0
+    assert report["decision_agreement"] == 0.75
+    assert report["ms_per_image"] == pytest.approx(7.0)
+    assert report["compute_saved"] == pytest.approx(0.3)
+
+
+def test_evaluate_cascade(make_detector, stage1, grey_image, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    paths = [grey_image(value) for value in (0, 128, 255)] + [str(broken)]
+
+    report = evaluate_cascade(make_detector(), stage1, paths, batch_size=2)
+
+    assert report["images"] == 3
+    assert report["errors"] == 1
+    assert report["configured"]["escalation_rate"] == pytest.approx(1 / 3)
+    assert report["configured"]["decision_agreement"] == 1.0
+    assert (report["bands"][0]["low"], report["bands"][0]["high"]) == (0.1, 0.9)
+    with pytest.raises(ValueError, match="must not use a cascade"):
+        evaluate_cascade(make_detector(cascade=Cascade(stage1)), stage1, paths)
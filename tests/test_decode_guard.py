@@ -0,0 +1,102 @@
+import io
+import pickle
+import struct
+import threading
+import zlib
+
+import pytest
+from PIL import Image
+
+from decode_guard import DecodeBusy, DecodeGuard, ImageTooLarge, decoded_bytes
+
+
+def png_header(width, height):
+    # A valid PNG header that declares a huge canvas without carrying its pixels
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+
+
+def encode(size, image_format):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (120, 60, 30)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_oversized_header_is_rejected_before_decoding():
+    guard = DecodeGuard(max_pixels=1_000_000)
+    with pytest.raises(ImageTooLarge, match="8000x7000"):
+        guard.open(png_header(8000, 7000), (224, 224))
+    assert guard.stats()["rejected"] == 1
+
+
+def test_large_jpeg_is_drafted_under_the_budget():
+    guard = DecodeGuard(max_pixels=1_000_000)
+    image, header_size = guard.open_with_size(encode((2400, 1600), "JPEG"), (224, 224))
+    assert header_size == (2400, 1600)
+    assert image.width * image.height <= 1_000_000
+    assert guard.stats()["reduced"] == 1
+
+
+def test_input_bytes_are_limited():
+    guard = DecodeGuard(max_input_bytes=1024)
+    with pytest.raises(ImageTooLarge, match="bytes"):
+        guard.open(b"\0" * 2048, (224, 224))
+
+
+def test_in_memory_images_are_only_checked():
+    guard = DecodeGuard(max_pixels=100)
+    with pytest.raises(ImageTooLarge):
+        guard.open(Image.new("RGB", (20, 20)), (224, 224))
+
+
+def test_decoded_bytes_counts_the_rgb_copy():
+    assert decoded_bytes(Image.new("RGB", (10, 10))) == 300
+    assert decoded_bytes(Image.new("L", (10, 10))) == 100 + 300
+
+
+def test_memory_budget_blocks_then_times_out():
+    guard = DecodeGuard(memory_budget=1000, wait_timeout=0.05)
+    with pytest.raises(ImageTooLarge):
+        with guard.reserve(2000):
+            pass
+
+    with guard.reserve(800):
+        assert guard.stats()["in_flight_bytes"] == 800
+        with pytest.raises(DecodeBusy):
+            with guard.reserve(400):
+                pass
+    assert guard.stats()["in_flight_bytes"] == 0
+    assert guard.stats()["timeouts"] == 1
+
+
+def test_waiting_decode_proceeds_when_memory_frees():
+    guard = DecodeGuard(memory_budget=1000, wait_timeout=5)
+    reserved = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with guard.reserve(800):
+            reserved.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    reserved.wait()
+    threading.Timer(0.05, release.set).start()
+    with guard.reserve(400):
+        assert guard.stats()["in_flight_bytes"] == 400
+    thread.join()
+    assert guard.stats()["waits"] == 1
+
+
+def test_pickled_guard_keeps_limits_with_a_fresh_budget():
+    guard = DecodeGuard(max_pixels=123, memory_budget=1000)
+    with pytest.raises(ImageTooLarge):
+        guard.check_pixels((100, 100))
+
+    copy = pickle.loads(pickle.dumps(guard))
+    assert (copy.max_pixels, copy.memory_budget) == (123, 1000)
+    assert copy.stats()["rejected"] == 0
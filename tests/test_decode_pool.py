@@ -0,0 +1,47 @@
+import pytest
+
+
+@pytest.fixture
+def images(grey_image, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    paths = [grey_image(value, format="JPEG") for value in range(0, 256, 40)]
+    paths.insert(3, str(broken))
+    return paths
+
+
+def scores(results):
+    return [result.get("scores", "error") for result in results]
+
+
+@pytest.mark.parametrize("worker_type", ["thread", "process"])
+def test_pool_matches_sequential_decoding(make_detector, images, worker_type):
+    sequential = make_detector(batch_size=3).predict_batch(images)
+
+    detector = make_detector(batch_size=3, num_workers=2, worker_type=worker_type, prefetch_batches=1)
+    try:
+        pooled = detector.predict_batch(images)
+    finally:
+        detector.close()
+
+    assert [result["image_path"] for result in pooled] == images
+    assert scores(pooled) == scores(sequential)
+    assert "error" in pooled[3]
+
+
+def test_num_workers_per_call(make_detector, images):
+    detector = make_detector(batch_size=4)
+    try:
+        results = detector.predict_batch(images, num_workers=2)
+        assert detector._executor is not None
+    finally:
+        detector.close()
+
+    assert detector._executor is None
+    assert [result["image_path"] for result in results] == images
+
+
+def test_unknown_worker_type(make_detector, images):
+    detector = make_detector(num_workers=2, worker_type="fiber")
+    with pytest.raises(ValueError, match="Unknown worker type"):
+        detector.predict_batch(images)
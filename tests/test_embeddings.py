@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from embeddings import EmbeddingStore, merge_topk, search_matrix
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EmbeddingStore(str(tmp_path / "store"), flush_rows=None)
+
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def test_merge_topk_sorts_and_keeps_the_best():
+    scores, indices = merge_topk(np.array([[0.1, 0.9, -np.inf, 0.5]]), np.array([[0, 1, -1, 3]]), 2)
+
+    assert list(indices[0]) == [1, 3]
+    assert list(scores[0]) == [0.9, 0.5]
+
+
+def test_chunked_search_matches_brute_force():
+    matrix = random_vectors(100)
+    queries = random_vectors(3, seed=1)
+
+    scores, indices = search_matrix(matrix, queries, 5, chunk_rows=7)
+
+    expected = np.argsort(-(queries @ matrix.T), axis=1)[:, :5]
+    assert (indices == expected).all()
+    assert scores[:, 0] == pytest.approx((queries @ matrix.T).max(axis=1), rel=1e-5)
+
+
+def test_rows_are_written_on_flush_and_survive_reopening(store, tmp_path):
+    vectors = random_vectors(10)
+    store.add_batch([f"{index}.jpg" for index in range(10)], vectors)
+    assert len(store) == 0
+
+    store.flush()
+    reopened = EmbeddingStore(store.path)
+
+    assert len(reopened) == 10 and reopened.dim == 16
+    assert reopened.paths()[3] == "3.jpg"
+    assert np.linalg.norm(reopened.vector(3)) == pytest.approx(1.0, abs=1e-3)
+    with pytest.raises(ValueError, match="16-d"):
+        EmbeddingStore(store.path, dim=8)
+
+
+def test_flush_rows_flushes_automatically(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"), flush_rows=4)
+    for index, vector in enumerate(random_vectors(6)):
+        store.add(f"{index}.jpg", vector)
+
+    assert len(store) == 4
+    store.close()
+    assert len(store) == 6
+
+
+def test_search_finds_the_nearest_rows(store):
+    vectors = random_vectors(50)
+    store.add_batch([f"{index}.jpg" for index in range(50)], vectors)
+    store.flush()
+
+    scores, indices = store.search(vectors[[7, 21]] * 3.0, k=3)
+
+    assert list(indices[:, 0]) == [7, 21]
+    assert scores[:, 0] == pytest.approx([1.0, 1.0], abs=1e-2)
+    hits = store.neighbours(vectors[7], k=3)
+    assert hits[0]["image_path"] == "7.jpg"
+    assert all(hit["image_path"] != "7.jpg" for hit in store.neighbours("7.jpg", k=3))
+    assert store.neighbours("7.jpg", k=3, min_similarity=1.1) == []
+
+
+def test_interrupted_flush_is_dropped_on_open(store):
+    store.add_batch(["a.jpg", "b.jpg"], random_vectors(2))
+    store.flush()
+    # Rows written after the last meta.json update, as if the process died mid-flush
+    with open(store._file("vectors.f16"), "ab") as f:
+        f.write(b"\x00" * 16 * 2 * 3)
+    with open(store._file("paths.jsonl"), "ab") as f:
+        f.write(b'"c.jpg"\n"d.j')
+
+    reopened = EmbeddingStore(store.path)
+
+    assert len(reopened) == 2
+    assert reopened.paths() == ["a.jpg", "b.jpg"]
+    reopened.add("e.jpg", random_vectors(1)[0])
+    reopened.flush()
+    assert EmbeddingStore(store.path).paths() == ["a.jpg", "b.jpg", "e.jpg"]
+
+
+def test_truncate_rewinds_to_a_checkpoint(store):
+    store.add_batch([f"{index}.jpg" for index in range(5)], random_vectors(5))
+    store.flush()
+    store.add("pending.jpg", random_vectors(1)[0])
+
+    store.truncate(3)
+
+    assert len(store) == 3
+    assert store.paths() == ["0.jpg", "1.jpg", "2.jpg"]
+    reopened = EmbeddingStore(store.path)
+    assert reopened.paths() == ["0.jpg", "1.jpg", "2.jpg"]
+    assert reopened.matrix().shape == (3, 16)
+    with pytest.raises(ValueError, match="holds 3 rows"):
+        store.truncate(4)
+
+
+def test_ivf_pq_index_with_unindexed_tail(store):
+    pytest.importorskip("faiss")
+    vectors = random_vectors(600)
+    store.add_batch([f"{index}.jpg" for index in range(600)], vectors)
+    store.build_index(nlist=4, m=4, nbits=4, nprobe=4)
+    store.add_batch(["new.jpg"], vectors[:1] + 0.01)
+    store.flush()
+
+    scores, indices = store.search(vectors[[5, 300]], k=2)
+
+    assert list(indices[:, 0]) == [5, 300]
+    assert set(store.search(vectors[0], k=2)[1][0]) == {0, 600}
+    store.truncate(500)
+    assert store.meta["index"] is None
+
+
+def test_detector_embeddings(make_detector, tmp_path):
+    paths = []
+    for name, colour in (("red", (255, 0, 0)), ("dark_red", (200, 0, 0)), ("blue", (0, 0, 255))):
+        path = tmp_path / f"{name}.png"
+        Image.new("RGB", (64, 48), colour).save(path)
+        paths.append(str(path))
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    detector = make_detector(embeddings=True, batch_size=2)
+
+    rows = list(detector.iter_embedding_rows(paths + [str(broken)]))
+
+    assert [row[0] for row in rows] == paths + [str(broken)]
+    assert rows[-1][2] is None and rows[-1][3] is not None
+    store = EmbeddingStore(str(tmp_path / "store"), model_identity=detector.model_identity())
+    store.add_batch([row[0] for row in rows[:3]], [row[2] for row in rows[:3]])
+    store.flush()
+    assert store.neighbours(paths[0], k=1)[0]["image_path"] == paths[1]
+    assert detector.predict(paths[2], return_embedding=True)["embedding"] == pytest.approx(rows[2][2], abs=1e-6)
+
+
+def test_embeddings_need_an_embedding_detector(make_detector, grey_image):
+    with pytest.raises(ValueError, match="embeddings=True"):
+        list(make_detector().iter_embedding_rows([grey_image(0)]))
@@ -0,0 +1,145 @@
+import itertools
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from frames import FrameThinner, PacedSampler, aggregate_scores, iter_frames, uniform_indices
+
+
+def save_gif(path, values, size=(32, 24)):
+    # Pillow merges identical consecutive GIF frames, so callers pass slightly different values
+    images = [Image.new("RGB", size, (value, value, value)) for value in values]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=50)
+    return str(path)
+
+
+def save_video(path, values, fps=10, size=(64, 48)):
+    av = pytest.importorskip("av")
+    container = av.open(str(path), "w")
+    stream = container.add_stream("mpeg4", rate=fps)
+    stream.width, stream.height = size
+    stream.pix_fmt = "yuv420p"
+    stream.codec_context.gop_size = 5
+    for value in values:
+        frame = av.VideoFrame.from_ndarray(np.full((size[1], size[0], 3), value, np.uint8), format="rgb24")
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode():
+        container.mux(packet)
+    container.close()
+    return str(path)
+
+
+def test_uniform_indices_are_centred_in_their_segments():
+    assert uniform_indices(3, 8) == [0, 1, 2]
+    assert uniform_indices(100, 4) == [12, 37, 62, 87]
+
+
+def test_frame_thinner_keeps_an_even_spread_in_bounded_memory():
+    thinner = FrameThinner(4)
+    for index in range(1000):
+        thinner.offer(index)
+        assert len(thinner.frames) < 8
+
+    kept = thinner.result()
+    assert len(kept) == 4
+    assert kept[0] < 250 and kept[-1] > 750
+
+
+def test_paced_sampler_spreads_frames_over_the_stream():
+    sampler = PacedSampler(100, 4)
+    kept = [position for position in range(100) if sampler.offer(position)]
+
+    assert kept == [0, 25, 50, 75]
+    assert sampler.done
+    assert not PacedSampler(100, 0).offer(None)
+    assert PacedSampler(100, 1).offer(None)
+
+
+def test_aggregations():
+    rows = np.array([[1.0, 0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.2, 0.8, 0.0], [0.5, 0.0, 0.0, 0.5, 0.0]])
+    columns = [1, 3, 4]
+
+    row, worst, scores = aggregate_scores(rows, columns, "max")
+    assert worst == 1 and list(row) == list(rows[1])
+    assert list(scores) == pytest.approx([0.0, 0.8, 0.5])
+    assert aggregate_scores(rows, columns, "mean")[0] == pytest.approx(rows.mean(axis=0))
+    assert aggregate_scores(rows, columns, "topk", top_k=2)[0] == pytest.approx(rows[1:].mean(axis=0))
+    with pytest.raises(ValueError):
+        aggregate_scores(rows, columns, "median")
+
+
+def test_gif_frames(make_detector, tmp_path):
+    gif = save_gif(tmp_path / "a.gif", list(range(9)) + [255])
+
+    result = make_detector().predict_frames(gif, max_frames=10, early_stop=False)
+
+    assert [frame["frame"] for frame in result["frames"]] == list(range(10))
+    assert result["worst_frame"]["frame"] == 9
+    assert result["nsfw_score"] > 0.9
+    assert not result["stopped_early"]
+    mean = make_detector().predict_frames(gif, max_frames=10, aggregate="mean", early_stop=False)
+    assert mean["nsfw_score"] < result["nsfw_score"]
+
+
+def test_early_stop_skips_the_remaining_batches(make_detector, tmp_path):
+    gif = save_gif(tmp_path / "a.gif", list(range(240, 256)))
+    detector = make_detector()
+
+    result = detector.predict_frames(gif, max_frames=16, frame_batch_size=4)
+
+    assert result["stopped_early"]
+    assert len(result["frames"]) == 4
+    assert [shape[0] for shape in detector.model.batch_shapes] == [4]
+
+
+def test_scene_sampling_keeps_one_frame_per_scene(tmp_path):
+    gif = save_gif(tmp_path / "a.gif", list(range(5)) + list(range(250, 255)) + list(range(5, 10)))
+
+    assert [frame.index for frame in iter_frames(gif, "scene", max_frames=8)] == [0, 5, 10]
+
+
+def test_unknown_sampling_method(tmp_path):
+    with pytest.raises(ValueError, match="Unknown frame sampling"):
+        iter_frames(save_gif(tmp_path / "a.gif", [0, 255]), "random")
+
+
+@pytest.mark.parametrize("sampling", ["uniform", "keyframe", "scene"])
+def test_video_sampling(tmp_path, sampling):
+    video = save_video(tmp_path / "v.mp4", [(index // 10) * 25 for index in range(100)])
+
+    frames = list(iter_frames(video, sampling, max_frames=8))
+
+    assert 1 < len(frames) <= 8
+    times = [frame.time for frame in frames]
+    assert times == sorted(times)
+    assert times[-1] > 5.0
+
+
+def test_video_frames_are_decoded_lazily(tmp_path, monkeypatch):
+    av = pytest.importorskip("av")
+    video = save_video(tmp_path / "v.mp4", [(index // 10) * 25 for index in range(100)])
+    decoded = []
+    decode = av.container.InputContainer.decode
+
+    def counting_decode(self, *args, **kwargs):
+        for frame in decode(self, *args, **kwargs):
+            decoded.append(frame)
+            yield frame
+    monkeypatch.setattr(av.container.InputContainer, "decode", counting_decode)
+
+    frames = iter_frames(video, "scene", max_frames=8)
+    list(itertools.islice(frames, 2))
+    frames.close()
+
+    assert len(decoded) < 50
+
+
+def test_video_prediction(make_detector, tmp_path):
+    video = save_video(tmp_path / "v.mp4", [0] * 50 + [255] * 50)
+
+    result = make_detector().predict_frames(video, max_frames=8, early_stop=False)
+
+    assert len(result["frames"]) == 8
+    assert result["worst_frame"]["time"] >= 5.0
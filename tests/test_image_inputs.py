@@ -0,0 +1,83 @@
+import io
+import logging
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from nsfw_detector import input_label, predict
+
+
+@pytest.fixture
+def image():
+    pixels = np.zeros((48, 64, 3), dtype=np.uint8)
+    pixels[:, 32:] = 255
+    return Image.fromarray(pixels)
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_in_memory_inputs_match_the_file(make_detector, image, tmp_path):
+    detector = make_detector()
+    path = tmp_path / "image.png"
+    image.save(path)
+    expected = detector.predict(str(path))["scores"]
+
+    with open(path, "rb") as f:
+        inputs = [png_bytes(image), bytearray(png_bytes(image)), image, np.asarray(image),
+                  np.asarray(image).astype(np.float32) / 255.0, f]
+        for image_input in inputs:
+            assert detector.predict(image_input)["scores"] == pytest.approx(expected, abs=1e-6)
+
+
+def test_unsupported_input_type(make_detector):
+    with pytest.raises(TypeError, match="Unsupported image input type"):
+        make_detector().predict(42)
+
+
+def test_input_labels():
+    assert input_label("/data/a.jpg") == "/data/a.jpg"
+    assert input_label(b"\x00" * 10) == "<bytes len=10>"
+    assert input_label(memoryview(b"\x00" * 10)) == "<bytes len=10>"
+    assert input_label(Image.new("RGB", (64, 48))) == "<PIL.Image RGB 64x48>"
+    assert input_label(np.zeros((48, 64, 3), np.uint8)) == "<ndarray shape=(48, 64, 3) dtype=uint8>"
+
+
+def test_results_and_logs_use_short_labels(make_detector, image, caplog):
+    detector = make_detector()
+    garbage = b"\xff" * 5000
+    inputs = [png_bytes(image), garbage, image, np.asarray(image)]
+
+    with caplog.at_level(logging.ERROR, logger="nsfw_detector"):
+        results = list(detector.iter_predict(inputs))
+
+    assert [result["image_path"] for result in results] == [
+        f"<bytes len={len(inputs[0])}>", "<bytes len=5000>", "<PIL.Image RGB 64x48>",
+        "<ndarray shape=(48, 64, 3) dtype=uint8>",
+    ]
+    assert "error" in results[1]
+    assert "<bytes len=5000>" in caplog.text
+    assert "\\xff" not in caplog.text
+
+
+def test_classify_names_list_entries(make_detector, image, tmp_path):
+    path = tmp_path / "named.png"
+    image.save(path)
+    with open(path, "rb") as f:
+        results = predict.classify(make_detector(), [png_bytes(image), f, image])
+
+    assert sorted(results) == ["image_0", "image_2", "named.png"]
+
+
+def test_predict_endpoint_status_codes(flask_client, image):
+    response = flask_client.post("/predict", data={"file": (io.BytesIO(png_bytes(image)), "image.png")})
+    assert response.status_code == 200
+    assert response.json["result"]["scores"]
+
+    response = flask_client.post("/predict", data={"file": (io.BytesIO(b"not an image"), "image.jpg")})
+    assert response.status_code == 400
+    assert "error" in response.json
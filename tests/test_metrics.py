@@ -0,0 +1,68 @@
+import pytest
+
+from metrics import CallbackMetric, Counter, Gauge, Histogram, Registry
+
+
+def samples(registry):
+    return [line for line in registry.render().splitlines() if not line.startswith("#")]
+
+
+def test_text_format():
+    registry = Registry(enabled=True)
+    requests = Counter("http_requests", "Requests served", ["method", "status"], registry=registry)
+    in_flight = Gauge("http_in_flight", "Requests in flight", registry=registry)
+    latency = Histogram("latency_seconds", "Request latency", buckets=(0.1, 1.0), registry=registry)
+
+    requests.labels("GET", 200).inc()
+    requests.labels(method="GET", status="200").inc(2)
+    in_flight.set(3)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+    assert "# HELP http_requests Requests served\n# TYPE http_requests counter\n" in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert samples(registry) == [
+        'http_requests_total{method="GET",status="200"} 3.0',
+        "http_in_flight 3",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = Registry(enabled=True)
+    Counter("errors", "Errors", ["message"], registry=registry).labels('bad "quote"\\\n').inc()
+    assert samples(registry) == ['errors_total{message="bad \\"quote\\"\\\\\\n"} 1.0']
+
+
+def test_callback_metrics_read_at_scrape_time():
+    registry = Registry(enabled=True)
+    state = {"hits": 1}
+    CallbackMetric("cache_lookups", "Lookups", "counter", lambda: {("hit",): state["hits"], ("miss",): None},
+                   ["outcome"], registry=registry)
+    CallbackMetric("ready", "Ready", "gauge", lambda: None, registry=registry)
+    state["hits"] = 4
+    assert samples(registry) == ['cache_lookups_total{outcome="hit"} 4']
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry(enabled=False)
+    counter = Counter("requests", "Requests", registry=registry)
+    counter.inc()
+    with Histogram("latency", "Latency", registry=registry).time():
+        pass
+    assert samples(registry) == []
+
+
+def test_duplicate_names_are_rejected():
+    registry = Registry()
+    Gauge("depth", "Queue depth", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("depth", "Queue depth", registry=registry)
+    registry.unregister("depth")
+    Gauge("depth", "Queue depth", registry=registry)
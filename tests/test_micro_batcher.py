@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from micro_batcher import MicroBatcher
+
+
+@pytest.fixture
+def batcher(make_detector):
+    batcher = MicroBatcher(make_detector(), max_batch_size=4, max_wait_ms=50)
+    yield batcher
+    batcher.stop()
+
+
+def test_queued_requests_are_coalesced_up_to_max_batch_size(batcher, grey_image):
+    # Submitted before the worker starts, so the whole queue is waiting when it takes the first batch
+    futures = [batcher.submit(grey_image(value)) for value in (0, 50, 100, 150, 255)]
+    batcher.start()
+    results = [future.result(timeout=10) for future in futures]
+
+    assert [shape[0] for shape in batcher.detector.model.batch_shapes] == [4, 1]
+    assert results[0]["predicted_class"] == "drawings"
+    assert results[-1]["scores"]["porn"] > results[0]["scores"]["porn"]
+    stats = batcher.stats()
+    assert stats["requests"] == 5
+    assert stats["batches"] == 2
+    assert stats["batch_size_histogram"] == {"1": 1, "4": 1}
+
+
+def test_results_match_direct_prediction(batcher, grey_image):
+    batcher.start()
+    paths = [grey_image(value) for value in range(0, 256, 32)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(batcher.predict, paths))
+
+    for path, result in zip(paths, results):
+        assert result["scores"] == pytest.approx(batcher.detector.predict(path)["scores"], abs=1e-6)
+    assert batcher.stats()["requests"] == len(paths)
+
+
+def test_decode_errors_fail_only_their_own_request(batcher, grey_image, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    batcher.start()
+    bad = batcher.submit(str(broken))
+    good = batcher.submit(grey_image(0))
+
+    with pytest.raises(Exception):
+        bad.result(timeout=10)
+    assert good.result(timeout=10)["predicted_class"] == "drawings"
+    # The undecodable file never reached the queue
+    assert batcher.stats()["requests"] == 1
+
+
+def test_model_errors_fail_the_whole_batch(batcher, grey_image, monkeypatch):
+    def broken(batch):
+        raise RuntimeError("model exploded")
+    monkeypatch.setattr(batcher.detector, "run_model", broken)
+    futures = [batcher.submit(grey_image(value)) for value in (0, 255)]
+    batcher.start()
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model exploded"):
+            future.result(timeout=10)
+    assert batcher.stats()["errors"] == 2
@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+from PIL import Image
+
+from phash_index import BKTree, PerceptualIndex, hamming_distance
+
+
+def test_bktree_search_matches_brute_force():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for item, value in enumerate(values):
+        tree.add(value, item)
+    assert len(tree) == len(values)
+
+    for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for max_distance in (0, 8, 24):
+            expected = sorted(
+                (hamming_distance(query, value), item)
+                for item, value in enumerate(values)
+                if hamming_distance(query, value) <= max_distance
+            )
+            assert sorted(tree.search(query, max_distance)) == expected
+
+
+def test_bktree_results_are_nearest_first():
+    tree = BKTree()
+    tree.add(0b1111, "far")
+    tree.add(0b0001, "near")
+    tree.add(0b0000, "exact")
+    assert [item for _, item in tree.search(0, 4)] == ["exact", "near", "far"]
+
+
+def blobs(width, height, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((width, height), Image.BILINEAR)
+
+
+def test_perceptual_index_finds_resized_copies():
+    index = PerceptualIndex(threshold=6)
+    original = blobs(320, 240)
+    index.add(index.compute_hash(original), np.arange(5, dtype=np.float32))
+
+    resized = original.resize((160, 120))
+    np.testing.assert_array_equal(index.lookup(index.compute_hash(resized)), np.arange(5, dtype=np.float32))
+    assert index.lookup(index.compute_hash(blobs(320, 240, seed=1))) is None
+    assert index.stats()["hits"] == 1
+    assert index.stats()["misses"] == 1
+
+
+def test_perceptual_index_round_trips(tmp_path):
+    index = PerceptualIndex(threshold=4, method="dhash")
+    index.add(0x0123456789ABCDEF, [0.1, 0.2, 0.3, 0.2, 0.2])
+    index.add(0x0123456789ABCDEF, [0.9, 0.0, 0.1, 0.0, 0.0])  # exact duplicates are ignored
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+
+    loaded = PerceptualIndex.load(path)
+    assert len(loaded) == 1
+    assert (loaded.threshold, loaded.method) == (4, "dhash")
+    np.testing.assert_allclose(loaded.lookup(0x0123456789ABCDEF ^ 0b111), [0.1, 0.2, 0.3, 0.2, 0.2])
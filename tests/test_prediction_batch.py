@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from prediction_batch import PredictionBatch, format_prediction, iter_prediction_batches
+
+SCORES = np.array([
+    [0.7, 0.1, 0.1, 0.05, 0.05],   # drawings
+    [0.1, 0.1, 0.2, 0.5, 0.1],     # porn
+    [0.1, 0.2, 0.45, 0.05, 0.2],   # neutral, but an NSFW score of 0.45
+], dtype=np.float32)
+
+
+def make_batch():
+    scores = np.vstack([SCORES, np.full((1, 5), np.nan, dtype=np.float32)])
+    errors = np.array([None, None, None, "cannot identify image file"], dtype=object)
+    return PredictionBatch(scores, ["a.jpg", "b.jpg", "c.jpg", "d.jpg"], errors)
+
+
+def test_rows_match_the_per_image_dicts():
+    batch = make_batch()
+    for index in range(3):
+        expected = format_prediction(SCORES[index])
+        expected["image_path"] = batch.image_paths[index]
+        assert batch[index] == expected
+    assert batch[3] == {"image_path": "d.jpg", "error": "cannot identify image file"}
+    assert batch.to_dicts() == list(batch)
+
+
+def test_columns():
+    batch = make_batch()
+    assert batch.predicted_class().tolist() == ["drawings", "porn", "neutral", None]
+    assert batch.is_nsfw().tolist() == [False, True, False, False]
+    assert batch.is_nsfw(threshold=0.4).tolist() == [False, True, True, False]
+    np.testing.assert_allclose(batch.nsfw_score()[:3], [0.2, 0.7, 0.45], rtol=1e-6)
+    assert batch.valid.tolist() == [True, True, True, False]
+
+
+def test_slices_and_concat():
+    batch = make_batch()
+    joined = PredictionBatch.concat([batch[:2], batch[2:]])
+    assert joined.image_paths == batch.image_paths
+    assert joined.to_dicts() == batch.to_dicts()
+    assert len(PredictionBatch.concat([])) == 0
+
+
+def test_lengths_must_agree():
+    with pytest.raises(ValueError):
+        PredictionBatch(SCORES, ["a.jpg"])
+
+
+def test_rows_are_chunked():
+    rows = [(f"{i}.jpg", SCORES[i % 3], None) for i in range(5)] + [("bad.jpg", None, ValueError("broken"))]
+    batches = list(iter_prediction_batches(rows, chunk_size=4))
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert batches[1][1] == {"image_path": "bad.jpg", "error": "broken"}
+    assert batches[1][0]["predicted_class"] == "porn"
+
+
+def test_arrow_nulls_failed_rows():
+    pytest.importorskip("pyarrow")
+    table = make_batch().to_arrow()
+    assert table.column("image_path").to_pylist() == ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    assert table.column("is_nsfw").to_pylist() == [False, True, False, None]
+    assert table.column("error").to_pylist() == [None, None, None, "cannot identify image file"]
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from queue_worker import QueueWorker, SQLiteQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "jobs.db"), max_attempts=2, retry_delay=0)
+    yield queue
+    queue.close()
+
+
+def test_enqueue_skips_known_refs(queue):
+    assert queue.enqueue(["a", "b", "a"]) == 2
+    assert queue.enqueue(["b", "c"]) == 1
+    assert queue.counts()["pending"] == 3
+
+
+def test_leased_jobs_are_not_handed_out_twice(queue):
+    queue.enqueue(["a", "b", "c"])
+    first = queue.lease("w1", 2)
+    second = queue.lease("w2", 2)
+    assert [job.image_ref for job in first] == ["a", "b"]
+    assert [job.image_ref for job in second] == ["c"]
+    assert all(job.attempts == 1 for job in first + second)
+    assert queue.lease("w3", 2) == []
+
+
+def test_failures_retry_then_go_to_dead_letters(queue):
+    queue.enqueue(["bad"])
+    job, = queue.lease("w1", 1)
+    assert queue.fail("w1", [(job, "decode error")]) == 0
+    assert queue.counts()["pending"] == 1
+
+    job, = queue.lease("w1", 1)
+    assert job.attempts == 2
+    assert queue.fail("w1", [(job, "decode error")]) == 1
+    assert queue.counts()["dead"] == 1
+    assert queue.dead_letters() == [{"id": job.id, "image_ref": "bad", "attempts": 2, "error": "decode error"}]
+
+    assert queue.requeue_dead() == 1
+    assert [job.attempts for job in queue.lease("w1", 1)] == [1]
+
+
+def test_retries_back_off(tmp_path):
+    queue = SQLiteQueue(str(tmp_path / "jobs.db"), max_attempts=3, retry_delay=60)
+    queue.enqueue(["slow"])
+    job, = queue.lease("w1", 1)
+    queue.fail("w1", [(job, "timeout")])
+    assert queue.lease("w1", 1) == []
+    queue.close()
+
+
+def test_expired_lease_moves_to_another_worker(queue):
+    queue.enqueue(["a"])
+    stale, = queue.lease("w1", 1, lease_seconds=0)
+    job, = queue.lease("w2", 1)
+    assert job.id == stale.id
+
+    queue.ack("w1", [stale])  # the old worker no longer owns the job
+    assert queue.counts()["leased"] == 1
+    queue.ack("w2", [job])
+    assert queue.counts()["done"] == 1
+
+
+def test_lease_that_keeps_expiring_is_dead_lettered(queue):
+    queue.enqueue(["crasher"])
+    queue.lease("w1", 1, lease_seconds=0)
+    queue.lease("w2", 1, lease_seconds=0)
+    assert queue.lease("w3", 1) == []
+    assert queue.counts()["dead"] == 1
+
+
+class FakeDetector:
+    batch_size = 4
+
+    def iter_predict(self, image_refs, batch_size=None):
+        for image_ref in image_refs:
+            if image_ref.startswith("bad"):
+                yield {"image_path": image_ref, "error": "cannot identify image file"}
+            else:
+                yield {"image_path": image_ref, "predicted_class": "neutral"}
+
+
+class ListSink:
+    def __init__(self):
+        self.rows = []
+        self.flushed = 0
+        self._lock = threading.Lock()
+
+    def write(self, result):
+        with self._lock:
+            self.rows.append(result["image_path"])
+
+    def flush(self):
+        self.flushed += 1
+
+
+def test_worker_drains_the_queue(queue):
+    queue.enqueue([f"img{i}" for i in range(10)] + ["bad1"])
+    sink = ListSink()
+    worker = QueueWorker(FakeDetector(), queue, sink, worker_id="w1", heartbeat_interval=0)
+    stats = worker.run(stop_when_empty=True)
+
+    assert sorted(sink.rows) == sorted(f"img{i}" for i in range(10))
+    assert sink.flushed >= 1
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 10, "dead": 1}
+    assert (stats["done"], stats["failed"], stats["dead"]) == (10, 2, 1)
+    assert queue.workers()[0]["done"] == 10
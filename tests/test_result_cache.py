@@ -0,0 +1,62 @@
+import sqlite3
+
+import numpy as np
+
+from result_cache import ResultCache
+
+
+def scores(value):
+    return np.full(5, value, dtype=np.float32)
+
+
+def test_memory_tier_is_a_bounded_lru():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", scores(0.1))
+    cache.put("b", scores(0.2))
+    assert cache.get("a") is not None  # "a" becomes the most recently used
+    cache.put("c", scores(0.3))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ResultCache(db_path=db_path)
+    cache.put("a", scores(0.5))
+    cache.close()
+
+    reopened = ResultCache(db_path=db_path)
+    np.testing.assert_array_equal(reopened.get("a"), scores(0.5))
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get("a") is not None
+    assert reopened.stats()["memory_hits"] == 1
+
+
+def test_put_many_writes_every_row(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ResultCache(max_entries=1, db_path=db_path)
+    cache.put_many([(f"key{i}", scores(i / 10)) for i in range(5)])
+    cache.put_many([])
+
+    with sqlite3.connect(db_path) as db:
+        assert db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 5
+    np.testing.assert_array_equal(cache.get("key2"), scores(0.2))
+
+
+def test_keys_are_scoped():
+    data = b"image bytes"
+    assert ResultCache.make_key(data, "model-a") != ResultCache.make_key(data, "model-b")
+    assert ResultCache.make_key(data, "model-a") == ResultCache.make_key(data, "model-a")
+
+
+def test_clear_empties_both_tiers(tmp_path):
+    cache = ResultCache(db_path=str(tmp_path / "cache.db"))
+    cache.put("a", scores(0.5))
+    cache.clear()
+    assert cache.get("a") is None
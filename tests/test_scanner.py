@@ -0,0 +1,80 @@
+import json
+import os
+
+from PIL import Image
+
+from scanner import ScanCheckpoint, scan
+
+
+class FakeDetector:
+    # scan() only needs iter_predict; no model is loaded
+    def __init__(self):
+        self.seen = []
+
+    def iter_predict(self, image_paths, batch_size=None, num_workers=None):
+        for image_path in image_paths:
+            self.seen.append(image_path)
+            yield {
+                "image_path": image_path,
+                "is_nsfw": False,
+                "predicted_class": "neutral",
+                "confidence": 0.9,
+                "scores": {"drawings": 0.05, "hentai": 0.0, "neutral": 0.9, "porn": 0.0, "sexy": 0.05},
+            }
+
+
+def make_tree(root):
+    paths = []
+    for directory in ("a", "b", os.path.join("b", "c")):
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        for name in ("1.png", "2.jpg", "skip.txt"):
+            path = os.path.join(root, directory, name)
+            if name.endswith(".txt"):
+                open(path, "w").close()
+            else:
+                Image.new("RGB", (8, 8)).save(path)
+                paths.append(path)
+    return paths
+
+
+def read_paths(output):
+    with open(output, encoding="utf-8") as f:
+        return [json.loads(line)["image_path"] for line in f]
+
+
+def test_checkpoint_round_trips_extra_fields(tmp_path):
+    path = str(tmp_path / "scan.ckpt")
+    ScanCheckpoint(path).save("a/1.png", 3, embedding_rows=2)
+
+    state = ScanCheckpoint(path)
+    assert (state.last_path, state.completed, state.extra) == ("a/1.png", 3, {"embedding_rows": 2})
+
+
+def test_interrupted_scan_resumes_after_the_last_result(tmp_path):
+    root = str(tmp_path / "images")
+    expected = make_tree(root)
+    output = str(tmp_path / "results.jsonl")
+    checkpoint = str(tmp_path / "scan.ckpt")
+
+    results = scan(FakeDetector(), root, output=output, checkpoint=checkpoint, checkpoint_every=2)
+    for _ in range(3):
+        next(results)
+    results.close()  # as if the consumer were interrupted
+
+    state = ScanCheckpoint(checkpoint)
+    assert state.completed == 3
+    assert state.last_path == os.path.relpath(expected[2], root)
+
+    detector = FakeDetector()
+    assert len(list(scan(detector, root, output=output, checkpoint=checkpoint))) == len(expected) - 3
+    assert detector.seen == expected[3:]
+    assert read_paths(output) == expected
+    assert ScanCheckpoint(checkpoint).completed == len(expected)
+
+
+def test_finished_scan_has_nothing_left(tmp_path):
+    root = str(tmp_path / "images")
+    make_tree(root)
+    checkpoint = str(tmp_path / "scan.ckpt")
+    list(scan(FakeDetector(), root, checkpoint=checkpoint))
+    assert list(scan(FakeDetector(), root, checkpoint=checkpoint)) == []
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from nsfw_detector import NSFWDetector
+from server_common import ModelService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_does_not_load_numpy_pil_or_tensorflow():
+    code = ("import sys, nsfw_detector, api_server; "
+            "print(sorted(m for m in ('numpy', 'PIL.Image', 'tensorflow') if m in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_warmup_batches_are_height_by_width(make_detector):
+    # input_size is (width, height); the model takes NHWC batches
+    detector = make_detector(input_size=(320, 240), backend_options={"input_shape": (240, 320)})
+    detector.warmup(batch_sizes=(1, 4))
+
+    assert detector.model.batch_shapes == [(1, 240, 320, 3), (4, 240, 320, 3)]
+
+
+def test_input_size_must_match_the_model(make_detector):
+    with pytest.raises(ValueError, match="takes 224x224 inputs"):
+        make_detector(input_size=(320, 240))
+
+
+@pytest.mark.usefixtures("make_detector")
+def test_service_reports_loading_until_warm(tmp_path, monkeypatch):
+    service = ModelService(str(tmp_path), backend="stub")
+    assert service.health()[1] == 503
+
+    release = threading.Event()
+    warmup = NSFWDetector.warmup
+
+    def slow_warmup(self, batch_sizes=(1,)):
+        release.wait(10)
+        warmup(self, batch_sizes)
+    monkeypatch.setattr(NSFWDetector, "warmup", slow_warmup)
+
+    loader = service.start_loading()
+    payload, status_code = service.health()
+    assert (payload["status"], status_code) == ("loading", 503)
+
+    release.set()
+    loader.join()
+    try:
+        assert service.health() == ({"status": "healthy", "model_status": "ready", "message": "API is running"}, 200)
+    finally:
+        service.batcher.stop()
+
+
+def test_missing_model_is_reported(tmp_path):
+    service = ModelService(str(tmp_path / "missing"), backend="stub")
+    service.start_loading().join()
+
+    payload, status_code = service.health()
+    assert (payload["status"], status_code) == ("error", 503)
+    assert "not found" in payload["message"]
@@ -0,0 +1,113 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+from starlette.testclient import TestClient
+
+import api_server
+import async_api_server
+from server_common import DownloadTooLarge, MultipartFileStream
+
+BOUNDARY = "test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def png(value):
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), (value, value, value)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def multipart(files, field="files"):
+    body = b""
+    for filename, data in files:
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: application/octet-stream\r\n\r\n").encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def make_parser(**limits):
+    return MultipartFileStream(BOUNDARY.encode(), **limits)
+
+
+def feed_in_chunks(parser, body, size=7):
+    parts = []
+    for start in range(0, len(body), size):
+        parts.extend(parser.feed(body[start:start + size]))
+    return parts + parser.feed(None)
+
+
+def test_parser_yields_each_file_as_it_completes():
+    files = [("a.png", png(0)), ("b.png", png(255))]
+
+    parts = feed_in_chunks(make_parser(), multipart(files))
+
+    assert parts == [(filename, data, None) for filename, data in files]
+
+
+def test_parser_limits():
+    parts = feed_in_chunks(make_parser(max_file_bytes=100000), multipart([("a.png", b"x" * 300000)]), 65536)
+    assert parts[0][1] is None and "too large" in parts[0][2]
+
+    with pytest.raises(ValueError, match="Too many files"):
+        feed_in_chunks(make_parser(max_files=1), multipart([("a.png", b"x"), ("b.png", b"y")]))
+
+    # The total is counted as bytes arrive, whatever the request headers said
+    with pytest.raises(DownloadTooLarge):
+        feed_in_chunks(make_parser(max_total_bytes=1000), multipart([("a.png", b"x" * 2000)]), 100)
+
+
+def read_lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.fixture(params=["flask", "async"])
+def client(request):
+    return request.getfixturevalue(f"{request.param}_client")
+
+
+def post_body(client, path, body, **headers):
+    headers["Content-Type"] = CONTENT_TYPE
+    if isinstance(client, TestClient):
+        return client.post(path, headers=headers, content=body)
+    return client.post(path, headers=headers, data=body)
+
+
+def test_streamed_results_come_back_in_upload_order(client):
+    body = multipart([("a.png", png(0)), ("b.txt", b"text"), ("c.png", png(255)), ("d.jpg", b"broken")])
+
+    response = post_body(client, "/predict_batch?stream=1", body)
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = read_lines(response)
+    assert [line.get("filename") for line in lines[:-1]] == ["a.png", "b.txt", "c.png", "d.jpg"]
+    assert [line["index"] for line in lines[:-1]] == [0, 1, 2, 3]
+    assert lines[0]["result"]["predicted_class"] == "drawings"
+    assert lines[1]["error"] == "Invalid file"
+    assert "error" in lines[3]
+    assert lines[-1] == {"success": True, "total_files": 4}
+
+
+def test_accept_header_selects_streaming(flask_client):
+    response = post_body(flask_client, "/predict_batch", multipart([("a.png", png(0))]), Accept="application/x-ndjson")
+    assert read_lines(response)[-1] == {"success": True, "total_files": 1}
+
+
+def test_declared_length_over_the_stream_cap_is_413(flask_client, async_client, monkeypatch):
+    monkeypatch.setattr(api_server, "MAX_STREAM_BYTES", 1000)
+    monkeypatch.setattr(async_api_server, "MAX_STREAM_BYTES", 1000)
+    body = multipart([("a.png", b"x" * 2000)])
+
+    assert post_body(flask_client, "/predict_batch?stream=1", body).status_code == 413
+    assert post_body(async_client, "/predict_batch?stream=1", body).status_code == 413
+
+
+def test_async_form_endpoints_count_chunked_bodies(async_client):
+    # No Content-Length: the body is sent chunked and counted as it arrives
+    body = multipart([("big.png", b"x" * (17 * 1024 * 1024))], field="file")
+    chunks = (body[start:start + 65536] for start in range(0, len(body), 65536))
+
+    response = post_body(async_client, "/predict", chunks)
+
+    assert response.status_code == 413
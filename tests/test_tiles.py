@@ -0,0 +1,87 @@
+import pytest
+from PIL import Image
+
+from tiles import load_tiling_image, scale_box, tile_boxes
+
+
+@pytest.fixture
+def corner_image(tmp_path):
+    # A small white region in the top-left corner of a black 896x896 field
+    image = Image.new("RGB", (896, 896))
+    image.paste((255, 255, 255), (0, 0, 256, 256))
+    path = tmp_path / "corner.png"
+    image.save(path)
+    return str(path)
+
+
+def test_grid_tiles_overlap_and_reach_the_edges():
+    boxes = tile_boxes((0, 0, 896, 896), grid=2, overlap=0.25)
+
+    assert boxes == [(0, 0, 512, 512), (384, 0, 896, 512), (0, 384, 512, 896), (384, 384, 896, 896)]
+
+
+def test_tall_regions_get_more_rows_of_square_tiles():
+    boxes = tile_boxes((0, 0, 400, 1600), grid=2, overlap=0.0)
+
+    assert all(right - left == bottom - top == 200 for left, top, right, bottom in boxes)
+    assert len({box[0] for box in boxes}) == 2
+    assert len({box[1] for box in boxes}) == 8
+
+
+def test_window_and_explicit_grid():
+    assert tile_boxes((0, 0, 1000, 500), window=500, overlap=0.0) == [(0, 0, 500, 500), (500, 0, 1000, 500)]
+    assert tile_boxes((100, 100, 400, 300), grid=(1, 3), overlap=0.0) == [
+        (100, 100, 200, 300), (200, 100, 300, 300), (300, 100, 400, 300),
+    ]
+
+
+def test_tiles_below_min_size_are_dropped():
+    assert tile_boxes((0, 0, 300, 300), grid=2, min_size=224) == []
+    with pytest.raises(ValueError, match="overlap"):
+        tile_boxes((0, 0, 300, 300), overlap=1.0)
+
+
+def test_large_images_are_downscaled_and_boxes_scaled_back(tmp_path):
+    path = tmp_path / "large.jpg"
+    Image.new("RGB", (4000, 2000)).save(path)
+
+    image, original_size = load_tiling_image(str(path), max_resolution=1000)
+
+    assert original_size == (4000, 2000)
+    assert image.size == (1000, 500)
+    assert scale_box((0, 0, 500, 250), 4.0, 4.0) == [0, 0, 2000, 1000]
+
+
+def test_refinement_finds_a_small_region(make_detector, corner_image):
+    result = make_detector().predict_tiled(corner_image)
+
+    assert result["global_nsfw_score"] < 0.2
+    assert result["nsfw_score"] > 0.5
+    worst = result["worst_tile"]
+    assert worst["depth"] == 2
+    assert worst["box"][:2] == [0, 0] and worst["box"][2] <= 300
+    # Only the suspicious top-left tile was split further
+    assert sum(tile["depth"] == 2 for tile in result["tiles"]) == 4
+
+
+def test_without_refinement_only_the_first_grid_is_scored(make_detector, corner_image):
+    detector = make_detector()
+
+    result = detector.predict_tiled(corner_image, refine=False)
+
+    assert [tile["depth"] for tile in result["tiles"]] == [0, 1, 1, 1, 1]
+    assert detector.model.batch_shapes == [(5, 224, 224, 3)]
+    assert result["worst_tile"]["box"] == [0, 0, 512, 512]
+
+
+def test_max_tiles_caps_the_work(make_detector, corner_image):
+    result = make_detector().predict_tiled(corner_image, max_tiles=6)
+
+    assert len(result["tiles"]) == 6
+
+
+def test_boxes_are_reported_in_original_coordinates(make_detector, corner_image):
+    result = make_detector().predict_tiled(corner_image, refine=False, max_resolution=448)
+
+    assert result["image_size"] == [896, 896]
+    assert result["tiles"][0]["box"] == [0, 0, 896, 896]
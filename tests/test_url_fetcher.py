@@ -0,0 +1,74 @@
+import json
+import time
+from concurrent.futures import Future
+
+from url_fetcher import iter_classify_urls, iter_url_predictions, shared_fetch_loop
+
+
+def byte_count(data):
+    future = Future()
+    future.set_result(len(data))
+    return future
+
+
+def test_results_and_errors_per_url(image_server):
+    urls = [image_server.url("grey/0.png"), image_server.url("missing.png"), image_server.url("page.html"),
+            image_server.url("large.jpg"), "ftp://example.com/a.png"]
+
+    results = {index: (prediction, error) for index, url, prediction, error in iter_url_predictions(byte_count, urls)}
+
+    assert sorted(results) == list(range(len(urls)))
+    assert results[0][0] > 0 and results[0][1] is None
+    assert "404" in str(results[1][1])
+    assert "image" in str(results[2][1])
+    assert "too large" in str(results[3][1])
+    assert "Unsupported URL" in str(results[4][1])
+
+
+def test_connections_per_host_are_limited(image_server):
+    urls = [image_server.url(f"slow/{value}.png") for value in range(8)]
+
+    results = list(iter_url_predictions(byte_count, urls, max_per_host=2))
+
+    assert all(error is None for *_, error in results)
+    assert image_server.max_active <= 2
+
+
+def test_stopping_early_cancels_the_remaining_downloads(image_server):
+    urls = [image_server.url(f"slow/{value}.png") for value in range(40)]
+    predictions = iter_url_predictions(byte_count, urls, max_per_host=1)
+    next(predictions)
+    predictions.close()
+
+    fetcher = shared_fetch_loop(max_per_host=1).fetcher
+    deadline = time.monotonic() + 5
+    while fetcher._host_limits and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not fetcher._host_limits
+
+
+def test_classify_urls(make_detector, image_server):
+    urls = [image_server.url("grey/0.png"), image_server.url("missing.png")]
+
+    results = sorted(iter_classify_urls(make_detector(), urls), key=lambda result: result["index"])
+
+    assert results[0]["url"] == urls[0]
+    assert results[0]["predicted_class"] == "drawings"
+    assert "error" in results[1]
+
+
+def test_predict_urls_streams_ndjson_in_both_servers(flask_client, async_client, image_server):
+    urls = [image_server.url("grey/0.png"), image_server.url("missing.png"), image_server.url("grey/255.png")]
+
+    for response in (flask_client.post("/predict_urls", json={"urls": urls}),
+                     async_client.post("/predict_urls", json={"urls": urls})):
+        assert response.status_code == 200
+        lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+        assert [line["url"] for line in lines] == urls
+        assert lines[0]["result"]["predicted_class"] == "drawings"
+        assert "error" in lines[1]
+
+
+def test_predict_urls_validates_the_list(flask_client):
+    assert flask_client.post("/predict_urls", json={"urls": "http://example.com/a.png"}).status_code == 400
+    assert flask_client.post("/predict_urls", json={}).status_code == 400
@@ -0,0 +1,87 @@
+import math
+from collections import namedtuple
+
+from decode_guard import decoded_bytes
+from lazy_import import lazy_import
+
+Image = lazy_import("PIL.Image")
+
+Tile = namedtuple("Tile", ["box", "depth"])
+
+
+def _axis_starts(length, size, count=None, overlap=0.25):
+    if size >= length:
+        return [0.0]
+    if count is None:
+        count = math.ceil((length - size) / (size * (1 - overlap)) - 1e-6) + 1
+    if count <= 1:
+        return [0.0]
+    # Spread the windows evenly so the last one ends exactly on the edge
+    return [index * (length - size) / (count - 1) for index in range(count)]
+
+
+def tile_boxes(region, grid=2, window=None, overlap=0.25, min_size=0):
+    """Boxes covering region: square windows of `window` px, `grid` square tiles across the
+    shorter side, or an explicit (rows, cols) grid. Returns [] when tiles would be under min_size."""
+    if not 0 <= overlap < 1:
+        raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+    left, top, right, bottom = region
+    width, height = right - left, bottom - top
+
+    rows = cols = None
+    if window is not None:
+        tile_width, tile_height = min(window, width), min(window, height)
+    elif isinstance(grid, int):
+        # Square tiles, so a tall screenshot gets more rows instead of stretched crops
+        tile_width = tile_height = min(width, height) / (grid - (grid - 1) * overlap)
+        if width <= height:
+            cols = grid
+        else:
+            rows = grid
+    else:
+        rows, cols = grid
+        tile_width = width / (cols - (cols - 1) * overlap)
+        tile_height = height / (rows - (rows - 1) * overlap)
+
+    if min(tile_width, tile_height) < min_size:
+        return []
+
+    x_starts = _axis_starts(width, tile_width, cols, overlap)
+    y_starts = _axis_starts(height, tile_height, rows, overlap)
+    return [
+        (round(left + x), round(top + y), round(left + x + tile_width), round(top + y + tile_height))
+        for y in y_starts for x in x_starts
+    ]
+
+
+def load_tiling_image(image_input, max_resolution=4096, decode_guard=None):
+    # Returns the RGB image to crop from and the original size that boxes are reported in
+    from nsfw_detector import load_image
+
+    if decode_guard is not None:
+        # The guard drafts towards max_resolution, checks the budgets and holds the decode against memory
+        image, original_size = decode_guard.open_with_size(image_input, (max_resolution, max_resolution))
+        with decode_guard.reserve(decoded_bytes(image)):
+            return _fit_tiling_image(image, max_resolution), original_size
+
+    image = load_image(image_input)
+    original_size = image.size
+    if max(original_size) > max_resolution and not isinstance(image_input, Image.Image):
+        # JPEG can decode at 1/2, 1/4 or 1/8 scale for almost free
+        image.draft('RGB', (max_resolution, max_resolution))
+    return _fit_tiling_image(image, max_resolution), original_size
+
+
+def _fit_tiling_image(image, max_resolution):
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if max(image.size) > max_resolution:
+        scale = max_resolution / max(image.size)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))))
+    return image
+
+
+def scale_box(box, scale_x, scale_y):
+    left, top, right, bottom = box
+    return [round(left * scale_x), round(top * scale_y), round(right * scale_x), round(bottom * scale_y)]
@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import logging
+import os
+import queue
+import threading
+from collections import Counter
+from urllib.parse import urlsplit
+
+import httpx
+
+from server_common import DOWNLOAD_TIMEOUT, MAX_DOWNLOAD_BYTES, CappedBuffer, check_image_response, timed_download
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 4
+MAX_CONCURRENT_FETCHES = 64
+
+
+class URLFetcher:
+    def __init__(self, client=None, max_connections=MAX_CONNECTIONS, max_per_host=MAX_CONNECTIONS_PER_HOST,
+                 timeout=DOWNLOAD_TIMEOUT, max_bytes=MAX_DOWNLOAD_BYTES):
+        self._owns_client = client is None
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=max_connections),
+            follow_redirects=True
+        )
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        # One semaphore per host with fetches queued or in flight; dropped when its last user leaves
+        self._host_limits = {}
+        self._host_users = Counter()
+
+    @contextlib.asynccontextmanager
+    async def _host_slot(self, host):
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        self._host_users[host] += 1
+        try:
+            async with limit:
+                yield
+        finally:
+            self._host_users[host] -= 1
+            if not self._host_users[host]:
+                del self._host_users[host]
+                del self._host_limits[host]
+
+    async def fetch(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            raise ValueError(f"Unsupported URL: {url}")
+
+        async with self._host_slot(parts.netloc.lower()):
+            # httpx timeouts apply per read; this bounds the whole download
+            with timed_download():
+                return await asyncio.wait_for(self._download(url), self.timeout)
+
+    async def _download(self, url):
+        async with self.client.stream("GET", url) as response:
+            response.raise_for_status()
+            check_image_response(response.headers.get('content-type', ''), response.headers.get('content-length'), self.max_bytes)
+
+            buffer = CappedBuffer(self.max_bytes)
+            async for chunk in response.aiter_bytes():
+                buffer.append(chunk)
+            return buffer.getvalue()
+
+    async def aclose(self):
+        if self._owns_client:
+            await self.client.aclose()
+
+
+async def aiter_url_predictions(submit, urls, fetcher, max_concurrency=MAX_CONCURRENT_FETCHES):
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Queue()
+    slots = asyncio.Semaphore(max_concurrency)
+
+    async def process(index, url):
+        async with slots:
+            try:
+                image_data = await fetcher.fetch(url)
+                # submit() decodes the image, so keep it off the event loop
+                future = await loop.run_in_executor(None, submit, image_data)
+                finished.put_nowait((index, url, await asyncio.wrap_future(future), None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error classifying {url}: {e}")
+                finished.put_nowait((index, url, None, e))
+
+    tasks = [asyncio.ensure_future(process(index, url)) for index, url in enumerate(urls)]
+    try:
+        for _ in tasks:
+            yield await finished.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class FetchLoop:
+    """Event loop thread that owns a URLFetcher, so synchronous callers share its connection pool and
+    per-host limits instead of opening a client per request."""
+
+    def __init__(self, **fetch_options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="url-fetcher", daemon=True)
+        self.thread.start()
+        self.fetcher = self.run(self._create_fetcher(fetch_options)).result()
+
+    @staticmethod
+    async def _create_fetcher(fetch_options):
+        return URLFetcher(**fetch_options)
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        self.run(self.fetcher.aclose()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+_fetch_loops = {}
+_fetch_loops_pid = None
+_fetch_loops_lock = threading.Lock()
+
+
+def shared_fetch_loop(**fetch_options):
+    global _fetch_loops_pid
+    key = tuple(sorted(fetch_options.items()))
+    with _fetch_loops_lock:
+        if _fetch_loops_pid != os.getpid():
+            # Loop threads do not survive a fork; each gunicorn worker starts its own
+            _fetch_loops.clear()
+            _fetch_loops_pid = os.getpid()
+        fetch_loop = _fetch_loops.get(key)
+        if fetch_loop is None:
+            fetch_loop = _fetch_loops[key] = FetchLoop(**fetch_options)
+        return fetch_loop
+
+
+def iter_url_predictions(submit, urls, max_concurrency=MAX_CONCURRENT_FETCHES, **fetch_options):
+    fetch_loop = shared_fetch_loop(**fetch_options)
+    results = queue.Queue()
+    done = object()
+
+    async def run():
+        predictions = aiter_url_predictions(submit, urls, fetch_loop.fetcher, max_concurrency)
+        try:
+            async for item in predictions:
+                results.put(item)
+        finally:
+            await predictions.aclose()
+
+    def finished(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"URL fetch loop failed: {future.exception()}")
+        results.put(done)
+
+    future = fetch_loop.run(run())
+    future.add_done_callback(finished)
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        # Stops the remaining downloads when the caller (e.g. a disconnected client) stops reading
+        future.cancel()
+
+
+def iter_classify_urls(detector, urls, max_batch_size=None, **options):
+    from micro_batcher import MicroBatcher
+
+    batcher = MicroBatcher(detector, max_batch_size=max_batch_size or detector.batch_size)
+    batcher.start()
+    try:
+        for index, url, prediction, error in iter_url_predictions(batcher.submit, urls, **options):
+            if error is not None:
+                yield {"index": index, "url": url, "error": str(error)}
+            else:
+                yield dict(prediction, index=index, url=url)
+    finally:
+        batcher.stop()